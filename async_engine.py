@@ -0,0 +1,192 @@
+"""asyncio章节下载引擎：一个事件循环加有界信号量，可同时维持数百个在途请求"""
+import asyncio
+import json
+import time
+from collections import deque
+
+import http_client
+from host_control import classify_status, parse_retry_after
+from retry_policy import MAX_ATTEMPTS, LatencyTracker, backoff_delay, hedge_capacity
+
+# 异步引擎允许的最大在途请求数
+MAX_CONCURRENCY = 512
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise Exception("异步引擎需要安装aiohttp：pip install aiohttp")
+    return aiohttp
+
+
+async def _request(session, endpoint, item_id, parse, tracker, latencies, sent=None):
+    """向一个地址发出一次章节请求，成功返回结果，失败返回None；被取消时继续抛出
+
+    sent为asyncio.Event时在请求真正发出（通过主机控制器）时设置。
+    """
+    # 按主机的AIMD控制器决定何时发出请求
+    controller = endpoint.controller
+    started = await controller.acquire_async()
+    if sent:
+        sent.set()
+    if tracker:
+        tracker.started()
+    outcome, retry_after = 'error', None
+    try:
+        async with session.get(endpoint.request_url({'item_id': item_id})) as response:
+            outcome = classify_status(response.status)
+            if outcome != 'ok':
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            response.raise_for_status()
+            body = await response.read()
+        outcome = 'error'
+        result = parse(json.loads(body))
+        if result:
+            result["bytes"] = len(body)
+            outcome = 'ok'
+            latencies.add(time.time() - started)
+        else:
+            outcome = 'bad_code'
+        return result
+    except asyncio.CancelledError:
+        # 对冲请求中较慢的一个被取消，不计入主机统计
+        outcome = 'cancelled'
+        raise
+    except asyncio.TimeoutError:
+        outcome = 'timeout'
+        print(f"下载章节 {item_id} 失败: 请求超时")
+        return None
+    except Exception as e:
+        print(f"下载章节 {item_id} 失败: {str(e) or type(e).__name__}")
+        return None
+    finally:
+        controller.release(started, outcome, retry_after)
+        if tracker:
+            tracker.ended()
+
+
+async def _fetch_one(session, semaphore, pool, item_id, parse, tracker, slot, latencies, tried, sent=None):
+    """下载一次章节，失败时换一个本轮没试过的地址；成功返回结果，都失败返回None
+
+    tried为本轮已用过的地址，对冲请求与原请求共用；sent见_request。被取消时归还名额后继续抛出。
+    """
+    async with semaphore:
+        if slot:
+            await slot.acquire_async()
+        try:
+            endpoint = pool.choose(tried) or pool.choose()
+            while endpoint:
+                tried.append(endpoint)
+                result = await _request(session, endpoint, item_id, parse, tracker, latencies, sent)
+                pool.report(endpoint, result is not None, {'item_id': item_id})
+                if result:
+                    return result
+                endpoint = pool.choose(tried)
+            return None
+        finally:
+            if slot:
+                slot.release()
+
+
+async def _fetch_hedged(session, semaphore, hedge_semaphore, pool, item_id, parse, tracker, slot,
+                        latencies):
+    """请求耗时超过近期p95延迟时再发一个对冲请求（尽量发往另一个地址），先成功的结果生效，另一个被取消
+
+    计时从原请求真正发出时开始，在信号量、全局名额和主机控制器处排队的时间不算，
+    否则排队中的请求也会被对冲，对冲请求就成了绕过并发上限的额外并发。
+    """
+    tried = []
+    sent = asyncio.Event()
+    primary = asyncio.ensure_future(
+        _fetch_one(session, semaphore, pool, item_id, parse, tracker, slot, latencies, tried, sent)
+    )
+    pending = {primary}
+    try:
+        threshold = latencies.threshold()
+        if threshold is not None:
+            waiter = asyncio.ensure_future(sent.wait())
+            try:
+                await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            if not primary.done():
+                await asyncio.wait(pending, timeout=threshold)
+            # 对冲请求使用单独的信号量，不与普通请求排队；名额用完时不再对冲
+            if not primary.done() and not hedge_semaphore.locked():
+                pending.add(asyncio.ensure_future(
+                    _fetch_one(session, hedge_semaphore, pool, item_id, parse, tracker, slot, latencies, tried)
+                ))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result:
+                    return result
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def _fetch_chapter(session, semaphore, hedge_semaphore, pool, idx, item_id, parse, tracker,
+                         slot, latencies, max_attempts):
+    """下载一个章节，失败后按带抖动的指数退避重试，最多尝试max_attempts次"""
+    for attempt in range(1, max_attempts + 1):
+        result = await _fetch_hedged(
+            session, semaphore, hedge_semaphore, pool, item_id, parse, tracker, slot, latencies
+        )
+        if result:
+            return idx, result
+        if attempt < max_attempts:
+            await asyncio.sleep(backoff_delay(attempt))
+    return idx, None
+
+
+async def _fetch_all(jobs, concurrency, pool, parse, on_result, tracker, window_end, slot, max_attempts):
+    aiohttp = _import_aiohttp()
+    semaphore = asyncio.Semaphore(concurrency)
+    hedge_semaphore = asyncio.Semaphore(hedge_capacity(concurrency))
+    latencies = LatencyTracker()
+    connector = aiohttp.TCPConnector(
+        limit=concurrency + hedge_capacity(concurrency),
+        limit_per_host=concurrency + hedge_capacity(concurrency),
+        ttl_dns_cache=300
+    )
+    timeout = aiohttp.ClientTimeout(total=http_client.DEFAULT_TIMEOUT)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        headers=http_client.DEFAULT_HEADERS,
+        timeout=timeout
+    ) as session:
+        jobs = deque(jobs)
+        tasks = set()
+        while jobs or tasks:
+            limit = window_end() if window_end else None
+            while jobs and (not tasks or limit is None or jobs[0][0] < limit):
+                idx, item_id = jobs.popleft()
+                tasks.add(asyncio.ensure_future(_fetch_chapter(
+                    session, semaphore, hedge_semaphore, pool, idx, item_id, parse, tracker,
+                    slot, latencies, max_attempts
+                )))
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                idx, result = task.result()
+                on_result(idx, result)
+
+
+def fetch_chapters(jobs, concurrency, pool, parse, on_result, tracker=None, window_end=None, slot=None,
+                   max_attempts=MAX_ATTEMPTS):
+    """并发下载章节
+
+    jobs为按序号递增的(序号, item_id)列表，每个请求从接口池pool中选择地址，失败时换地址；
+    每个章节有最终结果时以(序号, 结果)回调on_result，结果为parse(响应JSON)的返回值并附带
+    响应字节数bytes，重试max_attempts次仍失败时为None。
+    tracker提供started()/ended()，在每个请求真正发出和结束时调用；
+    提供window_end时只提交序号小于window_end()的章节；
+    提供slot（下载任务）时每个请求都先占用一个全局并发名额。
+    """
+    concurrency = max(1, min(int(concurrency), MAX_CONCURRENCY))
+    asyncio.run(_fetch_all(jobs, concurrency, pool, parse, on_result, tracker, window_end, slot, max_attempts))
@@ -0,0 +1,259 @@
+"""下载流程基准：用本地模拟上游驱动download_and_build_epub，对比不同引擎、并发数和书籍大小
+
+用法：python benchmarks/bench_pipeline.py [--sizes 10,100,1000] [--threads 8,16,32] [--engines thread,async]
+                                         [--books 5] [--latency lognormal:0.05:0.5] [--fail-rate 0.01]
+                                         [--mirrors 3] [--max-concurrency 8] [--split volume --volumes 5]
+                                         [--compare benchmarks/results/上次的结果.json]
+
+每组（引擎、并发数、书籍大小）在单独的子进程和临时目录中运行，章节缓存、主机控制器和峰值内存互不影响；
+模拟上游也在单独的进程中运行，不与被测流程争用GIL。
+结果保存到benchmarks/results/（或--output指定的文件），用--compare与之前的结果对比。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_upstream  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+# 合成书籍的book_id：9 + 5位章节数 + 3位序号，各组之间不重复
+BOOK_ID_FORMAT = "9{size:05d}{index:03d}"
+
+
+def percentile(values, pct):
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def stage_total(stage):
+    import metrics
+
+    counts = metrics.stage_seconds.values.get((stage,))
+    return counts[-1] if counts else 0.0
+
+
+def run_mock(options, ready):
+    """子进程：运行模拟上游，直到被父进程结束"""
+    server = mock_upstream.start(mock_upstream.MockConfig(**options))
+    ready.put(server.base_url)
+    server.stopping.wait()
+
+
+def start_mocks(context, options, count):
+    """启动count个相同配置的模拟上游（每个一个进程），返回(进程列表, 地址列表)"""
+    ready = context.Queue()
+    processes = []
+    for _ in range(count):
+        process = context.Process(target=run_mock, args=(options, ready), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes, [ready.get(timeout=30) for _ in processes]
+
+
+def run_trial(base_urls, engine, threads, book_ids, client_timeout, transforms=(), split=None, output_format='epub',
+              verbose=False):
+    """子进程：在临时目录中依次下载book_ids，返回每本书的耗时等统计"""
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    workdir = tempfile.mkdtemp(prefix='fanqie-bench-')
+    os.chdir(workdir)
+    os.environ['FANQIE_CHAPTER_LIST_API'] = ','.join(f"{base_url}/all_items.php" for base_url in base_urls)
+    os.environ['FANQIE_CONTENT_API'] = ','.join(f"{base_url}/content.php" for base_url in base_urls)
+
+    import http_client
+    import metrics
+    import process_pool
+    from downloader import download_and_build_epub
+    from scheduler import Job
+
+    http_client.DEFAULT_TIMEOUT = client_timeout
+    books = []
+    for book_id in book_ids:
+        job = Job(book_id, threads, engine=engine, transforms=transforms, split=split, format=output_format)
+        build_before = stage_total('render') + stage_total('epub_write') + stage_total('txt_write')
+        started = time.perf_counter()
+        error = None
+        try:
+            download_and_build_epub(book_id, threads, engine, job=job)
+        except Exception as e:
+            error = str(e)
+        books.append({
+            'book_id': book_id,
+            'seconds': time.perf_counter() - started,
+            'build_seconds': stage_total('render') + stage_total('epub_write') + stage_total('txt_write') - build_before,
+            'chapters': job.status['total_chapters'],
+            'missing': len(job.status['missing']),
+            'error': error
+        })
+    # 请求总数包括章节列表、封面、重试和对冲请求
+    requests_sent = sum(counts[-2] for counts in metrics.request_seconds.values.values())
+    process_pool.shutdown()
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {'books': books, 'requests': requests_sent, 'peak_rss_mb': peak_rss_mb()}
+
+
+def summarize(engine, threads, size, trial):
+    books = trial['books']
+    seconds = [book['seconds'] for book in books]
+    build = [book['build_seconds'] for book in books]
+    chapters = sum(book['chapters'] for book in books)
+    return {
+        'engine': engine,
+        'threads': threads,
+        'size': size,
+        'books': len(books),
+        'chapters_per_sec': round(chapters / sum(seconds), 1) if sum(seconds) else None,
+        'book_p50': round(percentile(seconds, 50), 3),
+        'book_p99': round(percentile(seconds, 99), 3),
+        'build_p50': round(percentile(build, 50), 3),
+        'peak_rss_mb': trial['peak_rss_mb'],
+        'requests_per_chapter': round(trial['requests'] / chapters, 3) if chapters else None,
+        'missing': sum(book['missing'] for book in books),
+        'errors': [book['error'] for book in books if book['error']]
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return (result['engine'], result['threads'], result['size'])
+
+
+def print_results(results, previous=None):
+    baseline = {result_key(result): result for result in (previous or [])}
+    header = f"{'引擎':<6} {'并发':>4} {'章节数':>6} {'章/秒':>8} {'p50(秒)':>8} {'p99(秒)':>8} " \
+             f"{'构建p50':>8} {'峰值内存MB':>10} {'请求/章':>7} {'缺失':>4}"
+    print(header)
+    for result in results:
+        line = f"{result['engine']:<6} {result['threads']:>4} {result['size']:>6} " \
+               f"{result['chapters_per_sec'] or 0:>8.1f} {result['book_p50']:>8.3f} {result['book_p99']:>8.3f} " \
+               f"{result['build_p50']:>8.3f} {result['peak_rss_mb'] or 0:>10.1f} " \
+               f"{result['requests_per_chapter'] or 0:>7.3f} {result['missing']:>4}"
+        old = baseline.get(result_key(result))
+        if old and old.get('chapters_per_sec') and result['chapters_per_sec']:
+            change = (result['chapters_per_sec'] / old['chapters_per_sec'] - 1) * 100
+            line += f"  章/秒 {change:+.1f}%，p50 {old['book_p50']:.3f} -> {result['book_p50']:.3f}"
+        print(line)
+        for error in result['errors']:
+            print(f"    失败：{error}")
+
+
+def parse_list(text, cast=int):
+    return [cast(value) for value in text.split(',') if value.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载流程基准测试")
+    parser.add_argument('--sizes', default='10,100,1000', help="书籍章节数，逗号分隔（10~10000）")
+    parser.add_argument('--threads', default='8,16,32', help="单本书并发上限，逗号分隔")
+    parser.add_argument('--engines', default='thread', help="下载引擎，逗号分隔：thread、async")
+    parser.add_argument('--books', type=int, default=5, help="每组下载几本书（用于计算p50/p99）")
+    parser.add_argument('--mirrors', type=int, default=1, help="启动几个等价的模拟上游（测试多地址分流）")
+    parser.add_argument('--transforms', default='', help="正文处理步骤，逗号分隔（如normalize,strip_ads,s2t）")
+    parser.add_argument('--split', help="分册输出：volume或每册章节数")
+    parser.add_argument('--format', default='epub', help="输出格式：epub、txt或both")
+    parser.add_argument('--client-timeout', type=float, default=10.0, help="下载器的请求超时（秒）")
+    parser.add_argument('--output', help="结果文件（默认benchmarks/results/pipeline-时间.json）")
+    parser.add_argument('--compare', help="与之前保存的结果文件对比")
+    parser.add_argument('--verbose', action='store_true', help="显示下载流程的输出")
+    mock_upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    sizes = parse_list(args.sizes)
+    thread_counts = parse_list(args.threads)
+    engines = parse_list(args.engines, str)
+    transforms = parse_list(args.transforms, str)
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)['results']
+
+    # 先登记所有合成书籍的章节数，模拟上游按book_id返回对应大小的章节列表
+    plan = []
+    books = {}
+    index = 0
+    for engine in engines:
+        for threads in thread_counts:
+            for size in sizes:
+                book_ids = []
+                for _ in range(args.books):
+                    book_id = BOOK_ID_FORMAT.format(size=size, index=index % 1000)
+                    index += 1
+                    books[book_id] = size
+                    book_ids.append(book_id)
+                plan.append((engine, threads, size, book_ids))
+    options = mock_upstream.options_from_args(args, books=books)
+
+    context = multiprocessing.get_context('spawn')
+    mocks, base_urls = start_mocks(context, options, args.mirrors)
+    results = []
+    try:
+        print(f"模拟上游：{'、'.join(base_urls)}，延迟 {args.latency}，失败率 {args.fail_rate}，"
+              f"超时率 {args.timeout_rate}")
+        for engine, threads, size, book_ids in plan:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                trial = pool.submit(run_trial, base_urls, engine, threads, book_ids, args.client_timeout,
+                                    transforms, args.split, args.format, args.verbose).result()
+            result = summarize(engine, threads, size, trial)
+            results.append(result)
+            print(f"完成：{engine} 并发{threads} {size}章 × {len(book_ids)}本，{result['chapters_per_sec']} 章/秒")
+    finally:
+        for mock in mocks:
+            mock.terminate()
+            mock.join()
+
+    print()
+    print_results(results, previous)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime('pipeline-%Y%m%d-%H%M%S.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created': int(time.time()),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'options': {key: value for key, value in options.items() if key != 'books'},
+            'mirrors': args.mirrors,
+            'transforms': transforms,
+            'split': args.split,
+            'format': args.format,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存：{output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""章节渲染基准：对比原先的BeautifulSoup路径和chapter_render.render_chapter
+
+用法：python benchmarks/bench_render.py [--chapters 3000] [--chars 3000] [--markup-ratio 0.0]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chapter_render import render_chapter  # noqa: E402
+
+SAMPLE_TEXT = "番茄小说下载器生成的测试正文，包含标点符号、数字123和英文words。"
+
+
+def build_corpus(chapters, chars, markup_ratio, seed=42):
+    """生成合成语料：每章若干段纯文本，按比例混入带HTML标签的章节"""
+    rng = random.Random(seed)
+    corpus = []
+    for idx in range(chapters):
+        paragraphs = []
+        length = 0
+        while length < chars:
+            paragraph = "　　" + SAMPLE_TEXT * rng.randint(1, 4)
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        content = "\n".join(paragraphs)
+        if rng.random() < markup_ratio:
+            content = "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+        corpus.append((f"第{idx + 1}章 风起&云涌<{idx}>", content))
+    return corpus
+
+
+def render_with_soup(title, content):
+    """原先download_and_build_epub中的渲染方式"""
+    from bs4 import BeautifulSoup
+
+    content = content.replace("\n", "<br/>")
+    soup = BeautifulSoup(f"<h1>{title}</h1>{content}", 'html.parser')
+    return str(soup)
+
+
+def run(render, corpus):
+    start = time.perf_counter()
+    output_bytes = 0
+    for title, content in corpus:
+        output_bytes += len(render(title, content).encode('utf-8'))
+    return time.perf_counter() - start, output_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="章节渲染基准测试")
+    parser.add_argument('--chapters', type=int, default=3000)
+    parser.add_argument('--chars', type=int, default=3000, help="每章大约的字数")
+    parser.add_argument('--markup-ratio', type=float, default=0.0, help="带HTML标签的章节比例")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.chapters, args.chars, args.markup_ratio)
+    total_chars = sum(len(content) for _, content in corpus)
+    print(f"语料：{len(corpus)} 章，共 {total_chars} 字，带标签比例 {args.markup_ratio:.0%}")
+
+    results = {}
+    for name, render in (('beautifulsoup', render_with_soup), ('render_chapter', render_chapter)):
+        elapsed, output_bytes = run(render, corpus)
+        results[name] = elapsed
+        print(f"{name:>15}: {elapsed:8.3f} 秒，每章 {elapsed / len(corpus) * 1e6:9.1f} 微秒，"
+              f"输出 {output_bytes / 1024 / 1024:.1f} MB")
+
+    print(f"加速比：{results['beautifulsoup'] / results['render_chapter']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""本地模拟上游：提供章节列表（all_items.php）、章节内容（content.php）和封面，用于基准测试和离线调试
+
+用法：python benchmarks/mock_upstream.py [--port 8765] [--chapters 500] [--latency lognormal:0.05:0.5]
+                                        [--fail-rate 0.01] [--timeout-rate 0.001] [--rate-limit-rate 0]
+启动后设置环境变量让下载器使用模拟上游：
+    FANQIE_CHAPTER_LIST_API=http://127.0.0.1:8765/all_items.php
+    FANQIE_CONTENT_API=http://127.0.0.1:8765/content.php
+
+延迟分布写法：0（无延迟）、fixed:秒、uniform:最小:最大、lognormal:中位数:sigma（长尾）
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+SAMPLE_TEXT = "番茄小说下载器基准测试的模拟正文，包含标点符号、数字123和英文words。"
+# 章节item_id = book_id + 6位章节序号
+ITEM_DIGITS = 6
+COVER_BYTES = b'\xff\xd8\xff\xe0' + b'\0' * 2048
+
+
+def parse_latency(spec):
+    """把延迟分布写法解析为 rng -> 秒 的函数"""
+    kind, _, rest = spec.partition(':')
+    params = [float(value) for value in rest.split(':')] if rest else []
+    if kind in ('0', 'none'):
+        return lambda rng: 0.0
+    if kind == 'fixed' and len(params) == 1:
+        return lambda rng: params[0]
+    if kind == 'uniform' and len(params) == 2:
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'lognormal' and len(params) == 2:
+        mu = math.log(params[0])
+        return lambda rng: rng.lognormvariate(mu, params[1])
+    raise Exception(f"无法解析的延迟分布：{spec}")
+
+
+class MockConfig:
+    """模拟上游的行为参数；books为 book_id -> 章节数，未列出的书使用chapters"""
+
+    def __init__(self, chapters=500, books=None, volumes=1, chars=3000, latency='fixed:0.02',
+                 fail_rate=0.0, timeout_rate=0.0, timeout_seconds=15.0, rate_limit_rate=0.0,
+                 retry_after=1, max_concurrency=0, seed=None):
+        self.chapters = chapters
+        self.books = {str(book_id): count for book_id, count in (books or {}).items()}
+        self.volumes = max(volumes, 1)
+        self.chars = chars
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.fail_rate = fail_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency  # 超过这个并发的章节请求直接返回429，0为不限制
+        self.seed = seed
+        # 正文从一段预先生成的长文本中按item_id截取，避免每个请求都生成随机文本
+        rng = random.Random(seed)
+        paragraphs = []
+        length = 0
+        while length < chars * 4:
+            paragraph = "　　" + SAMPLE_TEXT * rng.randint(1, 4)
+            paragraphs.append(paragraph)
+            length += len(paragraph) + 1
+        self.text_pool = "\n".join(paragraphs)
+
+    def chapter_count(self, book_id):
+        return self.books.get(book_id, self.chapters)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        config = self.server.config
+        rng = self.server.local_rng()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.endswith('/cover.jpg'):
+            return self.send_body(COVER_BYTES, 'image/jpeg')
+
+        delay = config.latency(rng)
+        if url.path.endswith('/content.php'):
+            if not self.server.enter():
+                return self.send_status(429)
+            try:
+                return self.content(config, rng, delay, query)
+            finally:
+                self.server.leave()
+
+        self.server.sleep(delay)
+        if url.path.endswith('/all_items.php'):
+            book_id = query.get('book_id', [''])[0]
+            body = self.chapter_list(book_id)
+        else:
+            return self.send_status(404)
+        self.send_body(json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+    def content(self, config, rng, delay, query):
+        roll = rng.random()
+        if roll < config.timeout_rate:
+            # 模拟上游卡住：一直不返回，直到客户端超时后断开
+            self.server.sleep(config.timeout_seconds)
+            self.close_connection = True
+            return
+        roll -= config.timeout_rate
+        if roll < config.fail_rate:
+            self.server.sleep(delay)
+            return self.send_status(503)
+        roll -= config.fail_rate
+        if roll < config.rate_limit_rate:
+            return self.send_status(429, {'Retry-After': str(config.retry_after)})
+
+        self.server.sleep(delay)
+        body = self.chapter_content(query.get('item_id', [''])[0])
+        self.send_body(json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+    def chapter_list(self, book_id):
+        config = self.server.config
+        count = config.chapter_count(book_id)
+        if not book_id or count <= 0:
+            return {'code': 1, 'message': "书籍不存在"}
+        per_volume = max(math.ceil(count / config.volumes), 1)
+        volumes = [
+            [
+                {'itemId': f"{book_id}{index:0{ITEM_DIGITS}d}", 'title': f" 第{index + 1}章 模拟章节 "}
+                for index in range(start, min(start + per_volume, count))
+            ]
+            for start in range(0, count, per_volume)
+        ]
+        return {
+            'code': 0,
+            'data': {
+                'chapterListWithVolume': volumes,
+                'volumeNameList': [f"第{number + 1}卷" for number in range(len(volumes))]
+            }
+        }
+
+    def chapter_content(self, item_id):
+        config = self.server.config
+        book_id = item_id[:-ITEM_DIGITS]
+        if not book_id or not item_id.isdigit():
+            return {'code': 404, 'message': "章节不存在"}
+        pool = config.text_pool
+        offset = int(item_id) % (len(pool) - config.chars)
+        return {
+            'code': 200,
+            'data': {
+                'content': pool[offset:offset + config.chars],
+                'author': "基准测试作者",
+                'book_name': f"基准测试书{book_id}",
+                'pic': f"http://{self.headers.get('Host')}/cover.jpg"
+            }
+        }
+
+    def send_status(self, code, headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockUpstream(ThreadingHTTPServer):
+    # 高并发基准时连接会集中到达，默认的5太小
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def __init__(self, config, host='127.0.0.1', port=0):
+        super().__init__((host, port), MockHandler)
+        self.config = config
+        self.stopping = threading.Event()
+        self._local = threading.local()
+        self._seeds = random.Random(config.seed)
+        self._seed_lock = threading.Lock()
+        self.active = 0
+        self._active_lock = threading.Lock()
+
+    def enter(self):
+        """章节请求开始；超过max_concurrency时返回False"""
+        with self._active_lock:
+            if self.config.max_concurrency and self.active >= self.config.max_concurrency:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self._active_lock:
+            self.active -= 1
+
+    def local_rng(self):
+        """每个处理线程一个随机数生成器（由seed派生，失败和延迟的分布可复现）"""
+        rng = getattr(self._local, 'rng', None)
+        if rng is None:
+            with self._seed_lock:
+                rng = self._local.rng = random.Random(self._seeds.random())
+        return rng
+
+    def handle_error(self, request, client_address):
+        # 客户端取消对冲请求或超时断开是正常情况，不打印异常
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def sleep(self, seconds):
+        # 关闭服务时不必等完模拟的延迟
+        self.stopping.wait(seconds)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+
+def start(config, host='127.0.0.1', port=0):
+    """在后台线程中启动模拟上游，返回MockUpstream（base_url为访问地址）"""
+    server = MockUpstream(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """模拟上游的行为参数，基准测试脚本共用"""
+    parser.add_argument('--latency', default='fixed:0.02', help="每个请求的延迟分布")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="返回503的章节请求比例")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="一直不返回的章节请求比例")
+    parser.add_argument('--timeout-seconds', type=float, default=15.0, help="不返回的请求挂起多久")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="返回429的章节请求比例")
+    parser.add_argument('--max-concurrency', type=int, default=0, help="同时处理的章节请求上限，超出返回429")
+    parser.add_argument('--chars', type=int, default=3000, help="每章字数")
+    parser.add_argument('--volumes', type=int, default=1, help="每本书的分卷数")
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def options_from_args(args, chapters=500, books=None):
+    """MockConfig的参数（普通dict，可以传给子进程）"""
+    return {
+        'chapters': chapters, 'books': books, 'volumes': args.volumes, 'chars': args.chars,
+        'latency': args.latency, 'fail_rate': args.fail_rate, 'timeout_rate': args.timeout_rate,
+        'timeout_seconds': args.timeout_seconds, 'rate_limit_rate': args.rate_limit_rate,
+        'max_concurrency': args.max_concurrency, 'seed': args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟上游")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--chapters', type=int, default=500, help="每本书的章节数")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockUpstream(MockConfig(**options_from_args(args, args.chapters)), args.host, args.port)
+    print(f"模拟上游已启动：{server.base_url}")
+    print(f"  FANQIE_CHAPTER_LIST_API={server.base_url}/all_items.php")
+    print(f"  FANQIE_CONTENT_API={server.base_url}/content.php")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""本地章节缓存：以item_id为键保存章节内容，重新下载同一本书时只需获取缺失章节
+
+已有下载记录（manifest）的书籍的章节会被固定（pinned），不参与LRU淘汰，也不计入容量上限，
+否则下载大量新书后更新模式会因为章节被淘汰而重新下载整本书。删除书籍时取消固定。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+CACHE_DIR = os.path.join('download', '.cache')
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # 默认上限512MB
+CACHE_COMPRESS = True
+# 超出上限时淘汰到上限的90%，避免每次写入都触发淘汰（只统计未固定的章节）
+EVICT_TARGET = 0.9
+
+
+class ChapterCache:
+    """基于SQLite的章节缓存，未固定的章节按最近访问时间做LRU淘汰，可选zlib压缩"""
+
+    def __init__(self, path, max_bytes=CACHE_MAX_BYTES, compress=CACHE_COMPRESS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chapters (
+                item_id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                compressed INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(chapters)")}
+        if 'pinned' not in columns:
+            self.conn.execute("ALTER TABLE chapters ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chapters_access ON chapters(last_access)"
+        )
+        self.conn.commit()
+        # total_bytes只统计可淘汰（未固定）的章节，pinned_bytes为固定章节
+        self.total_bytes = 0
+        self.pinned_bytes = 0
+        for pinned, size in self.conn.execute(
+            "SELECT pinned, COALESCE(SUM(size), 0) FROM chapters GROUP BY pinned"
+        ):
+            if pinned:
+                self.pinned_bytes += size
+            else:
+                self.total_bytes += size
+
+    def get(self, item_id):
+        """读取缓存的章节，未命中返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data, compressed FROM chapters WHERE item_id = ?",
+                (str(item_id),)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE chapters SET last_access = ? WHERE item_id = ?",
+                (time.time(), str(item_id))
+            )
+            self.conn.commit()
+            self.hits += 1
+
+        data, compressed = row
+        if compressed:
+            data = zlib.decompress(data)
+        return json.loads(data)
+
+    def cached_ids(self, item_ids):
+        """返回item_ids中已缓存的item_id集合（不读取内容，也不更新访问时间）"""
+        item_ids = [str(item_id) for item_id in item_ids]
+        found = set()
+        with self.lock:
+            for start in range(0, len(item_ids), 500):
+                batch = item_ids[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT item_id FROM chapters WHERE item_id IN ({placeholders})", batch
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    def put(self, item_id, chapter):
+        """写入章节（保留原有的固定状态），超过容量上限时淘汰最久未访问的未固定章节"""
+        data = json.dumps(chapter, ensure_ascii=False).encode('utf-8')
+        if self.compress:
+            data = zlib.compress(data)
+        with self.lock:
+            old = self.conn.execute(
+                "SELECT size, pinned FROM chapters WHERE item_id = ?", (str(item_id),)
+            ).fetchone()
+            pinned = old[1] if old else 0
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chapters (item_id, data, compressed, size, last_access, pinned) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(item_id), data, int(self.compress), len(data), time.time(), pinned)
+            )
+            delta = len(data) - (old[0] if old else 0)
+            if pinned:
+                self.pinned_bytes += delta
+            else:
+                self.total_bytes += delta
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def discard(self, item_id):
+        """删除缓存的章节（例如上游章节内容已变化）"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, pinned FROM chapters WHERE item_id = ?", (str(item_id),)
+            ).fetchone()
+            if row:
+                self.conn.execute("DELETE FROM chapters WHERE item_id = ?", (str(item_id),))
+                self.conn.commit()
+                if row[1]:
+                    self.pinned_bytes -= row[0]
+                else:
+                    self.total_bytes -= row[0]
+
+    def pin(self, item_ids, pinned=True):
+        """固定章节使其不被淘汰（pinned为假时取消固定），未缓存的item_id会被忽略"""
+        item_ids = [str(item_id) for item_id in item_ids]
+        with self.lock:
+            for start in range(0, len(item_ids), 500):
+                batch = item_ids[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                moved = self.conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM chapters "
+                    f"WHERE pinned = ? AND item_id IN ({placeholders})", [int(not pinned)] + batch
+                ).fetchone()[0]
+                self.conn.execute(
+                    f"UPDATE chapters SET pinned = ? WHERE item_id IN ({placeholders})",
+                    [int(pinned)] + batch
+                )
+                if pinned:
+                    self.total_bytes -= moved
+                    self.pinned_bytes += moved
+                else:
+                    self.total_bytes += moved
+                    self.pinned_bytes -= moved
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def unpin(self, item_ids):
+        """取消固定，章节重新参与LRU淘汰"""
+        self.pin(item_ids, False)
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TARGET
+        rows = self.conn.execute(
+            "SELECT item_id, size FROM chapters WHERE pinned = 0 ORDER BY last_access"
+        )
+        evicted = []
+        for item_id, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((item_id,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM chapters WHERE item_id = ?", evicted)
+
+    def stats(self):
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM chapters").fetchone()[0]
+            return {
+                'chapters': count,
+                'bytes': self.total_bytes,
+                'pinned_bytes': self.pinned_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """获取全局章节缓存（首次使用时创建）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ChapterCache(os.path.join(CACHE_DIR, 'chapters.db'))
+        return _cache
@@ -0,0 +1,57 @@
+"""章节正文转XHTML：纯文本直接拼接转义后的段落，只有正文含标签时才交给BeautifulSoup"""
+import re
+from html import escape, unescape
+
+# 正文中出现HTML标签或实体时才需要解析；只有常见的标签名加合乎语法的属性才算标签，
+# “a<b & c>d”这样的文字按纯文本转义
+TAG_NAMES = r'p|br|div|span|b|i|u|s|em|strong|small|big|sub|sup|font|center|a|img|h[1-6]|ul|ol|li|dl|dt|dd' \
+            r'|blockquote|pre|code|hr|table|thead|tbody|tr|td|th'
+MARKUP_RE = re.compile(
+    rf'<\s*/?\s*(?:{TAG_NAMES})(?:\s+[a-zA-Z_][-\w.]*(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'<>=`]+))?)*\s*/?\s*>'
+    r'|&(?:[a-zA-Z]+|#[0-9]+|#x[0-9a-fA-F]+);',
+    re.IGNORECASE
+)
+TAG_RE = re.compile(r'<[^<>]*>')
+# XML 1.0不允许出现的字符：制表、换行、回车以外的控制字符，代理项，U+FFFE和U+FFFF
+INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+# 标签名和属性名只保留不带命名空间前缀的XML名称
+XML_NAME_RE = re.compile(r'[A-Za-z_][-A-Za-z0-9_.]*\Z')
+
+
+def render_chapter(title, content):
+    """把章节标题和正文转换为<body>内的XHTML片段"""
+    title = INVALID_XML_RE.sub('', title)
+    content = INVALID_XML_RE.sub('', content)
+    if MARKUP_RE.search(content):
+        return render_markup(title, content)
+    paragraphs = []
+    for line in content.split('\n'):
+        # 保留行首的全角空格缩进，只去掉首尾的ASCII空白
+        line = line.strip(' \t\r')
+        if line.strip():
+            paragraphs.append(f'<p>{escape(line, quote=False)}</p>')
+    return f'<h1>{escape(title, quote=False)}</h1>\n' + '\n'.join(paragraphs)
+
+
+def render_markup(title, content):
+    """正文本身带标签时，用BeautifulSoup整理成合法的XHTML"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content.replace('\n', '<br/>'), 'html.parser')
+    # html.parser会把“<b & c>”中的“&”当作属性名，原样输出不是合法的XML
+    for tag in soup.find_all(True):
+        if not XML_NAME_RE.match(tag.name):
+            tag.unwrap()
+            continue
+        for name in [name for name in tag.attrs if not XML_NAME_RE.match(name)]:
+            del tag.attrs[name]
+    # 字符引用（如&#1;）解码后也可能是XML不允许的字符
+    body = INVALID_XML_RE.sub('', soup.decode(formatter='minimal'))
+    return f'<h1>{escape(title, quote=False)}</h1>\n' + body
+
+
+def plain_text(content):
+    """去掉正文中的HTML标签，只保留文字（用于全文索引和TXT输出）"""
+    if '<' in content or '&' in content:
+        content = unescape(TAG_RE.sub('', content))
+    return content
@@ -0,0 +1,144 @@
+"""命令行入口
+
+    python cli.py download <book_id...>   不启动网页界面，直接下载并生成EPUB（适合定时任务）
+    python cli.py serve [--host] [--port]   以部署模式启动网页界面（无debug自动重载）
+"""
+import argparse
+import sys
+import time
+
+from retry_policy import MAX_ATTEMPTS
+from scheduler import GLOBAL_CONCURRENCY, MAX_ACTIVE_JOBS
+
+# 下载中每隔多少秒打印一次进度
+PROGRESS_INTERVAL = 5
+
+
+def download(args):
+    # 只导入下载流程，不加载Flask
+    from downloader import ENGINES, FORMATS, AUTO_MAX_WORKERS, max_workers_limit, new_job, run_job
+    from scheduler import Scheduler, PRIORITIES
+    from text_transforms import validate as validate_transforms
+    from epub_parts import parse_split
+    import host_control
+
+    if args.engine not in ENGINES:
+        raise Exception(f"未知的下载引擎：{args.engine}")
+    if args.format is not None and args.format not in FORMATS:
+        raise Exception(f"未知的输出格式：{args.format}")
+    if args.concurrency < 1 or args.jobs < 1:
+        raise Exception("并发上限和同时下载的书籍数量必须为正整数")
+    threads = max(1, min(args.threads or AUTO_MAX_WORKERS, max_workers_limit(args.engine)))
+    options = {
+        'max_workers': threads, 'priority': PRIORITIES['normal'], 'engine': args.engine, 'update': args.update,
+        'max_attempts': args.retries
+    }
+    # 没有指定的正文处理、分册方式和输出格式使用默认值，--update时沿用上次下载时的设置
+    if args.transforms is not None:
+        options['transforms'] = validate_transforms(name.strip() for name in args.transforms.split(','))
+    if args.split is not None:
+        options['split'] = parse_split(args.split)
+    if args.format is not None:
+        options['format'] = args.format
+    scheduler = Scheduler(run_job, args.concurrency, args.jobs)
+    # 全局预算超过每主机的默认并发上限时，单个主机也能用满预算
+    host_control.set_max_limit(args.concurrency)
+    jobs = scheduler.submit_many([new_job(book_id, **options) for book_id in dict.fromkeys(args.book_ids)])
+
+    last_report = time.time()
+    while scheduler.is_busy():
+        time.sleep(0.5)
+        if time.time() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.time()
+            for job in jobs:
+                status = job.status
+                if status['state'] == 'running' and status['total_chapters']:
+                    print(f"[{status['book_name'] or status['book_id']}] "
+                          f"{status['downloaded']}/{status['total_chapters']}，{status['chapters_per_sec']} 章/秒")
+
+    failed = 0
+    for job in jobs:
+        status = job.status
+        name = status['book_name'] or status['book_id']
+        if status['state'] == 'failed':
+            failed += 1
+            print(f"失败：{name}（{status['error']}）")
+        else:
+            missing = f"，缺失 {len(status['missing'])} 章" if status['missing'] else ''
+            print(f"{'无需更新' if status['state'] == 'skipped' else '完成'}：{name}{missing}")
+    return 1 if failed else 0
+
+
+def serve(args):
+    import webui
+
+    if args.concurrency < 1 or args.jobs < 1:
+        raise Exception("并发上限和同时下载的书籍数量必须为正整数")
+    webui.init_app(args.concurrency, args.jobs)
+    webui.resume_jobs()
+    url = f"http://{args.host}:{args.port}"
+    if args.open:
+        import webbrowser
+        webbrowser.open(url)
+    if args.server == 'waitress':
+        try:
+            from waitress import serve as waitress_serve
+        except ImportError:
+            raise Exception("使用waitress需要先安装：pip install waitress")
+        print(f"使用waitress提供服务：{url}")
+        waitress_serve(webui.app, host=args.host, port=args.port, threads=args.threads)
+    else:
+        # 每个请求一个线程；/events推送连接会长期占用一个线程
+        from werkzeug.serving import make_server
+        server = make_server(args.host, args.port, webui.app, threaded=True)
+        print(f"服务已启动：{url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="番茄小说下载器")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    download_parser = commands.add_parser('download', help="下载书籍并生成EPUB")
+    download_parser.add_argument('book_ids', nargs='+', metavar='book_id')
+    download_parser.add_argument('-t', '--threads', type=int, help="单本书并发上限（默认自动调节）")
+    download_parser.add_argument('-e', '--engine', default='thread', help="下载引擎：thread或async")
+    download_parser.add_argument('-u', '--update', action='store_true', help="只更新新章节")
+    download_parser.add_argument('-j', '--jobs', type=int, default=MAX_ACTIVE_JOBS, help="同时下载的书籍数量")
+    download_parser.add_argument('-c', '--concurrency', type=int, default=GLOBAL_CONCURRENCY,
+                                 help="所有书籍共享的章节请求并发上限")
+    download_parser.add_argument('--retries', type=int, default=MAX_ATTEMPTS, help="每个章节最多尝试的次数")
+    download_parser.add_argument('--transforms',
+                                 help="正文处理步骤，逗号分隔：normalize、strip_ads、s2t（转繁体）、t2s（转简体）"
+                                      "（--update时默认沿用上次的设置）")
+    download_parser.add_argument('--split', help="分册输出：volume为每卷一册，数字N为每N章一册，0为不分册"
+                                                 "（--update时默认沿用上次的设置）")
+    download_parser.add_argument('-f', '--format', help="输出格式：epub（默认）、txt或both（同时生成）"
+                                                        "（--update时默认沿用上次的设置）")
+    download_parser.set_defaults(func=download)
+
+    serve_parser = commands.add_parser('serve', help="以部署模式启动网页界面")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="监听地址，对外提供服务时使用0.0.0.0")
+    serve_parser.add_argument('--port', type=int, default=5000)
+    serve_parser.add_argument('--server', choices=('werkzeug', 'waitress'), default='werkzeug')
+    serve_parser.add_argument('--threads', type=int, default=32, help="waitress的工作线程数")
+    serve_parser.add_argument('-j', '--jobs', type=int, default=MAX_ACTIVE_JOBS, help="同时下载的书籍数量")
+    serve_parser.add_argument('-c', '--concurrency', type=int, default=GLOBAL_CONCURRENCY,
+                              help="所有书籍共享的章节请求并发上限")
+    serve_parser.add_argument('--open', action='store_true', help="启动后打开浏览器")
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except Exception as e:
+        print(f"程序出错：{str(e)}")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,787 @@
+"""下载流程：获取章节列表、并发下载章节并生成EPUB，不依赖网页界面，命令行和网页共用"""
+import heapq
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+import http_client
+import events
+import metrics
+from chapter_cache import get_cache
+from epub_writer import StreamingEpubWriter, source_date_epoch
+from chapter_render import render_chapter
+from library_catalog import get_catalog
+from search_index import IndexWriter, get_index
+from manifest import build_options, load_manifest, save_manifest, save_txt_ranges, delete_txt_ranges, diff_chapters, \
+    manifest_files, outputs_exist, cover_digest, BuildHash
+from scheduler import Job
+from host_control import MAX_LIMIT, get_controller, classify_status, parse_retry_after
+from endpoints import CHAPTER_LIST, CONTENT, get_pool
+from text_transforms import TransformPipeline, validate as validate_transforms
+from epub_parts import PartedEpubWriter, parse_split, plan_parts, part_of
+from txt_writer import StreamingTxtWriter
+from retry_policy import MAX_ATTEMPTS, LatencyTracker, backoff_delay, hedge_capacity
+
+# 可选的章节下载引擎：thread为线程池，async为asyncio事件循环
+ENGINES = ('thread', 'async')
+# 输出格式：both为同一次下载同时生成EPUB和TXT
+FORMATS = ('epub', 'txt', 'both')
+# 封面在后台线程中下载，不占用章节下载线程
+cover_executor = ThreadPoolExecutor(max_workers=4)
+MISSING_CHAPTER_TEXT = "本章下载失败，请稍后使用“仅更新新章节”重新下载。"
+# 未指定并发上限时，单本书最多使用的并发数（实际并发由各主机的AIMD控制器决定）
+AUTO_MAX_WORKERS = 32
+# 已提交但尚未写入EPUB的章节窗口：并发数的4倍，至少64章
+WINDOW_FACTOR = 4
+MIN_WINDOW = 64
+
+# 创建下载目录
+os.makedirs('download', exist_ok=True)
+
+def max_workers_limit(engine):
+    """单本书并发上限的最大值：线程引擎不超过每主机的并发上限，异步引擎不超过其在途请求上限"""
+    if engine == 'async':
+        from async_engine import MAX_CONCURRENCY  # 只在需要时导入asyncio
+        return MAX_CONCURRENCY
+    return MAX_LIMIT
+
+def new_job(book_id, **options):
+    """创建任务；更新任务中没有指定的分册方式、输出格式和正文处理沿用上次下载时的设置"""
+    if options.get('update'):
+        options = dict(build_options(load_manifest(book_id)), **options)
+    return Job(book_id, **options)
+
+def run_job(job):
+    download_and_build_epub(job.book_id, job.max_workers, job.engine, job.update, job)
+
+def get_chapter_infos(book_id):
+    """获取章节信息（包含item_id和标题）"""
+    params = {"book_id": book_id}
+    
+    try:
+        data, response = fetch_endpoint(
+            CHAPTER_LIST, lambda data: data if data.get("code") == 0 else None, params
+        )
+        if data is None:
+            raise Exception(f"API错误：{response.json().get('message')}")
+        
+        chapters = []
+        volume_names = data["data"].get("volumeNameList") or []
+        # 遍历每个卷中的章节，保留所属分卷用于生成分级目录和按卷分册
+        for number, volume in enumerate(data["data"].get("chapterListWithVolume", [])):
+            default_name = volume_names[number] if number < len(volume_names) else f"第{number + 1}卷"
+            for chapter in volume:
+                chapters.append({
+                    "item_id": chapter["itemId"],
+                    "title": chapter["title"].strip(),
+                    "volume": (chapter.get("volume_name") or default_name or "").strip()
+                })
+        return chapters
+    
+    except Exception as e:
+        raise Exception(f"获取章节列表失败：{str(e)}")
+
+def cached_build_hash(chapters, cache, build_hash, previous):
+    """所有章节都在缓存中时，不下载也不生成，直接计算内容哈希；有章节已被淘汰时返回None
+
+    封面沿用上次生成时的封面；上次有封面地址却没能下载封面时返回None，重新生成以补上封面。
+    """
+    first = cache.get(chapters[0]["item_id"])
+    if not first or (first.get("pic") and not previous.get('cover')):
+        return None
+    for chapter in chapters:
+        result = cache.get(chapter["item_id"])
+        if not result:
+            return None
+        build_hash.add(result)
+    return build_hash.hexdigest(
+        first.get("book_name", "未知书名"), first.get("author", "未知作者"), first.get("pic", ""),
+        previous.get('cover') if first.get("pic") else None
+    )
+
+def fetch_upstream(url, parse, **kwargs):
+    """经主机并发控制请求上游JSON接口，返回(parse结果, 响应)
+
+    超时、HTTP 429/5xx和接口code异常（parse返回None）都会反馈给该主机的控制器，
+    响应带Retry-After时控制器会暂停向该主机发请求。
+    """
+    controller = get_controller(url)
+    started = controller.acquire()
+    outcome, retry_after = 'error', None
+    try:
+        response = http_client.get(url, **kwargs)
+        outcome = classify_status(response.status_code)
+        if outcome != 'ok':
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        response.raise_for_status()
+        outcome = 'error'
+        result = parse(response.json())
+        outcome = 'ok' if result is not None else 'bad_code'
+        return result, response
+    except requests.Timeout:
+        outcome = 'timeout'
+        raise
+    finally:
+        controller.release(started, outcome, retry_after)
+
+def fetch_endpoint(role, parse, params, tried=None):
+    """从接口池中选择地址请求，失败时换一个本轮没试过的地址，返回(parse结果, 响应)
+
+    tried为本轮已用过的地址，对冲请求与原请求共用，对冲时尽量发往另一个地址。
+    所有地址都失败时返回最后一个地址的结果，或抛出最后一个异常。
+    """
+    pool = get_pool(role)
+    tried = [] if tried is None else tried
+    endpoint = pool.choose(tried) or pool.choose()
+    result, response, error = None, None, None
+    while endpoint:
+        tried.append(endpoint)
+        try:
+            result, response = fetch_upstream(endpoint.url, parse, params=params)
+            error = None
+        except Exception as e:
+            result, error = None, e
+        pool.report(endpoint, result is not None, params)
+        if result is not None:
+            break
+        endpoint = pool.choose(tried)
+    if error:
+        raise error
+    return result, response
+
+def parse_chapter_data(data):
+    """解析章节接口返回的JSON，code不为200时返回None"""
+    if data.get("code") == 200:
+        content_data = data.get("data", {})
+        return {
+            "content": content_data.get("content", ""),
+            "author": content_data.get("author", "未知作者"),
+            "book_name": content_data.get("book_name", "未知书名"),
+            "pic": content_data.get("pic", "")
+        }
+    return None
+
+def download_chapter(item_id, tried=None):
+    """下载章节内容并获取元数据（优先读取本地缓存，下载成功后写入缓存）"""
+    cached = get_cache().get(item_id)
+    if cached:
+        return cached
+
+    try:
+        result, response = fetch_endpoint(CONTENT, parse_chapter_data, {"item_id": item_id}, tried)
+        if result:
+            get_cache().put(item_id, result)
+            result["bytes"] = len(response.content)
+        return result
+    except Exception as e:
+        print(f"下载章节 {item_id} 失败: {str(e)}")
+        return None
+
+def sanitize_filename(name):
+    """去除文件名中的非法字符"""
+    return re.sub(r'[\\/*?:"<>|]', '', name).strip()
+
+class ProgressTracker:
+    """统计章节下载速率、在途请求数和预计剩余时间，并写入任务状态"""
+
+    WINDOW = 10  # 速率按最近10秒内完成的章节计算
+
+    def __init__(self, total, status):
+        self.total = total
+        self.status = status
+        self.done = 0
+        self.in_flight = 0
+        self.bytes = 0
+        self.start_time = time.time()
+        self.recent = deque()  # (完成时间, 字节数)
+        self.lock = threading.Lock()
+
+    def cached(self):
+        """记录一个命中本地缓存的章节，不计入下载速率"""
+        with self.lock:
+            self.done += 1
+            self.status['downloaded'] = self.done
+            self.status['last_update'] = int(time.time())
+        events.notify()
+
+    def started(self):
+        """一个章节请求（包括重试和对冲请求）开始"""
+        with self.lock:
+            self.in_flight += 1
+            self.status['in_flight'] = self.in_flight
+
+    def ended(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.status['in_flight'] = self.in_flight
+
+    def finished(self, nbytes=0):
+        """一个章节有了最终结果（成功或重试耗尽）"""
+        with self.lock:
+            now = time.time()
+            self.done += 1
+            self.bytes += nbytes
+            self.recent.append((now, nbytes))
+            while self.recent and now - self.recent[0][0] > self.WINDOW:
+                self.recent.popleft()
+
+            # 下载刚开始时窗口不足10秒，按实际经过时间计算
+            span = min(now - self.start_time, self.WINDOW) or 1e-6
+            chapters_per_sec = len(self.recent) / span
+            bytes_per_sec = sum(size for _, size in self.recent) / span
+            remaining = self.total - self.done
+            self.status.update({
+                'downloaded': self.done,
+                'bytes_downloaded': self.bytes,
+                'chapters_per_sec': round(chapters_per_sec, 2),
+                'bytes_per_sec': round(bytes_per_sec),
+                'eta': round(remaining / chapters_per_sec) if chapters_per_sec else None,
+                'last_update': int(now)
+            })
+        events.notify()
+
+def fetch_cover(url):
+    """下载封面图片，失败时返回None"""
+    started = time.perf_counter()
+    try:
+        response = http_client.get(url)
+        if response.status_code == 200:
+            return response.content
+        print(f"封面下载失败: HTTP {response.status_code}")
+    except Exception as e:
+        print(f"封面下载失败: {str(e)}")
+    finally:
+        metrics.stage_seconds.observe(time.perf_counter() - started, stage='cover')
+    return None
+
+class BookMetadata:
+    """书名、作者和封面：取自最先拿到的章节结果，不再为元数据单独请求章节
+
+    拿到封面地址后立即在后台下载封面，与章节下载同时进行。
+    """
+
+    def __init__(self, status):
+        self.status = status
+        self.author = "未知作者"
+        self.book_name = "未知书名"
+        self.pic = ""
+        self.found = False
+        self.cover = None  # 封面下载的Future
+        self.lock = threading.Lock()
+
+    def offer(self, result):
+        if self.found or not result:
+            return
+        with self.lock:
+            if self.found:
+                return
+            self.found = True
+        self.author = result.get("author", self.author)
+        self.book_name = result.get("book_name", self.book_name)
+        self.pic = result.get("pic", self.pic)
+        self.status['book_name'] = self.book_name
+        self.status['last_update'] = int(time.time())
+        events.notify()
+        if self.pic:
+            self.cover = cover_executor.submit(fetch_cover, self.pic)
+
+    def cover_data(self):
+        return self.cover.result() if self.cover else None
+
+class ChapterSequencer:
+    """按章节顺序输出：第idx章及其之前的章节全部就绪后，依次交给emit
+
+    命中缓存的章节不提前读入内存，轮到它时再通过load_cached读取。
+    """
+
+    def __init__(self, total, emit, load_cached, cached_idx):
+        self.total = total
+        self.emit = emit
+        self.load_cached = load_cached
+        self.cached_idx = cached_idx
+        self.ready = {}
+        self.next_idx = 0
+
+    def put(self, idx, result):
+        self.ready[idx] = result
+        self.flush()
+
+    def flush(self):
+        while self.next_idx < self.total:
+            if self.next_idx in self.ready:
+                result = self.ready.pop(self.next_idx)
+            elif self.next_idx in self.cached_idx:
+                result = self.load_cached(self.next_idx)
+            else:
+                break
+            self.emit(self.next_idx, result)
+            self.next_idx += 1
+
+def download_chapters_threaded(jobs, thread_count, on_result, tracker=None, window_end=None,
+                               slot=None, max_attempts=MAX_ATTEMPTS):
+    """线程池下载章节
+
+    jobs为按序号递增的(序号, item_id)列表，每个章节有最终结果时按完成顺序以(序号, 结果)
+    回调on_result，重试max_attempts次仍失败的章节结果为None。
+    失败的章节按带抖动的指数退避重新排队；请求耗时超过近期p95延迟时发出一个对冲请求，
+    先返回的结果生效。
+    提供window_end时只提交序号小于window_end()的章节，而不是一次性全部提交；
+    提供slot（下载任务）时每个请求都先占用一个全局并发名额。
+    """
+    latencies = LatencyTracker()
+
+    def fetch(item_id, attempt, tried):
+        if slot:
+            slot.acquire()
+        try:
+            if tracker:
+                tracker.started()
+            attempt['started'] = time.time()
+            result = download_chapter(item_id, tried)
+            if result:
+                latencies.add(time.time() - attempt['started'])
+            return result
+        finally:
+            if tracker:
+                tracker.ended()
+            if slot:
+                slot.release()
+
+    jobs = deque(jobs)
+    retries = []  # (重试时间, 序号, item_id)
+    failures = {}  # 序号 -> 已失败的轮数
+    outstanding = {}  # 序号 -> 进行中的请求数
+    hedged = set()
+    tried = {}  # 序号 -> 本轮已用过的接口地址（原请求和对冲请求共用）
+    resolved = set()
+    futures = {}  # future -> (序号, item_id, 是否对冲请求, 请求信息)
+    hedge_cap = hedge_capacity(thread_count)
+
+    def submit(idx, item_id, hedge=False):
+        attempt = {'started': None}
+        future = executor.submit(fetch, item_id, attempt, tried.setdefault(idx, []))
+        futures[future] = (idx, item_id, hedge, attempt)
+        outstanding[idx] = outstanding.get(idx, 0) + 1
+
+    # 普通请求不超过thread_count个，额外的线程留给对冲请求，保证对冲请求不用排队
+    with ThreadPoolExecutor(max_workers=thread_count + hedge_cap) as executor:
+        while jobs or retries or futures:
+            now = time.time()
+            hedges = sum(1 for _, _, hedge, _ in futures.values() if hedge)
+            while retries and retries[0][0] <= now and len(futures) - hedges < thread_count:
+                _, idx, item_id = heapq.heappop(retries)
+                submit(idx, item_id)
+
+            limit = window_end() if window_end else None
+            while jobs and (not futures or limit is None or jobs[0][0] < limit) \
+                    and len(futures) - hedges < thread_count:
+                idx, item_id = jobs.popleft()
+                submit(idx, item_id)
+
+            # 对耗时超过p95的请求发出对冲请求，每个章节只对冲一次
+            threshold = latencies.threshold()
+            # 并发已满时等待请求完成，不必按重试时间醒来
+            timeout = max(retries[0][0] - now, 0) \
+                if retries and len(futures) - hedges < thread_count else None
+            if threshold is not None:
+                for idx, item_id, hedge, attempt in list(futures.values()):
+                    if hedges >= hedge_cap:
+                        break
+                    if hedge or idx in hedged or attempt['started'] is None:
+                        continue
+                    if now - attempt['started'] > threshold:
+                        hedged.add(idx)
+                        hedges += 1
+                        submit(idx, item_id, hedge=True)
+                timeout = min(timeout, threshold / 4) if timeout is not None else threshold / 4
+
+            if not futures:
+                time.sleep(timeout or 0)
+                continue
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, item_id, _, _ = futures.pop(future)
+                outstanding[idx] -= 1
+                result = future.result()
+                if idx in resolved:
+                    # 对冲请求中较慢的一个，结果丢弃
+                    continue
+                if result:
+                    resolved.add(idx)
+                    tried.pop(idx, None)
+                    on_result(idx, result)
+                elif outstanding[idx] == 0:
+                    failures[idx] = failures.get(idx, 0) + 1
+                    hedged.discard(idx)
+                    # 退避后重试时所有地址重新参与选择
+                    tried.pop(idx, None)
+                    if failures[idx] < max_attempts:
+                        delay = backoff_delay(failures[idx])
+                        heapq.heappush(retries, (time.time() + delay, idx, item_id))
+                    else:
+                        resolved.add(idx)
+                        on_result(idx, None)
+
+def download_and_build_epub(book_id, thread_count=8, engine='thread', update=False, job=None):
+    """下载整本书并生成EPUB；job为调度器中的任务，进度写入job.status"""
+    if job is None:
+        job = Job(book_id, thread_count, engine=engine, update=update)
+    status = job.status
+    try:
+        # 每主机连接池大小与工作线程数一致，保证每个线程都能复用keep-alive连接
+        http_client.get_session(thread_count if engine == 'thread' else None)
+        transforms = validate_transforms(job.transforms)
+        split = parse_split(job.split)
+        if job.format not in FORMATS:
+            raise Exception(f"未知的输出格式：{job.format}")
+        write_epub = job.format in ('epub', 'both')
+        write_txt = job.format in ('txt', 'both')
+
+        print("正在获取章节信息...")
+        started = time.perf_counter()
+        chapters = get_chapter_infos(book_id)
+        metrics.stage_seconds.observe(time.perf_counter() - started, stage='chapter_list')
+        total_chapters = len(chapters)
+        print(f"共发现 {total_chapters} 个章节")
+        
+        status['total_chapters'] = total_chapters
+        status['last_update'] = int(time.time())
+        events.notify()
+
+        if total_chapters == 0:
+            raise Exception("没有找到任何章节")
+
+        cache = get_cache()
+        previous = load_manifest(book_id)
+        if update:
+            # 增量更新：与上次下载的清单对比，只需获取新增和标题变化的章节
+            if previous:
+                added, changed, removed = diff_chapters(previous, chapters)
+                status['book_name'] = previous['book_name']
+                if not (added or changed or removed) and previous.get('split') == split \
+                        and previous.get('format', 'epub') == job.format \
+                        and previous.get('transforms', []) == list(transforms) and outputs_exist(previous):
+                    print(f"《{previous['book_name']}》没有新章节，跳过更新")
+                    cache.pin(chapter['item_id'] for chapter in previous['chapters'])
+                    status['downloaded'] = total_chapters
+                    status['state'] = 'skipped'
+                    return
+                print(f"新增章节 {len(added)} 个，标题变化 {len(changed)} 个，移除 {len(removed)} 个")
+                for item_id in changed:
+                    cache.discard(item_id)
+                cache.unpin(removed)
+            else:
+                print("没有找到该书的下载记录，将完整下载")
+
+        # 元数据从最先完成的章节中获取，章节列表到达后立即开始下载章节
+        metadata = BookMetadata(status)
+        tracker = ProgressTracker(total_chapters, status)
+
+        # 已缓存的章节轮到写入时再从缓存读取，只下载缺失的章节
+        cached = cache.cached_ids(chapter["item_id"] for chapter in chapters)
+        cached_idx = set()
+        missing = []
+        for idx, chapter in enumerate(chapters):
+            if str(chapter["item_id"]) in cached:
+                cached_idx.add(idx)
+                tracker.cached()
+            else:
+                missing.append((idx, chapter["item_id"]))
+        metrics.chapters.inc(len(cached_idx), result='cached')
+        if cached_idx:
+            print(f"本地缓存命中 {len(cached_idx)} 个章节，需下载 {len(missing)} 个")
+
+        # 生成结果的内容哈希与上次相同时，已有的文件就是这次会生成的文件，不必重新生成
+        build_options = {
+            'transforms': list(transforms), 'split': split, 'format': job.format, 'timestamp': source_date_epoch()
+        }
+        if not missing and previous and previous.get('build_hash') and outputs_exist(previous):
+            digest = cached_build_hash(chapters, cache, BuildHash(chapters, build_options), previous)
+            if digest == previous['build_hash']:
+                print(f"《{previous['book_name']}》内容没有变化，保留现有文件")
+                cache.pin(chapter['item_id'] for chapter in previous['chapters'])
+                status['book_name'] = previous['book_name']
+                status['files'] = manifest_files(previous)
+                status['state'] = 'skipped'
+                return
+        build_hash = BuildHash(chapters, build_options)
+
+        # 章节按顺序流式写入临时文件，完成后再改名为最终文件
+        staging = f".book_{book_id}_{job.id}"
+        # 只输出TXT时不分册，整本书为一个文件
+        parts = plan_parts(chapters, split if write_epub else None)
+        if not write_epub:
+            writer = None
+            part_paths = []
+        elif len(parts) > 1:
+            # 分册输出：每个分册写满后在进程池中渲染打包，与后续章节的下载同时进行
+            print(f"分为 {len(parts)} 册生成")
+            writer = PartedEpubWriter(
+                parts, os.path.join('download', staging), f"fanqie-{book_id}",
+                lambda: (metadata.book_name, metadata.author, metadata.cover_data())
+            )
+            part_paths = writer.paths
+        else:
+            part_paths = [os.path.join('download', f"{staging}.epub.part")]
+            writer = StreamingEpubWriter(part_paths[0], f"fanqie-{book_id}")
+        # TXT与EPUB来自同一次下载，按章节顺序同时写入
+        txt_path = os.path.join('download', f"{staging}.txt.part")
+        txt_writer = StreamingTxtWriter(
+            txt_path, lambda: (metadata.book_name, metadata.author),
+            volumes=len({chapter.get("volume") for chapter in chapters if chapter.get("volume")}) > 1
+        ) if write_txt else None
+        succeeded = set()
+        # 章节正文同时写入全文索引（每个EPUB分册一份，只输出TXT时对应TXT文件），生成成功后才对搜索可见
+        try:
+            index_writers = [
+                IndexWriter(get_index(), book_id, f"{staging}_part{part['number']}" if len(parts) > 1 else staging)
+                for part in parts
+            ]
+        except Exception as e:
+            print(f"全文索引不可用：{str(e)}")
+            index_writers = None
+
+        failed = []
+        # 全书渲染、写入EPUB和写入TXT的累计耗时
+        stage_times = {}
+        if writer:
+            stage_times.update(render=0.0, epub_write=0.0)
+        if txt_writer:
+            stage_times['txt_write'] = 0.0
+
+        def add_chapter(idx, title, content):
+            volume = chapters[idx].get("volume")
+            if txt_writer:
+                started = time.perf_counter()
+                txt_writer.add_chapter(idx, title, content, volume)
+                stage_times['txt_write'] += time.perf_counter() - started
+            if not writer:
+                return
+            if len(parts) > 1:
+                # 分册的渲染在处理进程中进行
+                writer.add_chapter(idx, title, content, volume)
+                return
+            started = time.perf_counter()
+            body = render_chapter(title, content)
+            rendered = time.perf_counter()
+            writer.add_chapter(title, body, volume)
+            stage_times['render'] += rendered - started
+            stage_times['epub_write'] += time.perf_counter() - rendered
+
+        def store_chapter(idx, title, content):
+            # 正文处理完成后按章节顺序到达
+            add_chapter(idx, title, content)
+            if index_writers and idx in succeeded:
+                index_writers[part_of(parts, idx)].add(idx, title, content)
+
+        # 启用了正文处理时，章节按顺序提交到进程池，处理与后续章节的下载同时进行
+        transformer = TransformPipeline(transforms, store_chapter)
+
+        def write_chapter(idx, result):
+            # 缓存命中的章节不经过on_chapter，在这里提取元数据
+            metadata.offer(result)
+            build_hash.add(result)
+            title = chapters[idx]["title"]
+            if not result:
+                # 重试后仍失败的章节保留一个占位页，不从目录中消失
+                failed.append({"index": idx, "item_id": str(chapters[idx]["item_id"]), "title": title})
+                transformer.put(idx, f"{title}（缺失）", MISSING_CHAPTER_TEXT, transform=False)
+                return
+            succeeded.add(idx)
+            if result["content"]:
+                transformer.put(idx, title, result["content"])
+
+        def load_cached(idx):
+            # 缓存可能在此期间被淘汰，此时重新下载
+            return cache.get(chapters[idx]["item_id"]) or download_chapter(chapters[idx]["item_id"])
+
+        sequencer = ChapterSequencer(total_chapters, write_chapter, load_cached, cached_idx)
+
+        def on_chapter(idx, result):
+            # 按完成顺序到达，交给sequencer按章节顺序写入
+            nbytes = result.get("bytes", 0) if result else 0
+            tracker.finished(nbytes)
+            metrics.chapters.inc(result='downloaded' if result else 'failed')
+            metrics.chapter_bytes.inc(nbytes)
+            metadata.offer(result)
+            sequencer.put(idx, result)
+
+        # 已提交但尚未写入的章节数量上限，控制内存占用
+        window = max(thread_count * WINDOW_FACTOR, MIN_WINDOW)
+
+        def window_end():
+            return sequencer.next_idx + window
+
+        try:
+            # chapter_fetch为下载阶段的总耗时，包括期间按顺序写入的章节
+            fetch_started = time.perf_counter()
+            sequencer.flush()
+            if engine == 'async':
+                # 异步引擎（asyncio/aiohttp）只在使用时导入，加快启动
+                import async_engine
+
+                def on_async_chapter(idx, result):
+                    if result:
+                        cache.put(chapters[idx]["item_id"], {
+                            key: value for key, value in result.items() if key != "bytes"
+                        })
+                    on_chapter(idx, result)
+
+                # 单事件循环驱动全部章节请求，thread_count作为在途请求上限
+                print(f"开始下载章节内容（异步引擎，并发 {thread_count}）...")
+                async_engine.fetch_chapters(
+                    missing,
+                    thread_count,
+                    get_pool(CONTENT),
+                    parse_chapter_data,
+                    on_async_chapter,
+                    tracker,
+                    window_end,
+                    job,
+                    job.max_attempts
+                )
+            else:
+                # 多线程下载所有章节
+                print("开始下载章节内容...")
+                download_chapters_threaded(
+                    missing, thread_count, on_chapter, tracker, window_end, job, job.max_attempts
+                )
+
+            metrics.stage_seconds.observe(time.perf_counter() - fetch_started, stage='chapter_fetch')
+            if not succeeded:
+                # 只有占位页的文件没有意义，也不能记入下载记录和书库
+                raise Exception(f"全部 {total_chapters} 个章节都下载失败")
+            transformer.finish()
+            if transforms:
+                # 各处理步骤的耗时为所有进程上的耗时之和
+                for name, seconds in transformer.timings.items():
+                    metrics.transform_seconds.observe(seconds, transform=name)
+                status['transform_seconds'] = {
+                    name: round(seconds, 2) for name, seconds in transformer.timings.items()
+                }
+                print("正文处理耗时：" + "、".join(
+                    f"{name} {seconds:.2f}秒" for name, seconds in transformer.timings.items()
+                ))
+
+            txt_ranges = txt_writer.close(total_chapters) if txt_writer else None
+            if writer and len(parts) > 1:
+                print("正在等待分册生成完成...")
+                # 各分册的渲染和打包耗时为所有进程上的耗时之和
+                for timings in writer.close():
+                    stage_times['render'] += timings['render']
+                    stage_times['epub_write'] += timings['epub_write']
+                    metrics.stage_seconds.observe(timings['total'], stage='part_build')
+            elif writer:
+                print("正在生成EPUB文件...")
+                # 封面已在后台与章节同时下载
+                cover = metadata.cover_data()
+                if cover:
+                    writer.set_cover(cover)
+                started = time.perf_counter()
+                writer.close(metadata.book_name, metadata.author)
+                stage_times['epub_write'] += time.perf_counter() - started
+            for stage, seconds in stage_times.items():
+                metrics.stage_seconds.observe(seconds, stage=stage)
+
+            status['missing'] = failed
+            if failed:
+                print(f"有 {len(failed)} 个章节重试后仍下载失败：" +
+                      "、".join(chapter["title"] for chapter in failed[:20]) +
+                      ("等" if len(failed) > 20 else ""))
+        except BaseException:
+            transformer.abort()
+            if writer:
+                writer.abort()
+            if txt_writer:
+                txt_writer.abort()
+            if index_writers:
+                for index_writer in index_writers:
+                    index_writer.abort()
+            raise
+
+        # 生成文件名；分册为“书名_序号_分卷名.epub”
+        filename = sanitize_filename(metadata.book_name) or f"book_{book_id}"
+        if not write_epub:
+            epub_files = []
+        elif len(parts) > 1:
+            digits = max(len(str(len(parts))), 2)
+            epub_files = [
+                f"{filename}_{part['number']:0{digits}d}_{sanitize_filename(part['label'])}.epub"
+                for part in parts
+            ]
+        else:
+            epub_files = [f"{filename}.epub"]
+        txt_files = [f"{filename}.txt"] if write_txt else []
+        files = epub_files + txt_files
+        temp_paths = part_paths + ([txt_path] if write_txt else [])
+        status['files'] = files
+
+        # 封面下载失败时哈希不同，下次会重新生成并补上封面
+        cover = cover_digest(metadata.cover_data())
+        digest = build_hash.hexdigest(metadata.book_name, metadata.author, metadata.pic, cover)
+        if previous and previous.get('build_hash') == digest and manifest_files(previous) == files \
+                and outputs_exist(previous):
+            # 生成的文件与已有的文件逐字节相同，丢弃临时文件，不改动已有的文件
+            for temp_path in temp_paths:
+                os.remove(temp_path)
+            if index_writers:
+                for index_writer in index_writers:
+                    index_writer.abort()
+            print(f"《{metadata.book_name}》内容没有变化，保留现有文件")
+            status['state'] = 'skipped'
+            return
+
+        # 临时文件写完后原子地改名，/download/下不会出现写了一半的文件
+        for temp_path, name in zip(temp_paths, files):
+            os.replace(temp_path, os.path.join('download', name))
+        if index_writers:
+            for index_writer, name in zip(index_writers, epub_files or txt_files):
+                index_writer.commit(name, metadata.book_name)
+        print(f"文件已保存为：{'、'.join(os.path.join('download', name) for name in files)}")
+
+        # 只记录下载成功的章节，失败的章节在下次更新时会重新获取
+        if txt_ranges:
+            save_txt_ranges(book_id, txt_ranges)
+        save_manifest(book_id, metadata.book_name, files, [
+            chapter for idx, chapter in enumerate(chapters) if idx in succeeded
+        ], split, digest, job.format, cover, transforms)
+        # 有下载记录的书籍的章节固定在缓存中，不会被淘汰，下次更新只需获取新章节
+        cache.pin(chapters[idx]["item_id"] for idx in succeeded)
+        # 清单只记录这次生成的文件：分册方式或输出格式改变后，上次生成而这次没有覆盖的文件已过时，
+        # 留下来既不会再更新，删除时也无法清理清单
+        for name in manifest_files(previous) if previous else ():
+            if name not in files and os.path.exists(os.path.join('download', name)):
+                os.remove(os.path.join('download', name))
+                get_catalog().remove(name)
+                if index_writers:
+                    get_index().remove(name)
+        if not write_txt:
+            delete_txt_ranges(book_id)
+
+        http_stats = http_client.get_stats()
+        print(f"连接统计：新建连接 {http_stats['connections']} 次，"
+              f"请求 {http_stats['requests']} 次，复用 {http_stats['reused']} 次")
+        
+        # 记录到书库目录
+        for part, name in zip(parts, epub_files):
+            get_catalog().record(name, book_id, metadata.book_name, metadata.author, part['end'] - part['start'])
+        for name in txt_files:
+            get_catalog().record(name, book_id, metadata.book_name, metadata.author, total_chapters)
+        events.notify()
+
+    except Exception as e:
+        error_msg = str(e)
+        print(f"程序出错：{error_msg}")
+        status['error'] = error_msg
+    finally:
+        status['last_update'] = int(time.time())
+        if status['error']:
+            metrics.books.inc(result='failed')
+        else:
+            metrics.books.inc(result='skipped' if status['state'] == 'skipped' else 'done')
+        events.notify()
@@ -0,0 +1,194 @@
+"""上游接口池：章节列表和章节内容各自可以配置多个等价的地址
+
+每个请求选择预计最快完成的健康地址（延迟EWMA按排队情况折算），单个地址的并发上限用满时
+请求自然分摊到其他地址；请求失败时立即换一个没试过的地址。
+连续失败的地址被标记为不可用；后台线程定期用最近一次成功的请求参数探测不可用和长时间
+没有请求的地址，更新其延迟，恢复的地址重新参与选择。
+"""
+import math
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import http_client
+from host_control import get_controller, classify_status
+
+CHAPTER_LIST = 'chapter_list'
+CONTENT = 'content'
+DEFAULT_ENDPOINTS = {
+    CHAPTER_LIST: ["https://api.cenguigui.cn/api/tomato/api/all_items.php"],
+    CONTENT: ["https://fanqie.tutuxka.top/content.php"],
+}
+# 用环境变量替换地址，多个地址用逗号分隔
+ENV_VARS = {
+    CHAPTER_LIST: 'FANQIE_CHAPTER_LIST_API',
+    CONTENT: 'FANQIE_CONTENT_API',
+}
+# 连续失败几次后标记为不可用
+FAILURE_THRESHOLD = 3
+# 后台健康检查的间隔和探测请求的超时（秒）
+HEALTH_CHECK_INTERVAL = 30
+PROBE_TIMEOUT = 5
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        # 延迟EWMA、并发上限和Retry-After冷却都由所在主机的AIMD控制器维护
+        self.controller = get_controller(url)
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_used = 0.0
+        self.last_probe = None
+
+    def request_url(self, params):
+        return f"{self.url}?{urlencode(params)}"
+
+    def expected_seconds(self, fallback_latency):
+        """新请求预计多久完成：有空闲名额时为延迟EWMA，否则按前面排队的轮数折算，冷却中再加上剩余冷却时间"""
+        controller = self.controller
+        with controller.lock:
+            latency = controller.latency if controller.latency is not None else fallback_latency
+            limit = max(int(controller.limit), 1)
+            queued = controller.in_flight + len(controller.waiters)
+            cooldown = max(controller.cooldown_until - time.time(), 0.0)
+        return cooldown + latency * math.ceil((queued + 1) / limit), queued
+
+    def stats(self):
+        controller_stats = self.controller.stats()
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'latency_ms': controller_stats['latency_ms'],
+            'in_flight': controller_stats['in_flight'],
+            'requests': self.requests,
+            'failures': self.failures,
+            'last_probe': self.last_probe
+        }
+
+
+class EndpointPool:
+    """一种接口的全部地址"""
+
+    def __init__(self, role, urls):
+        if not urls:
+            raise Exception(f"没有配置{role}接口地址")
+        self.role = role
+        self.endpoints = [Endpoint(url) for url in dict.fromkeys(urls)]
+        self.lock = threading.Lock()
+        self.probe_params = None  # 最近一次成功请求的参数，健康检查时复用
+
+    def choose(self, exclude=()):
+        """选择预计最快完成的地址；exclude中的地址不再选择（失败切换或对冲时使用）
+
+        健康的地址都已排除时返回None；所有地址都不可用时仍返回其中最好的一个，避免任务完全停住。
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+        if not healthy:
+            if exclude:
+                return None
+            healthy = candidates
+        if len(healthy) == 1:
+            return healthy[0]
+        # 还没有延迟数据的地址按已知最快的延迟估计，保证新地址能尽快被试到
+        known = [endpoint.controller.latency for endpoint in healthy if endpoint.controller.latency is not None]
+        fallback = min(known) if known else 0.0
+        best, best_key = None, None
+        for endpoint in healthy:
+            seconds, queued = endpoint.expected_seconds(fallback)
+            key = (seconds, queued)
+            if best_key is None or key < best_key:
+                best, best_key = endpoint, key
+        return best
+
+    def report(self, endpoint, ok, params=None):
+        """记录一次请求的结果；连续失败达到阈值时标记为不可用"""
+        with self.lock:
+            endpoint.requests += 1
+            endpoint.last_used = time.time()
+            if ok:
+                endpoint.consecutive_failures = 0
+                if not endpoint.healthy:
+                    endpoint.healthy = True
+                    print(f"接口已恢复：{endpoint.url}")
+                if params is not None:
+                    self.probe_params = params
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            # 只剩一个地址时标记为不可用也没有别的地址可选，只在有多个地址时标记
+            if endpoint.healthy and len(self.endpoints) > 1 \
+                    and endpoint.consecutive_failures >= FAILURE_THRESHOLD:
+                endpoint.healthy = False
+                print(f"接口连续失败 {endpoint.consecutive_failures} 次，暂停使用：{endpoint.url}")
+
+    def probe(self, endpoint):
+        """健康检查：用最近一次成功的请求参数请求一次，结果同样计入主机的延迟和成功率"""
+        params = self.probe_params
+        controller = endpoint.controller
+        # 冷却中（上游要求暂停）或还不知道可用的请求参数时不探测
+        if params is None or controller.cooldown_until > time.time():
+            return
+        started = controller.acquire()
+        outcome = 'error'
+        try:
+            response = http_client.get(endpoint.url, params=params, timeout=PROBE_TIMEOUT)
+            outcome = classify_status(response.status_code)
+        except Exception:
+            outcome = 'error'
+        finally:
+            controller.release(started, outcome)
+        endpoint.last_probe = int(time.time())
+        self.report(endpoint, outcome == 'ok')
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+
+def configured_urls(role):
+    value = os.environ.get(ENV_VARS[role])
+    if value:
+        return [url.strip() for url in value.split(',') if url.strip()]
+    return DEFAULT_ENDPOINTS[role]
+
+
+_pools = {}
+_lock = threading.Lock()
+_health_thread = None
+
+
+def _health_check_loop():
+    while True:
+        time.sleep(HEALTH_CHECK_INTERVAL)
+        with _lock:
+            pools = list(_pools.values())
+        for pool in pools:
+            if len(pool.endpoints) < 2:
+                continue
+            idle_since = time.time() - HEALTH_CHECK_INTERVAL
+            for endpoint in pool.endpoints:
+                if not endpoint.healthy or endpoint.last_used < idle_since:
+                    pool.probe(endpoint)
+
+
+def get_pool(role):
+    """获取某种接口的地址池（首次使用时按配置创建；有多个地址时启动后台健康检查）"""
+    global _health_thread
+    with _lock:
+        pool = _pools.get(role)
+        if pool is None:
+            pool = _pools[role] = EndpointPool(role, configured_urls(role))
+            if len(pool.endpoints) > 1 and _health_thread is None:
+                _health_thread = threading.Thread(target=_health_check_loop, daemon=True)
+                _health_thread.start()
+        return pool
+
+
+def get_stats():
+    with _lock:
+        pools = list(_pools.values())
+    return {pool.role: pool.stats() for pool in pools}
@@ -0,0 +1,168 @@
+"""分册输出：按分卷或每N章把一本书拆成多个EPUB，各分册在进程池中同时生成
+
+章节按顺序到达时先追加到该分册的临时文件（spool），分册的最后一章写入后立即交给进程池
+渲染并打包，与后续章节的下载同时进行。主进程内存中只保留分册的划分，每个分册的大小和
+生成时间只与分册的章节数有关，与整本书的长度无关。
+"""
+import os
+import pickle
+import time
+
+from chapter_render import render_chapter
+from epub_writer import StreamingEpubWriter
+from process_pool import get_executor
+
+SPLIT_VOLUME = 'volume'
+# 按卷分册时单卷超过这个章节数会再拆开，保证单个分册不会过大
+MAX_PART_CHAPTERS = 1000
+
+
+def parse_split(value):
+    """解析分册方式：空为不分册，'volume'为按卷，正整数为每N章一册；无效时抛出异常"""
+    if value in (None, '', 0, '0'):
+        return None
+    if str(value).strip() == SPLIT_VOLUME:
+        return SPLIT_VOLUME
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        size = 0
+    if size <= 0:
+        raise Exception(f"分册方式无效：{value}（可用：volume 或 每册章节数）")
+    return size
+
+
+def plan_parts(chapters, split):
+    """按分册方式划分章节，返回[{'number', 'start', 'end', 'label'}]，章节范围为[start, end)"""
+    if not split or not chapters:
+        return [{'number': 1, 'start': 0, 'end': len(chapters), 'label': ''}]
+    ranges = []
+    if split == SPLIT_VOLUME:
+        start = 0
+        for idx in range(1, len(chapters) + 1):
+            if idx == len(chapters) or chapters[idx].get('volume') != chapters[start].get('volume'):
+                volume = chapters[start].get('volume') or f"第{len(ranges) + 1}卷"
+                pieces = range(start, idx, MAX_PART_CHAPTERS)
+                for number, piece in enumerate(pieces):
+                    label = volume if len(pieces) == 1 else f"{volume}（{number + 1}）"
+                    ranges.append((piece, min(piece + MAX_PART_CHAPTERS, idx), label))
+                start = idx
+    else:
+        for start in range(0, len(chapters), split):
+            end = min(start + split, len(chapters))
+            ranges.append((start, end, f"第{start + 1}-{end}章"))
+    return [
+        {'number': number, 'start': start, 'end': end, 'label': label}
+        for number, (start, end, label) in enumerate(ranges, 1)
+    ]
+
+
+def part_of(parts, idx):
+    """第idx章所在分册的序号（从0开始）"""
+    low, high = 0, len(parts) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if parts[middle]['start'] <= idx:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def build_part(spool_path, path, identifier, title, author, cover):
+    """在处理进程中运行：读取分册的章节，渲染并写入EPUB，返回各阶段耗时"""
+    render_seconds = 0.0
+    started = time.perf_counter()
+    writer = StreamingEpubWriter(path, identifier)
+    try:
+        with open(spool_path, 'rb') as f:
+            while True:
+                try:
+                    chapter_title, content, volume = pickle.load(f)
+                except EOFError:
+                    break
+                rendered = time.perf_counter()
+                body = render_chapter(chapter_title, content)
+                render_seconds += time.perf_counter() - rendered
+                writer.add_chapter(chapter_title, body, volume)
+        if cover:
+            writer.set_cover(cover)
+        writer.close(title, author)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        os.remove(spool_path)
+    total = time.perf_counter() - started
+    return {'render': render_seconds, 'epub_write': total - render_seconds, 'total': total}
+
+
+class PartedEpubWriter:
+    """按顺序追加章节，分册写满后交给进程池生成
+
+    prefix为临时文件的路径前缀；book_info()返回(书名, 作者, 封面数据)，在提交分册时调用，
+    此时元数据通常早已从先完成的章节中得到。
+    """
+
+    def __init__(self, parts, prefix, identifier, book_info):
+        self.parts = parts
+        self.prefix = prefix
+        self.identifier = identifier
+        self.book_info = book_info
+        self.paths = [f"{prefix}_part{part['number']}.epub.part" for part in parts]
+        self.futures = []
+        self.current = None  # 正在写入的分册的spool文件
+
+    def _spool_path(self, number):
+        return f"{self.prefix}_part{number}.spool"
+
+    def add_chapter(self, idx, title, content, volume=None):
+        """追加第idx章的原始正文（渲染在处理进程中进行）
+
+        正文为空的章节不会写入，分册按章节序号而不是写入的章节数划分。
+        """
+        self._advance(idx)
+        if self.current is None:
+            self.current = open(self._spool_path(self.parts[len(self.futures)]['number']), 'wb')
+        pickle.dump((title, content, volume), self.current, pickle.HIGHEST_PROTOCOL)
+        self._advance(idx + 1)
+
+    def _advance(self, idx):
+        """提交第idx章之前已经结束的分册"""
+        while len(self.futures) < len(self.parts) and idx >= self.parts[len(self.futures)]['end']:
+            self._submit(self.parts[len(self.futures)])
+
+    def _submit(self, part):
+        if self.current is None:
+            # 分册内的章节都没有写入时仍生成一个只有目录的分册，保持分册编号连续
+            self.current = open(self._spool_path(part['number']), 'wb')
+        self.current.close()
+        self.current = None
+        book_name, author, cover = self.book_info()
+        title = f"{book_name} {part['label']}"
+        self.futures.append(get_executor().submit(
+            build_part, self._spool_path(part['number']), self.paths[part['number'] - 1],
+            f"{self.identifier}-{part['number']}", title, author, cover
+        ))
+
+    def close(self):
+        """提交剩余的分册，等待全部分册生成完成，返回每个分册的耗时"""
+        self._advance(self.parts[-1]['end'])
+        return [future.result() for future in self.futures]
+
+    def abort(self):
+        if self.current:
+            self.current.close()
+            self.current = None
+        for future in self.futures:
+            future.cancel()
+        for future in self.futures:
+            if not future.cancelled():
+                try:
+                    future.result()
+                except Exception:
+                    pass
+        for part, path in zip(self.parts, self.paths):
+            for leftover in (path, self._spool_path(part['number'])):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
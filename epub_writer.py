@@ -0,0 +1,218 @@
+"""流式EPUB生成：章节XHTML按顺序直接写入zip，内存中只保留目录和书脊等少量元数据
+
+输出可复现：zip内文件的顺序、时间戳和属性以及dcterms:modified都是固定的，
+相同的内容总是生成逐字节相同的文件。时间取自环境变量SOURCE_DATE_EPOCH，未设置时为1980-01-01。
+"""
+import os
+import time
+import zipfile
+from html import escape
+
+# zip格式能表示的最早时间
+DEFAULT_EPOCH = 315532800
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="EPUB/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+XHTML_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="{lang}" xml:lang="{lang}">
+<head>
+<title>{title}</title>
+</head>
+<body>
+{body}
+</body>
+</html>
+'''
+
+
+class StreamingEpubWriter:
+    """按顺序追加章节的EPUB写入器
+
+    章节内容在add_chapter时立即压缩写入zip文件，不在内存中保留；
+    close时再写入content.opf、toc.ncx、nav.xhtml和封面。
+    章节属于两个以上的分卷时，目录按分卷分为两级。
+    """
+
+    def __init__(self, path, identifier, language='zh', timestamp=None):
+        self.path = path
+        self.identifier = identifier
+        self.language = language
+        self.timestamp = source_date_epoch() if timestamp is None else max(int(timestamp), DEFAULT_EPOCH)
+        self.chapters = []  # (文件名, 标题, 分卷名)
+        self.cover = None  # (文件名, 数据, 媒体类型)
+        self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        # mimetype必须是第一个文件且不压缩
+        self._write('mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+        self._write('META-INF/container.xml', CONTAINER_XML)
+
+    def add_chapter(self, title, body, volume=None):
+        """写入一个章节，body为<body>内的XHTML片段，volume为所属分卷名"""
+        file_name = f"chapter_{len(self.chapters)}.xhtml"
+        self._write_xhtml(file_name, title, body)
+        self.chapters.append((file_name, title, volume))
+
+    def set_cover(self, data, file_name='cover.jpg', media_type='image/jpeg'):
+        self.cover = (file_name, data, media_type)
+
+    def _write(self, name, data, compress_type=zipfile.ZIP_DEFLATED):
+        # 固定时间戳、权限和创建系统，不使用当前时间
+        info = zipfile.ZipInfo(name, time.gmtime(self.timestamp)[:6])
+        info.compress_type = compress_type
+        info.create_system = 3
+        info.external_attr = 0o644 << 16
+        self.zip.writestr(info, data)
+
+    def _write_xhtml(self, file_name, title, body):
+        document = XHTML_TEMPLATE.format(lang=self.language, title=escape(title), body=body)
+        self._write(f"EPUB/{file_name}", document.encode('utf-8'))
+
+    def close(self, title, author):
+        """写入导航、目录、封面和opf，完成EPUB文件"""
+        if self.cover:
+            file_name, data, _ = self.cover
+            self._write(f"EPUB/{file_name}", data)
+            self._write_xhtml(
+                'cover.xhtml', 'Cover',
+                f'<img src="{file_name}" alt="Cover" style="height:100%"/>'
+            )
+        self._write_xhtml('nav.xhtml', title, self._nav_body(title))
+        self._write('EPUB/toc.ncx', self._ncx(title).encode('utf-8'))
+        self._write('EPUB/content.opf', self._opf(title, author).encode('utf-8'))
+        self.zip.close()
+
+    def abort(self):
+        """出错时关闭并删除未完成的文件"""
+        try:
+            self.zip.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _volumes(self):
+        """按分卷把连续的章节分组，返回[(分卷名, [(序号, 文件名, 标题)...])]；不足两卷时返回None"""
+        groups = []
+        for idx, (file_name, chapter_title, volume) in enumerate(self.chapters):
+            if not groups or groups[-1][0] != volume:
+                groups.append((volume, []))
+            groups[-1][1].append((idx, file_name, chapter_title))
+        if len({volume for volume, _ in groups if volume}) < 2:
+            return None
+        return groups
+
+    def _nav_body(self, title):
+        def chapter_items(chapters):
+            return '\n'.join(
+                f'<li><a href="{file_name}">{escape(chapter_title)}</a></li>'
+                for _, file_name, chapter_title in chapters
+            )
+
+        volumes = self._volumes()
+        if volumes:
+            items = '\n'.join(
+                f'<li><span>{escape(volume or "")}</span>\n<ol>\n{chapter_items(chapters)}\n</ol></li>'
+                for volume, chapters in volumes
+            )
+        else:
+            items = chapter_items(
+                (idx, file_name, chapter_title)
+                for idx, (file_name, chapter_title, _) in enumerate(self.chapters)
+            )
+        return (
+            f'<nav epub:type="toc" id="id" role="doc-toc">\n<h2>{escape(title)}</h2>\n'
+            f'<ol>\n{items}\n</ol>\n</nav>'
+        )
+
+    def _ncx(self, title):
+        def chapter_points(chapters):
+            return '\n'.join(
+                f'<navPoint id="chapter_{idx}"><navLabel><text>{escape(chapter_title)}</text></navLabel>'
+                f'<content src="{file_name}"/></navPoint>'
+                for idx, file_name, chapter_title in chapters
+            )
+
+        volumes = self._volumes()
+        if volumes:
+            # 分卷节点指向本卷第一章
+            points = '\n'.join(
+                f'<navPoint id="volume_{number}"><navLabel><text>{escape(volume or "")}</text></navLabel>'
+                f'<content src="{chapters[0][1]}"/>\n{chapter_points(chapters)}\n</navPoint>'
+                for number, (volume, chapters) in enumerate(volumes)
+            )
+        else:
+            points = chapter_points(
+                (idx, file_name, chapter_title)
+                for idx, (file_name, chapter_title, _) in enumerate(self.chapters)
+            )
+        return f'''<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+<head>
+<meta name="dtb:uid" content="{escape(self.identifier)}"/>
+<meta name="dtb:depth" content="{2 if volumes else 1}"/>
+<meta name="dtb:totalPageCount" content="0"/>
+<meta name="dtb:maxPageNumber" content="0"/>
+</head>
+<docTitle><text>{escape(title)}</text></docTitle>
+<navMap>
+{points}
+</navMap>
+</ncx>
+'''
+
+    def _opf(self, title, author):
+        manifest = [
+            '<item href="nav.xhtml" id="nav" media-type="application/xhtml+xml" properties="nav"/>',
+            '<item href="toc.ncx" id="ncx" media-type="application/x-dtbncx+xml"/>',
+        ]
+        spine = []
+        cover_meta = ''
+        if self.cover:
+            file_name, _, media_type = self.cover
+            manifest.append(
+                f'<item href="{file_name}" id="cover-img" media-type="{media_type}" properties="cover-image"/>'
+            )
+            manifest.append('<item href="cover.xhtml" id="cover" media-type="application/xhtml+xml"/>')
+            spine.append('<itemref idref="cover" linear="no"/>')
+            cover_meta = '<meta name="cover" content="cover-img"/>'
+        spine.append('<itemref idref="nav"/>')
+        for idx, (file_name, _, _) in enumerate(self.chapters):
+            manifest.append(
+                f'<item href="{file_name}" id="chapter_{idx}" media-type="application/xhtml+xml"/>'
+            )
+            spine.append(f'<itemref idref="chapter_{idx}"/>')
+
+        modified = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.timestamp))
+        manifest_xml = '\n'.join(manifest)
+        spine_xml = '\n'.join(spine)
+        return f'''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="id" version="3.0">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier id="id">{escape(self.identifier)}</dc:identifier>
+<dc:title>{escape(title)}</dc:title>
+<dc:creator>{escape(author)}</dc:creator>
+<dc:language>{escape(self.language)}</dc:language>
+<meta property="dcterms:modified">{modified}</meta>
+{cover_meta}
+</metadata>
+<manifest>
+{manifest_xml}
+</manifest>
+<spine toc="ncx">
+{spine_xml}
+</spine>
+</package>
+'''
+
+
+def source_date_epoch():
+    """生成文件使用的时间（秒）：环境变量SOURCE_DATE_EPOCH，未设置或无效时为DEFAULT_EPOCH"""
+    try:
+        return max(int(os.environ.get('SOURCE_DATE_EPOCH', DEFAULT_EPOCH)), DEFAULT_EPOCH)
+    except ValueError:
+        return DEFAULT_EPOCH
@@ -0,0 +1,95 @@
+"""服务端推送（SSE）进度：状态变化时唤醒订阅者，按最小间隔合并变化，只推送变化的部分"""
+import json
+import threading
+import time
+
+# 两次推送之间的最小间隔（秒），期间的多次变化合并为一次
+MIN_INTERVAL = 0.5
+# 没有变化时定期发送注释行，防止代理断开空闲连接
+HEARTBEAT = 15
+
+
+class ChangeNotifier:
+    """版本计数器：任何状态变化都只需递增版本并唤醒等待者，开销与订阅者数量无关"""
+
+    def __init__(self):
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def notify(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, seen, timeout):
+        """等待版本不同于seen或超时，返回当前版本"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != seen, timeout)
+            return self.version
+
+
+notifier = ChangeNotifier()
+
+
+def notify():
+    notifier.notify()
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream(snapshot, min_interval=MIN_INTERVAL, heartbeat=HEARTBEAT):
+    """SSE事件生成器
+
+    snapshot()返回当前状态：{'jobs': [...], 'queue': [...], 'summary': {...},
+    'hosts': {...}, 'library': [...]}。连接建立时先推送一次完整的snapshot事件，
+    之后只推送变化：job（只含变化字段和id）、order（任务顺序）、summary、hosts、library。
+    """
+    sent_jobs = {}
+    sent = {}
+    seen = notifier.version
+    state = snapshot()
+    yield format_event('snapshot', state)
+    for job in state['jobs'] + state['queue']:
+        sent_jobs[job['id']] = job
+    for key in ('summary', 'hosts', 'library'):
+        sent[key] = state[key]
+    sent['order'] = _order(state)
+
+    while True:
+        version = notifier.wait(seen, heartbeat)
+        if version == seen:
+            yield ": keepalive\n\n"
+            continue
+        seen = version
+        state = snapshot()
+
+        current = {}
+        for job in state['jobs'] + state['queue']:
+            current[job['id']] = job
+            previous = sent_jobs.get(job['id'], {})
+            delta = {key: value for key, value in job.items() if previous.get(key) != value}
+            if delta:
+                delta['id'] = job['id']
+                yield format_event('job', delta)
+        sent_jobs = current
+
+        order = _order(state)
+        if order != sent['order']:
+            sent['order'] = order
+            yield format_event('order', order)
+        for key in ('summary', 'hosts', 'library'):
+            if state[key] != sent[key]:
+                sent[key] = state[key]
+                yield format_event(key, state[key])
+
+        # 合并推送：短时间内的大量进度变化只推送一次
+        time.sleep(min_interval)
+
+
+def _order(state):
+    return {
+        'jobs': [job['id'] for job in state['jobs']],
+        'queue': [job['id'] for job in state['queue']]
+    }
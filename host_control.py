@@ -0,0 +1,214 @@
+"""按上游主机自适应调整并发（AIMD）：健康时逐步加并发，超时/限流/服务端错误时减半"""
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import metrics
+
+INITIAL_LIMIT = 8
+MIN_LIMIT = 1
+# 每主机并发上限的默认最大值，也是线程引擎单本书的线程数上限；
+# 全局并发预算更大时随之提高（见set_max_limit），否则异步引擎对单个主机到不了预算的并发
+MAX_LIMIT = 64
+# 延迟不超过近期最好延迟的2倍、成功率不低于95%时视为健康
+LATENCY_FACTOR = 2.0
+HEALTHY_SUCCESS_RATE = 0.95
+EWMA_ALPHA = 0.1
+MAX_RETRY_AFTER = 120
+# 需要降低并发的失败类型；其余4xx是请求本身的问题，不代表上游过载
+BACKOFF_OUTCOMES = ('timeout', 'http_429', 'http_5xx', 'bad_code', 'error')
+
+
+def classify_status(status_code):
+    """把HTTP状态码归类为结果类型"""
+    if status_code == 429:
+        return 'http_429'
+    if status_code >= 500:
+        return 'http_5xx'
+    if status_code >= 400:
+        return 'http_4xx'
+    return 'ok'
+
+
+def parse_retry_after(value):
+    """解析Retry-After头（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return max(0.0, min(seconds, MAX_RETRY_AFTER))
+
+
+class HostController:
+    """单个上游主机的并发控制
+
+    每次成功且延迟健康时limit增加1/limit（约每轮增加1），
+    需要退避的失败使limit减半；同一轮中发出的请求只触发一次减半。
+    超出limit的请求按先后顺序排队，线程和协程公平地轮流获得名额。
+    """
+
+    def __init__(self, host, initial=INITIAL_LIMIT, minimum=MIN_LIMIT, maximum=None):
+        self.host = host
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or _max_limit
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None  # 延迟EWMA
+        self.best_latency = None
+        self.success_rate = 1.0
+        self.requests = 0
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.waiters = deque()  # 唤醒函数
+        self.timer = None  # Retry-After冷却结束后唤醒排队请求
+
+    def _try_acquire(self, wake):
+        with self.lock:
+            if not self.waiters and time.time() >= self.cooldown_until \
+                    and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            self.waiters.append(wake)
+            return False
+
+    def _wake_waiters(self):
+        """在持有锁时调用：把空出的名额按排队顺序分给等待的请求"""
+        delay = self.cooldown_until - time.time()
+        if delay > 0:
+            if self.timer is None:
+                self.timer = threading.Timer(delay, self._cooldown_finished)
+                self.timer.daemon = True
+                self.timer.start()
+            return
+        while self.waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self.waiters.popleft()()
+
+    def _cooldown_finished(self):
+        with self.lock:
+            self.timer = None
+            self._wake_waiters()
+
+    def acquire(self):
+        """阻塞直到可以发出请求，返回请求开始时间"""
+        event = threading.Event()
+        if not self._try_acquire(event.set):
+            event.wait()
+        return time.time()
+
+    async def acquire_async(self):
+        import asyncio  # 只有异步引擎会调用，延迟导入以加快启动
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        if not self._try_acquire(wake):
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self.lock:
+                    if wake in self.waiters:
+                        self.waiters.remove(wake)
+                        raise
+                    # 已分到名额但协程被取消，归还名额
+                    self.in_flight -= 1
+                    self._wake_waiters()
+                raise
+        return time.time()
+
+    def release(self, started, outcome, retry_after=None):
+        """请求结束后记录结果并调整并发上限"""
+        now = time.time()
+        latency = now - started
+        with self.lock:
+            self.in_flight -= 1
+            if outcome == 'cancelled':
+                # 主动取消的请求（对冲中较慢的一个）不计入统计，也不触发退避
+                self._wake_waiters()
+                return
+            metrics.request_seconds.observe(latency, host=self.host, outcome=outcome)
+            if outcome != 'ok':
+                metrics.request_errors.inc(host=self.host, kind=outcome)
+            self.requests += 1
+            success = outcome == 'ok'
+            self.success_rate += EWMA_ALPHA * ((1.0 if success else 0.0) - self.success_rate)
+
+            if success:
+                self.latency = latency if self.latency is None else \
+                    self.latency + EWMA_ALPHA * (latency - self.latency)
+                # 最好延迟缓慢上浮，避免一次偶然的快速响应让后续请求都显得过慢
+                self.best_latency = latency if self.best_latency is None else \
+                    min(latency, self.best_latency * 1.01)
+                healthy = latency <= self.best_latency * LATENCY_FACTOR and \
+                    self.success_rate >= HEALTHY_SUCCESS_RATE
+                if healthy:
+                    self.limit = min(self.limit + 1.0 / self.limit, self.maximum)
+            else:
+                self.failures[outcome] = self.failures.get(outcome, 0) + 1
+                if outcome in BACKOFF_OUTCOMES and started >= self.last_decrease:
+                    self.limit = max(self.limit / 2, self.minimum)
+                    self.last_decrease = now
+
+            if retry_after:
+                self.cooldown_until = max(self.cooldown_until, now + retry_after)
+            self._wake_waiters()
+
+    def set_maximum(self, maximum):
+        with self.lock:
+            self.maximum = maximum
+            self.limit = min(self.limit, maximum)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'latency_ms': round(self.latency * 1000) if self.latency is not None else None,
+                'success_rate': round(self.success_rate, 3),
+                'cooldown': round(max(self.cooldown_until - time.time(), 0), 1),
+                'requests': self.requests,
+                'failures': dict(self.failures)
+            }
+
+
+_controllers = {}
+_lock = threading.Lock()
+_max_limit = MAX_LIMIT
+
+
+def set_max_limit(maximum):
+    """设置每主机并发上限的最大值（不低于MAX_LIMIT），已有的控制器同时生效"""
+    global _max_limit
+    with _lock:
+        _max_limit = max(int(maximum), MAX_LIMIT)
+        controllers = list(_controllers.values())
+    for controller in controllers:
+        controller.set_maximum(_max_limit)
+
+
+def get_controller(url):
+    """按URL的主机获取（或创建）并发控制器"""
+    host = urlsplit(url).netloc
+    with _lock:
+        controller = _controllers.get(host)
+        if controller is None:
+            controller = _controllers[host] = HostController(host)
+        return controller
+
+
+def get_stats():
+    with _lock:
+        controllers = list(_controllers.values())
+    return {controller.host: controller.stats() for controller in controllers}
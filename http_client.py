@@ -0,0 +1,107 @@
+"""共享HTTP客户端：按主机复用连接池，统一默认请求头，并统计握手/复用次数"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 所有上游请求共用的默认请求头
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 8
+# 同时缓存的主机连接池数量（章节、目录、封面等几个上游主机）
+POOL_CONNECTIONS = 16
+
+_lock = threading.Lock()
+_session = None
+_pool_size = 0
+# 扩容时被替换掉的旧连接池的累计统计，按主机保存
+_retired_stats = {}
+
+
+def _mount_adapters(session, pool_size):
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=pool_size,
+        pool_block=False
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return adapter
+
+
+def _pool_stats(adapter):
+    """读取adapter下每个主机连接池的统计（新建连接数即握手次数）"""
+    stats = {}
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+        entry = stats.setdefault(host, {"connections": 0, "requests": 0})
+        entry["connections"] += pool.num_connections
+        entry["requests"] += pool.num_requests
+    return stats
+
+
+def _merge_stats(target, source):
+    for host, entry in source.items():
+        merged = target.setdefault(host, {"connections": 0, "requests": 0})
+        merged["connections"] += entry["connections"]
+        merged["requests"] += entry["requests"]
+
+
+def get_session(pool_size=None):
+    """获取共享Session；pool_size大于当前每主机连接池大小时自动扩容"""
+    global _session, _pool_size
+    wanted = max(pool_size or DEFAULT_POOL_SIZE, 1)
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(DEFAULT_HEADERS)
+            _mount_adapters(_session, wanted)
+            _pool_size = wanted
+        elif wanted > _pool_size:
+            # 只扩不缩：换上更大的连接池，旧连接池的统计计入累计值
+            old_adapter = _session.get_adapter("https://")
+            _merge_stats(_retired_stats, _pool_stats(old_adapter))
+            _mount_adapters(_session, wanted)
+            old_adapter.close()
+            _pool_size = wanted
+        return _session
+
+
+def get(url, **kwargs):
+    """通过共享Session发起GET请求，默认超时10秒"""
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return get_session().get(url, **kwargs)
+
+
+def get_stats():
+    """返回连接复用统计：每个主机的握手次数、请求数和复用次数"""
+    with _lock:
+        hosts = {}
+        _merge_stats(hosts, _retired_stats)
+        if _session is not None:
+            _merge_stats(hosts, _pool_stats(_session.get_adapter("https://")))
+        pool_size = _pool_size
+
+    total_connections = 0
+    total_requests = 0
+    for entry in hosts.values():
+        entry["reused"] = max(entry["requests"] - entry["connections"], 0)
+        total_connections += entry["connections"]
+        total_requests += entry["requests"]
+
+    return {
+        "pool_size": pool_size,
+        "connections": total_connections,
+        "requests": total_requests,
+        "reused": max(total_requests - total_connections, 0),
+        "hosts": hosts
+    }
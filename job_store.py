@@ -0,0 +1,128 @@
+"""持久化任务队列：任务记录在SQLite（WAL模式）中，程序重启后自动恢复未完成的任务"""
+import os
+import sqlite3
+import threading
+import time
+
+from epub_parts import parse_split
+from scheduler import Job
+
+STORE_PATH = os.path.join('download', '.cache', 'jobs.db')
+# 这段时间内完成的书籍不会被重复加入队列（秒）
+RECENT_WINDOW = 24 * 3600
+# 启动时清理超过这个时间的已结束任务记录（秒）
+KEEP_FINISHED = 30 * 24 * 3600
+FINISHED_STATES = ('done', 'skipped', 'failed')
+
+
+class JobStore:
+    """任务记录：加入队列时写入，开始和结束时更新状态"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                book_id TEXT NOT NULL,
+                max_workers INTEGER NOT NULL,
+                priority INTEGER NOT NULL,
+                engine TEXT NOT NULL,
+                update_mode INTEGER NOT NULL,
+                max_attempts INTEGER NOT NULL,
+                transforms TEXT NOT NULL DEFAULT '',
+                split TEXT NOT NULL DEFAULT '',
+                format TEXT NOT NULL DEFAULT 'epub',
+                state TEXT NOT NULL,
+                error TEXT,
+                created REAL NOT NULL,
+                finished REAL
+            )
+        """)
+        # 旧版本创建的表没有transforms、split和format列
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, default in (('transforms', ''), ('split', ''), ('format', 'epub')):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT NOT NULL DEFAULT '{default}'")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_book ON jobs(book_id, finished)")
+        self.conn.commit()
+
+    def add(self, jobs):
+        """在一个事务中写入一批新任务，并把数据库分配的id设为任务id"""
+        now = time.time()
+        with self.lock:
+            for job in jobs:
+                cursor = self.conn.execute(
+                    "INSERT INTO jobs (book_id, max_workers, priority, engine, update_mode, "
+                    "max_attempts, transforms, split, format, state, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+                    (job.book_id, job.max_workers, job.priority, job.engine, int(job.update),
+                     job.max_attempts, ','.join(job.transforms), str(job.split or ''), job.format, now)
+                )
+                job.id = job.status['id'] = cursor.lastrowid
+            self.conn.commit()
+
+    def update(self, job):
+        """记录任务的当前状态"""
+        finished = time.time() if job.status['state'] in FINISHED_STATES else None
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished = ? WHERE id = ?",
+                (job.status['state'], job.status['error'], finished, job.id)
+            )
+            self.conn.commit()
+
+    def unfinished(self):
+        """上次退出时还在排队或下载中的任务，按原来的id重建"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, book_id, max_workers, priority, engine, update_mode, max_attempts, transforms, split, "
+                "format, created "
+                "FROM jobs WHERE state IN ('queued', 'running') ORDER BY id"
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            job_id, book_id, max_workers, priority, engine, update, max_attempts, transforms, split, \
+                output_format, created = row
+            job = Job(book_id, max_workers, priority, engine, bool(update), max_attempts,
+                      [name for name in transforms.split(',') if name], parse_split(split), output_format)
+            job.id = job.status['id'] = job_id
+            job.status['created'] = int(created)
+            jobs.append(job)
+        return jobs
+
+    def recent_book_ids(self, window=RECENT_WINDOW):
+        """最近成功完成（或无需更新）的book_id"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT book_id FROM jobs WHERE state IN ('done', 'skipped') AND finished >= ?",
+                (time.time() - window,)
+            )
+            return {row[0] for row in rows}
+
+    def prune(self, keep=KEEP_FINISHED):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (time.time() - keep,)
+            )
+            self.conn.commit()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """获取全局任务记录（首次使用时创建）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore(STORE_PATH)
+            _store.prune()
+        return _store
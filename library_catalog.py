@@ -0,0 +1,166 @@
+"""书库目录：用SQLite记录已生成的书籍文件（EPUB和TXT）及其元数据，支持分页、筛选和排序查询"""
+import os
+import sqlite3
+import threading
+
+LIBRARY_DIR = 'download'
+CATALOG_PATH = os.path.join(LIBRARY_DIR, '.cache', 'library.db')
+# /library允许的排序字段
+SORT_FIELDS = ('name', 'author', 'chapters', 'size', 'mtime')
+MAX_PAGE_SIZE = 200
+BOOK_EXTENSIONS = ('.epub', '.txt')
+
+
+class LibraryCatalog:
+    """书库目录
+
+    下载完成和删除书籍时直接更新目录；手动放入或删除的文件通过reconcile发现：
+    只有download目录的mtime变化时才重新扫描目录，逐个文件按mtime和大小判断是否需要更新。
+    """
+
+    def __init__(self, path, directory=LIBRARY_DIR):
+        self.path = path
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.version = 0  # 每次目录内容变化时递增，用于推送书库变化
+        self.dir_mtime = None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS books (
+                filename TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                book_id TEXT,
+                author TEXT,
+                chapters INTEGER,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL
+            )
+        """)
+        for field in ('name', 'author', 'chapters', 'size', 'mtime'):
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_books_{field} ON books({field})")
+        self.conn.commit()
+
+    def record(self, filename, book_id=None, name=None, author=None, chapters=None):
+        """下载完成后记录书籍"""
+        stat = os.stat(os.path.join(self.directory, filename))
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO books (filename, name, book_id, author, chapters, size, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (filename, name or os.path.splitext(filename)[0], book_id and str(book_id),
+                 author, chapters, stat.st_size, stat.st_mtime)
+            )
+            self.conn.commit()
+            self.version += 1
+
+    def remove(self, filename):
+        with self.lock:
+            self.conn.execute("DELETE FROM books WHERE filename = ?", (filename,))
+            self.conn.commit()
+            self.version += 1
+
+    def reconcile(self, force=False):
+        """与download目录同步；目录mtime未变化时直接返回"""
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime
+        except OSError:
+            return
+        with self.lock:
+            if not force and dir_mtime == self.dir_mtime:
+                return
+            known = {
+                filename: (size, mtime)
+                for filename, size, mtime in self.conn.execute("SELECT filename, size, mtime FROM books")
+            }
+            seen = set()
+            changed = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(BOOK_EXTENSIONS) or not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    stat = entry.stat()
+                    if known.get(entry.name) != (stat.st_size, stat.st_mtime):
+                        changed.append((entry.name, stat))
+            removed = [(filename,) for filename in known if filename not in seen]
+
+            for filename, stat in changed:
+                if filename in known:
+                    # 文件被替换：保留已知的书籍信息，只更新大小和时间
+                    self.conn.execute(
+                        "UPDATE books SET size = ?, mtime = ? WHERE filename = ?",
+                        (stat.st_size, stat.st_mtime, filename)
+                    )
+                else:
+                    self.conn.execute(
+                        "INSERT INTO books (filename, name, size, mtime) VALUES (?, ?, ?, ?)",
+                        (filename, os.path.splitext(filename)[0], stat.st_size, stat.st_mtime)
+                    )
+            self.conn.executemany("DELETE FROM books WHERE filename = ?", removed)
+            self.conn.commit()
+            self.dir_mtime = dir_mtime
+            if changed or removed:
+                self.version += 1
+
+    def query(self, page=1, page_size=50, q='', sort='mtime', order='desc'):
+        """分页查询；q按书名或作者筛选"""
+        if sort not in SORT_FIELDS:
+            raise Exception(f"不支持的排序字段：{sort}")
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        page = max(int(page), 1)
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+
+        where, params = '', []
+        if q:
+            pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where = "WHERE name LIKE ? ESCAPE '\\' OR author LIKE ? ESCAPE '\\'"
+            params = [pattern, pattern]
+
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM books {where}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT filename, name, book_id, author, chapters, size, mtime FROM books {where} "
+                f"ORDER BY {sort} {direction}, filename LIMIT ? OFFSET ?",
+                params + [page_size, (page - 1) * page_size]
+            ).fetchall()
+        return {
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'books': [
+                {
+                    'filename': filename,
+                    'name': name,
+                    'book_id': book_id,
+                    'author': author,
+                    'chapters': chapters,
+                    'size': size,
+                    'mtime': int(mtime)
+                }
+                for filename, name, book_id, author, chapters, size, mtime in rows
+            ]
+        }
+
+    def summary(self):
+        """书库概况（数量和版本），页面据此判断是否需要重新加载当前页"""
+        with self.lock:
+            total = self.conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+            return {'total': total, 'version': self.version}
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """获取全局书库目录（首次使用时创建并与download目录同步）"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = LibraryCatalog(CATALOG_PATH)
+            _catalog.reconcile(force=True)
+        return _catalog
@@ -0,0 +1,200 @@
+"""每本书的章节清单：记录已下载的item_id和标题，用于增量更新连载中的书籍
+
+清单中的build_hash是上次生成结果的内容哈希，内容没有变化时不重新生成文件。
+生成了TXT的书籍另有一个.ranges文件，记录每章在TXT中的字节范围，用于单独读取某一章。
+"""
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_DIR = os.path.join('download', '.manifests')
+# 生成的文件格式改变时加一，使旧的build_hash全部失效
+BUILD_VERSION = 1
+
+
+def _manifest_path(book_id):
+    return os.path.join(MANIFEST_DIR, f"{book_id}.json")
+
+
+def _ranges_path(book_id):
+    return os.path.join(MANIFEST_DIR, f"{book_id}.ranges")
+
+
+def _write_json(path, data):
+    # 先写临时文件再替换，避免中途退出留下半个文件
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(book_id):
+    """读取书籍清单，不存在或已损坏时返回None"""
+    try:
+        with open(_manifest_path(book_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(book_id, book_name, files, chapters, split=None, build_hash=None, format='epub', cover=None,
+                  transforms=()):
+    """下载完成后保存清单，先写临时文件再替换，避免中途退出留下半个文件
+
+    files为生成的文件名列表（分册输出时有多个），filename记录第一个，兼容旧版本的清单；
+    split、format和transforms为生成时的分册方式、输出格式和正文处理步骤，改变时即使没有新章节也需要重新生成；
+    build_hash见BuildHash，cover为生成时使用的封面的哈希（没有封面时为None）。
+    """
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    manifest = {
+        'book_id': str(book_id),
+        'book_name': book_name,
+        'filename': files[0],
+        'files': list(files),
+        'split': split,
+        'build_hash': build_hash,
+        'format': format,
+        'cover': cover,
+        'transforms': list(transforms),
+        'updated': int(time.time()),
+        'chapters': [
+            {'item_id': str(chapter['item_id']), 'title': chapter['title']}
+            for chapter in chapters
+        ]
+    }
+    _write_json(_manifest_path(book_id), manifest)
+    return manifest
+
+
+def save_txt_ranges(book_id, ranges):
+    """保存每章在TXT中的[起始字节, 结束字节]，没有写入的章节为None"""
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    _write_json(_ranges_path(book_id), ranges)
+
+
+def delete_txt_ranges(book_id):
+    if os.path.exists(_ranges_path(book_id)):
+        os.remove(_ranges_path(book_id))
+
+
+def load_txt_ranges(book_id):
+    try:
+        with open(_ranges_path(book_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def manifest_files(manifest):
+    """清单对应的全部文件名（旧版本的清单只有filename）"""
+    return manifest.get('files') or [manifest['filename']]
+
+
+def build_options(manifest):
+    """上次生成时的分册方式、输出格式和正文处理步骤，没有下载记录时为空"""
+    if not manifest:
+        return {}
+    options = {'split': manifest.get('split'), 'format': manifest.get('format', 'epub')}
+    # 旧版本的清单没有记录正文处理步骤
+    if 'transforms' in manifest:
+        options['transforms'] = manifest['transforms']
+    return options
+
+
+def outputs_exist(manifest):
+    return all(os.path.exists(os.path.join('download', name)) for name in manifest_files(manifest))
+
+
+def cover_digest(data):
+    """封面数据的哈希，没有封面时为None"""
+    return hashlib.sha256(data).hexdigest() if data else None
+
+
+class BuildHash:
+    """生成结果的内容哈希：元数据、封面、生成选项、章节列表和按顺序的各章节正文哈希
+
+    生成的文件是可复现的，哈希相同时文件逐字节相同，可以直接保留已有的文件。
+    """
+
+    def __init__(self, chapters, options):
+        self.options = options
+        self.chapter_list = hashlib.sha256(json.dumps([
+            [str(chapter['item_id']), chapter['title'], chapter.get('volume')] for chapter in chapters
+        ], ensure_ascii=False).encode('utf-8')).hexdigest()
+        self.contents = hashlib.sha256()
+
+    def add(self, result):
+        """按章节顺序加入一章的下载结果；None为下载失败的章节"""
+        if result is None:
+            self.contents.update(b'\0' * 32)
+        else:
+            self.contents.update(hashlib.sha256((result.get('content') or '').encode('utf-8')).digest())
+
+    def hexdigest(self, book_name, author, pic, cover):
+        """cover为实际使用的封面的哈希（cover_digest），封面下载失败时为None"""
+        payload = json.dumps({
+            'version': BUILD_VERSION,
+            'options': self.options,
+            'book_name': book_name,
+            'author': author,
+            'pic': pic,
+            'cover': cover,
+            'chapters': self.chapter_list,
+            'contents': self.contents.hexdigest()
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def list_manifests():
+    manifests = []
+    if os.path.exists(MANIFEST_DIR):
+        for name in os.listdir(MANIFEST_DIR):
+            if name.endswith('.json'):
+                manifest = load_manifest(os.path.splitext(name)[0])
+                if manifest:
+                    manifests.append(manifest)
+    return manifests
+
+
+def delete_manifests_for(filename):
+    """删除书籍文件（或其中一个分册）时从清单中去掉这个文件，返回因此没有剩余文件而被删除的清单
+
+    清单还有其他文件时只更新清单：删除TXT时一并删除章节范围，并清除内容哈希，
+    下次下载这本书时会重新生成全部文件而不是保留剩下的文件。
+    """
+    deleted = []
+    for manifest in list_manifests():
+        files = manifest_files(manifest)
+        if filename not in files:
+            continue
+        book_id = manifest['book_id']
+        remaining = [name for name in files if name != filename]
+        if filename.endswith('.txt') or not remaining:
+            delete_txt_ranges(book_id)
+        if not remaining:
+            os.remove(_manifest_path(book_id))
+            deleted.append(manifest)
+            continue
+        extensions = {os.path.splitext(name)[1] for name in remaining}
+        manifest.update({
+            'filename': remaining[0],
+            'files': remaining,
+            'format': 'both' if len(extensions) > 1 else extensions.pop().lstrip('.'),
+            'build_hash': None
+        })
+        _write_json(_manifest_path(book_id), manifest)
+    return deleted
+
+
+def diff_chapters(manifest, chapters):
+    """对比清单与最新章节列表，返回(新增, 标题变化, 已移除)的item_id集合"""
+    known = {chapter['item_id']: chapter['title'] for chapter in manifest['chapters']}
+    latest = {str(chapter['item_id']): chapter['title'] for chapter in chapters}
+    added = {item_id for item_id in latest if item_id not in known}
+    changed = {
+        item_id for item_id, title in latest.items()
+        if item_id in known and known[item_id] != title
+    }
+    removed = {item_id for item_id in known if item_id not in latest}
+    return added, changed, removed
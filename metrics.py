@@ -0,0 +1,132 @@
+"""运行指标：计数器、直方图和回调式仪表，按Prometheus文本格式输出（/metrics）"""
+import threading
+
+# 延迟直方图的分桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # 标签 -> [各分桶计数..., 总数, 总和]
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels, key, {'le': bound})
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, key, {'le': '+Inf'})
+                lines.append(f"{self.name}_bucket{labels} {counts[-2]}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_count{labels} {counts[-2]}")
+                lines.append(f"{self.name}_sum{labels} {_format_value(round(counts[-1], 6))}")
+        return lines
+
+
+class Gauge:
+    """输出时调用collect()取当前值；带标签时collect()返回{标签值元组: 数值}"""
+
+    def __init__(self, name, help_text, collect, labels=()):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+        self.labels = tuple(labels)
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = self.collect()
+        if not self.labels:
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# 上游请求：每个请求结束时由host_control记录
+request_seconds = Histogram(
+    'fanqie_upstream_request_seconds', "上游请求耗时（秒）", ('host', 'outcome')
+)
+request_errors = Counter(
+    'fanqie_upstream_errors_total', "上游请求失败次数，按失败类型", ('host', 'kind')
+)
+# 章节：每个章节有最终结果时记录
+chapters = Counter('fanqie_chapters_total', "章节数，按结果（downloaded/cached/failed）", ('result',))
+chapter_bytes = Counter('fanqie_chapter_bytes_total', "下载的章节响应字节数")
+# 每本书各阶段耗时：chapter_list、chapter_fetch、render、epub_write、cover；
+# render和epub_write为全书各章节耗时之和
+stage_seconds = Histogram(
+    'fanqie_stage_seconds', "每本书各阶段耗时（秒）", ('stage',), STAGE_BUCKETS
+)
+# 每本书各正文处理步骤的累计耗时（所有处理进程上的耗时之和）
+transform_seconds = Histogram(
+    'fanqie_transform_seconds', "每本书各正文处理步骤的耗时（秒）", ('transform',), STAGE_BUCKETS
+)
+books = Counter('fanqie_books_total', "结束的下载任务数，按结果", ('result',))
@@ -0,0 +1,29 @@
+"""共享进程池：正文处理、分册EPUB生成等CPU密集的工作在子进程中进行，不与下载线程争用GIL"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+WORKERS = os.cpu_count() or 1
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    """全局进程池（首次使用时创建，所有任务共用）"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            # 使用spawn：下载线程运行时fork出的子进程可能继承其他线程持有的锁
+            _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def shutdown():
+    """关闭进程池；在multiprocessing子进程中使用后需要调用，否则子进程退出时会一直等待池中的进程"""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
@@ -0,0 +1,53 @@
+"""章节重试与对冲请求：失败章节按带抖动的指数退避重试，慢请求超过p95延迟时发出对冲请求"""
+import random
+import threading
+from collections import deque
+
+# 每个章节最多尝试的次数（含第一次）
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# 至少积累这么多次成功请求的延迟后才开始对冲
+HEDGE_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_DELAY = 0.05
+# 对冲请求最多占用并发上限的25%（至少1个）
+HEDGE_RATIO = 0.25
+LATENCY_SAMPLES = 200
+
+
+def backoff_delay(attempt):
+    """第attempt次失败后的等待秒数：指数增长，并在0.5~1.5倍之间随机抖动"""
+    delay = min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def hedge_capacity(concurrency):
+    return max(1, int(concurrency * HEDGE_RATIO))
+
+
+class LatencyTracker:
+    """记录最近成功请求的延迟，提供对冲阈值（p95）"""
+
+    def __init__(self, size=LATENCY_SAMPLES):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.cached = None
+        self.dirty = 0
+
+    def add(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+            self.dirty += 1
+
+    def threshold(self):
+        """返回对冲阈值秒数，样本不足时返回None"""
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            # 每积累10个新样本重新排序一次
+            if self.cached is None or self.dirty >= 10:
+                ordered = sorted(self.samples)
+                self.cached = ordered[min(int(len(ordered) * HEDGE_PERCENTILE), len(ordered) - 1)]
+                self.dirty = 0
+            return max(self.cached, HEDGE_MIN_DELAY)
@@ -0,0 +1,296 @@
+"""多书并发调度：多本书同时下载，共享一个全局章节请求并发预算"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+
+from retry_policy import MAX_ATTEMPTS
+
+
+def env_int(name, default):
+    """读取正整数环境变量，未设置时返回default，无效时抛出异常"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise Exception(f"环境变量{name}无效：{value}（应为正整数）")
+    return number
+
+
+# 所有书籍共享的章节请求并发上限（异步引擎单本书最多512并发，但总数不超过这个预算）
+GLOBAL_CONCURRENCY = env_int('FANQIE_GLOBAL_CONCURRENCY', 32)
+# 同时进行的书籍数量上限
+MAX_ACTIVE_JOBS = env_int('FANQIE_MAX_ACTIVE_JOBS', 4)
+# 状态中保留的已结束任务数量
+RECENT_JOBS = 20
+# 状态中列出的排队任务数量上限，其余只计数
+QUEUE_PREVIEW = 50
+PRIORITIES = {'low': -1, 'normal': 0, 'high': 1}
+
+
+class Job:
+    """一个下载任务；status为对外展示的任务状态，由下载流程直接更新"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, book_id, max_workers=8, priority=0, engine='thread', update=False,
+                 max_attempts=MAX_ATTEMPTS, transforms=(), split=None, format='epub'):
+        self.id = next(self._ids)
+        self.book_id = str(book_id)
+        self.max_workers = max(int(max_workers), 1)
+        self.priority = int(priority)
+        # 加权公平分配：优先级每高一级，分到的并发份额翻倍
+        self.weight = 2 ** self.priority
+        self.engine = engine
+        self.update = update
+        self.max_attempts = max_attempts
+        self.transforms = tuple(transforms)  # 正文后处理步骤（text_transforms中登记的名称）
+        self.split = split  # 分册方式：None不分册，'volume'按卷，整数为每册章节数
+        self.format = format  # 输出格式：epub、txt或both
+        self.budget = None
+        self.slots = 0  # 当前占用的全局并发名额
+        self.status = {
+            'id': self.id,
+            'book_id': self.book_id,
+            'book_name': '',
+            'state': 'queued',
+            'priority': self.priority,
+            'max_workers': self.max_workers,
+            'engine': engine,
+            'update': update,
+            'transforms': list(self.transforms),
+            'split': split,
+            'format': format,
+            'total_chapters': 0,
+            'downloaded': 0,
+            'bytes_downloaded': 0,
+            'chapters_per_sec': 0.0,
+            'bytes_per_sec': 0.0,
+            'in_flight': 0,
+            'eta': None,
+            'error': None,
+            'missing': [],  # 重试后仍失败的章节
+            'transform_seconds': {},  # 各正文处理步骤的累计耗时
+            'files': [],  # 生成的文件（分册输出时有多个）
+            'created': int(time.time()),
+            'started': None,
+            'finished': None,
+            'last_update': int(time.time())
+        }
+
+    def acquire(self):
+        """发出章节请求前占用一个全局并发名额（未加入调度器时不受限制）"""
+        if self.budget:
+            self.budget.acquire(self)
+
+    async def acquire_async(self):
+        if self.budget:
+            await self.budget.acquire_async(self)
+
+    def release(self):
+        if self.budget:
+            self.budget.release(self)
+
+
+class WorkerBudget:
+    """全局并发预算
+
+    名额不足时请求方排队等待；有名额释放时，在等待的任务中选择
+    (占用名额+1)/权重 最小的一个，实现按优先级加权的公平分配。
+    """
+
+    def __init__(self, total=GLOBAL_CONCURRENCY):
+        self.total = total
+        self.in_use = 0
+        self.lock = threading.Lock()
+        self.waiters = {}  # job -> deque[唤醒函数]
+
+    def _grant(self, job):
+        self.in_use += 1
+        job.slots += 1
+
+    def _try_grant(self, job, wake):
+        with self.lock:
+            if self.in_use < self.total and not self.waiters:
+                self._grant(job)
+                return True
+            self.waiters.setdefault(job, deque()).append(wake)
+            return False
+
+    def acquire(self, job):
+        event = threading.Event()
+        if not self._try_grant(job, event.set):
+            event.wait()
+
+    async def acquire_async(self, job):
+        import asyncio  # 只有异步引擎会调用，延迟导入以加快启动
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        if self._try_grant(job, wake):
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                queue = self.waiters.get(job)
+                if queue and wake in queue:
+                    # 还没分到名额，撤销排队
+                    queue.remove(wake)
+                    if not queue:
+                        del self.waiters[job]
+                    raise
+            # 已经分到名额但任务被取消，归还名额
+            self.release(job)
+            raise
+
+    def release(self, job):
+        with self.lock:
+            self.in_use -= 1
+            job.slots -= 1
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self.in_use < self.total and self.waiters:
+            chosen = min(self.waiters, key=lambda j: (j.slots + 1) / j.weight)
+            queue = self.waiters[chosen]
+            wake = queue.popleft()
+            if not queue:
+                del self.waiters[chosen]
+            self._grant(chosen)
+            wake()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'total': self.total,
+                'in_use': self.in_use,
+                'waiting_jobs': len(self.waiters)
+            }
+
+
+class Scheduler:
+    """任务调度器：按优先级和提交顺序启动任务，最多同时运行max_active本书"""
+
+    def __init__(self, run_job, global_concurrency=GLOBAL_CONCURRENCY, max_active=MAX_ACTIVE_JOBS,
+                 on_change=None, store=None):
+        self.run_job = run_job
+        self.on_change = on_change  # 任务加入、开始、结束时回调
+        self.store = store  # 任务记录（job_store.JobStore），为None时任务只保存在内存中
+        self.budget = WorkerBudget(global_concurrency)
+        self.max_active = max_active
+        self.pending = []
+        self.active = []
+        self.recent = deque(maxlen=RECENT_JOBS)
+        self.lock = threading.Lock()
+        self.last_update = int(time.time())
+
+    def submit(self, job):
+        self.submit_many([job])
+        return job
+
+    def submit_many(self, jobs):
+        """加入一批任务；有任务记录时先在一个事务中持久化"""
+        if self.store and jobs:
+            self.store.add(jobs)
+        self._enqueue(jobs)
+        return jobs
+
+    def resume(self):
+        """重新加入上次退出时未完成的任务"""
+        if not self.store:
+            return []
+        jobs = self.store.unfinished()
+        self._enqueue(jobs)
+        return jobs
+
+    def _enqueue(self, jobs):
+        for job in jobs:
+            job.budget = self.budget
+        with self.lock:
+            self.pending.extend(jobs)
+            self.last_update = int(time.time())
+        self._dispatch()
+        self._changed()
+
+    def book_ids(self):
+        """排队中和进行中任务的book_id，用于去重"""
+        with self.lock:
+            return {job.book_id for job in self.pending + self.active}
+
+    def counts(self):
+        """排队和进行中的任务数"""
+        with self.lock:
+            return {'queued': len(self.pending), 'running': len(self.active)}
+
+    def is_busy(self):
+        with self.lock:
+            return bool(self.pending or self.active)
+
+    def _dispatch(self):
+        started = []
+        with self.lock:
+            while self.pending and len(self.active) < self.max_active:
+                # 优先级高的先开始，同优先级按提交顺序
+                job = min(self.pending, key=lambda j: (-j.priority, j.id))
+                self.pending.remove(job)
+                self.active.append(job)
+                job.status['state'] = 'running'
+                job.status['started'] = int(time.time())
+                started.append(job)
+        for job in started:
+            self._persist(job)
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        if started:
+            self._changed()
+
+    def _persist(self, job):
+        if self.store:
+            self.store.update(job)
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def _run(self, job):
+        try:
+            self.run_job(job)
+            if job.status['state'] == 'running':
+                job.status['state'] = 'failed' if job.status['error'] else 'done'
+        except Exception as e:
+            job.status['state'] = 'failed'
+            job.status['error'] = str(e)
+        finally:
+            job.status['finished'] = int(time.time())
+            job.status['last_update'] = int(time.time())
+            self._persist(job)
+            with self.lock:
+                self.active.remove(job)
+                self.recent.appendleft(job)
+                self.last_update = int(time.time())
+            self._changed()
+            self._dispatch()
+
+    def snapshot(self):
+        with self.lock:
+            pending = heapq.nsmallest(QUEUE_PREVIEW, self.pending, key=lambda j: (-j.priority, j.id))
+            jobs = self.active + list(self.recent)
+            last_update = max([self.last_update] + [j.status['last_update'] for j in jobs])
+            return {
+                'is_downloading': bool(self.active),
+                'queue': [dict(job.status) for job in pending],
+                'queue_length': len(self.pending),
+                'jobs': [dict(job.status) for job in jobs],
+                'budget': self.budget.stats(),
+                'last_update': last_update
+            }
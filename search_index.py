@@ -0,0 +1,249 @@
+"""全文搜索索引：生成EPUB时把章节正文写入SQLite FTS5（trigram分词，适合中文），搜索时无需打开EPUB
+
+trigram索引只能查3个字及以上的词；中文里常见的1~2个字的词（人名、常用词）由另一个逐字分词的索引负责。
+"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+
+from chapter_render import plain_text
+
+INDEX_PATH = os.path.join('download', '.cache', 'search.db')
+# 每积累这么多章节写入一次索引
+BATCH_SIZE = 200
+MAX_LIMIT = 100
+SNIPPET_CHARS = 40
+
+
+def spaced(text):
+    """在每个字符之间插入空格，unicode61分词后每个字（字母、数字）成为一个词元"""
+    return ' '.join(text) if text else ''
+
+
+def make_snippet(content, terms, width=SNIPPET_CHARS):
+    """截取第一个命中词附近的正文，命中词用<mark>标出，其余部分已转义"""
+    positions = [(content.find(term), term) for term in terms]
+    positions = [(pos, term) for pos, term in positions if pos >= 0]
+    if not positions:
+        return escape(content[:width * 2])
+    pos, term = min(positions)
+    start = max(pos - width, 0)
+    end = min(pos + len(term) + width, len(content))
+    text = content[start:end].replace('\n', ' ')
+    snippet = escape(text)
+    for term in sorted(set(terms), key=len, reverse=True):
+        snippet = snippet.replace(escape(term), f'<mark>{escape(term)}</mark>')
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(content) else '')
+
+
+class SearchIndex:
+    """章节全文索引
+
+    documents表记录每个章节属于哪本书，chapters_fts保存标题和正文并建立trigram索引，
+    chapters_chars是逐字分词的无内容（contentless）索引，用于1~2个字的关键词，不重复保存正文；
+    三者通过rowid对应，按书删除时不需要扫描全文表。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.create_function('spaced', 1, spaced)
+        try:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chapters_fts "
+                "USING fts5(title, content, tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            self.conn.close()
+            raise Exception(f"全文搜索需要SQLite 3.34以上并启用FTS5（当前版本 {sqlite3.sqlite_version}）")
+        has_chars = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'chapters_chars'"
+        ).fetchone()
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chapters_chars "
+            "USING fts5(title, content, content='', tokenize='unicode61')"
+        )
+        if not has_chars:
+            # 旧版本的索引没有逐字索引，从trigram表中补建
+            self.conn.execute(
+                "INSERT INTO chapters_chars (rowid, title, content) "
+                "SELECT rowid, spaced(title), spaced(content) FROM chapters_fts"
+            )
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                filename TEXT NOT NULL,
+                book_id TEXT,
+                book_name TEXT,
+                chapter_index INTEGER NOT NULL,
+                title TEXT NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents(filename)")
+        # 上次退出时未完成的生成留下的临时索引
+        self._delete_where("book_name IS NULL")
+        self.conn.commit()
+
+    def add_chapters(self, filename, book_id, chapters):
+        """写入一批章节，chapters为(章节序号, 标题, 正文)"""
+        with self.lock:
+            for chapter_index, title, content in chapters:
+                cursor = self.conn.execute(
+                    "INSERT INTO documents (filename, book_id, book_name, chapter_index, title) "
+                    "VALUES (?, ?, NULL, ?, ?)",
+                    (filename, str(book_id), chapter_index, title)
+                )
+                text = plain_text(content)
+                self.conn.execute(
+                    "INSERT INTO chapters_fts (rowid, title, content) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, title, text)
+                )
+                self.conn.execute(
+                    "INSERT INTO chapters_chars (rowid, title, content) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, spaced(title), spaced(text))
+                )
+            self.conn.commit()
+
+    def rename(self, old_filename, filename, book_name):
+        """生成完成后把临时名下的章节改到最终文件名下，并替换同名文件的旧索引"""
+        with self.lock:
+            self._remove(filename)
+            self.conn.execute(
+                "UPDATE documents SET filename = ?, book_name = ? WHERE filename = ?",
+                (filename, book_name, old_filename)
+            )
+            self.conn.commit()
+
+    def remove(self, filename):
+        """删除一本书的全部索引"""
+        with self.lock:
+            self._remove(filename)
+            self.conn.commit()
+
+    def _remove(self, filename):
+        self._delete_where("filename = ?", (filename,))
+
+    def _delete_where(self, condition, params=()):
+        """删除documents中满足条件的章节及其全文索引"""
+        rowids = f"SELECT id FROM documents WHERE {condition}"
+        # 无内容索引删除时要提供原来写入的值，由trigram表中保存的正文重新生成
+        self.conn.execute(
+            "INSERT INTO chapters_chars (chapters_chars, rowid, title, content) "
+            f"SELECT 'delete', rowid, spaced(title), spaced(content) FROM chapters_fts WHERE rowid IN ({rowids})",
+            params
+        )
+        self.conn.execute(f"DELETE FROM chapters_fts WHERE rowid IN ({rowids})", params)
+        self.conn.execute(f"DELETE FROM documents WHERE {condition}", params)
+
+    def search(self, q, limit=20, offset=0):
+        """按空格分隔的关键词搜索（全部命中），返回章节命中和摘要
+
+        3个字及以上的关键词走trigram索引，更短的关键词只在命中的章节中逐行匹配；
+        全部是短关键词时走逐字索引（相邻的字组成短语），再逐行确认原文中确实连续出现
+        （逐字索引会忽略标点和空白）。
+        """
+        terms = [term for term in q.split() if term]
+        if not terms:
+            return {'hits': [], 'has_more': False}
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        offset = max(int(offset), 0)
+        long_terms = [term for term in terms if len(term) >= 3]
+        short_terms = [term for term in terms if len(term) < 3]
+
+        # 只由标点组成的关键词在逐字索引中没有词元，只能逐行匹配
+        char_terms = [term for term in short_terms if any(ch.isalnum() for ch in term)]
+
+        where, params = [], []
+        source = "chapters_fts"
+        if long_terms:
+            where.append("chapters_fts MATCH ?")
+            params.append(' AND '.join('"' + term.replace('"', '""') + '"' for term in long_terms))
+            order = "ORDER BY rank"
+        elif char_terms:
+            # 由逐字索引按rowid顺序给出命中的章节，取够一页就停止，不需要先找出全部命中
+            source = "chapters_chars JOIN chapters_fts ON chapters_fts.rowid = chapters_chars.rowid"
+            where.append("chapters_chars MATCH ?")
+            params.append(' AND '.join('"' + spaced(term).replace('"', '""') + '"' for term in char_terms))
+            order = "ORDER BY chapters_chars.rowid"
+        else:
+            order = "ORDER BY chapters_fts.rowid"
+        for term in short_terms:
+            where.append("(chapters_fts.title LIKE ? ESCAPE '\\' OR chapters_fts.content LIKE ? ESCAPE '\\')")
+            pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            params += [pattern, pattern]
+
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT d.filename, d.book_id, d.book_name, d.chapter_index, d.title, chapters_fts.content "
+                f"FROM {source} JOIN documents d ON d.id = chapters_fts.rowid "
+                f"WHERE {' AND '.join(where)} AND d.book_name IS NOT NULL {order} LIMIT ? OFFSET ?",
+                params + [limit + 1, offset]
+            ).fetchall()
+        return {
+            'hits': [
+                {
+                    'filename': filename,
+                    'book_id': book_id,
+                    'book_name': book_name,
+                    'chapter_index': chapter_index,
+                    'title': title,
+                    'snippet': make_snippet(content, terms)
+                }
+                for filename, book_id, book_name, chapter_index, title, content in rows[:limit]
+            ],
+            'has_more': len(rows) > limit
+        }
+
+
+# 索引写入在单独的线程中按提交顺序进行，不阻塞写EPUB的线程
+_writer_executor = ThreadPoolExecutor(max_workers=1)
+
+
+class IndexWriter:
+    """一次EPUB生成对应的索引写入：章节先写在临时名下，生成成功后再改为最终文件名"""
+
+    def __init__(self, index, book_id, staging_name):
+        self.index = index
+        self.book_id = book_id
+        self.staging_name = staging_name
+        self.pending = []
+
+    def add(self, chapter_index, title, content):
+        self.pending.append((chapter_index, title, content))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            _writer_executor.submit(
+                self.index.add_chapters, self.staging_name, self.book_id, self.pending
+            )
+            self.pending = []
+
+    def commit(self, filename, book_name):
+        self.flush()
+        _writer_executor.submit(self.index.rename, self.staging_name, filename, book_name).result()
+
+    def abort(self):
+        self.pending = []
+        _writer_executor.submit(self.index.remove, self.staging_name).result()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """获取全局搜索索引（首次使用时创建）"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex(INDEX_PATH)
+        return _index
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import async_engine
+from retry_policy import HEDGE_MIN_SAMPLES, LatencyTracker
+
+
+class Controller:
+    """主机控制器：gate打开前所有请求都在排队"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.acquired = 0
+
+    async def acquire_async(self):
+        await self.gate.wait()
+        self.acquired += 1
+        return time.time()
+
+    def release(self, started, outcome, retry_after=None):
+        pass
+
+
+class Endpoint:
+    def __init__(self):
+        self.controller = Controller()
+
+    def request_url(self, params):
+        return f"http://upstream/content?item_id={params['item_id']}"
+
+
+class Pool:
+    def __init__(self):
+        self.endpoint = Endpoint()
+
+    def choose(self, tried=()):
+        return self.endpoint if self.endpoint not in tried else None
+
+    def report(self, endpoint, ok, context=None):
+        pass
+
+
+class Response:
+    status = 200
+    headers = {}
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        return b'{"content": "x"}'
+
+
+class Session:
+    def __init__(self, delay):
+        self.delay = delay
+        self.requests = 0
+
+    def get(self, url):
+        self.requests += 1
+        return Response(self.delay)
+
+
+def fetch(queued, delay):
+    """原请求在主机控制器处排队queued秒，发出后delay秒返回；返回发出的请求数"""
+    latencies = LatencyTracker()
+    for _ in range(HEDGE_MIN_SAMPLES):
+        latencies.add(0.01)
+    pool = Pool()
+    session = Session(delay)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.call_later(queued, pool.endpoint.controller.gate.set)
+        result = await async_engine._fetch_hedged(
+            session, asyncio.Semaphore(4), asyncio.Semaphore(1), pool, '1',
+            lambda data: data, None, None, latencies
+        )
+        assert result['content'] == 'x'
+
+    asyncio.run(run())
+    return session.requests
+
+
+def test_queued_request_is_not_hedged():
+    assert fetch(queued=0.3, delay=0.01) == 1
+
+
+def test_slow_request_is_hedged():
+    assert fetch(queued=0, delay=0.3) == 2
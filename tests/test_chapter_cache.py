@@ -0,0 +1,49 @@
+from chapter_cache import ChapterCache
+
+
+def make_cache(tmp_path, max_bytes):
+    return ChapterCache(str(tmp_path / 'chapters.db'), max_bytes=max_bytes, compress=False)
+
+
+def test_pinned_chapters_are_not_evicted(tmp_path):
+    cache = make_cache(tmp_path, 1000)
+    for item_id in range(5):
+        cache.put(item_id, {'content': 'x' * 150})
+    cache.pin(range(5))
+    for item_id in range(5, 20):
+        cache.put(item_id, {'content': 'x' * 150})
+
+    assert cache.cached_ids(range(5)) == {'0', '1', '2', '3', '4'}
+    assert len(cache.cached_ids(range(5, 20))) < 15
+    assert cache.stats()['bytes'] <= 1000
+
+
+def test_unpinned_chapters_rejoin_eviction(tmp_path):
+    cache = make_cache(tmp_path, 1000)
+    for item_id in range(5):
+        cache.put(item_id, {'content': 'x' * 150})
+    cache.pin(range(5))
+    pinned_bytes = cache.stats()['pinned_bytes']
+    cache.put(0, {'content': 'y' * 150})
+    assert cache.stats()['pinned_bytes'] == pinned_bytes
+
+    cache.unpin(range(5))
+    assert cache.stats()['pinned_bytes'] == 0
+    for item_id in range(5, 20):
+        cache.put(item_id, {'content': 'x' * 150})
+    assert not cache.cached_ids(range(5))
+
+
+def test_pinned_state_survives_reopen(tmp_path):
+    cache = make_cache(tmp_path, 1000)
+    cache.put('a', {'content': 'x' * 150})
+    cache.put('b', {'content': 'x' * 150})
+    cache.pin(['a'])
+    cache.conn.close()
+
+    reopened = make_cache(tmp_path, 1000)
+    stats = reopened.stats()
+    assert stats['pinned_bytes'] > 0 and stats['bytes'] > 0
+    assert stats['pinned_bytes'] + stats['bytes'] == sum(
+        row[0] for row in reopened.conn.execute("SELECT size FROM chapters")
+    )
@@ -0,0 +1,25 @@
+from xml.dom import minidom
+
+from chapter_render import MARKUP_RE, render_chapter
+
+
+def parse(title, content):
+    return minidom.parseString(f'<body>{render_chapter(title, content)}</body>'.encode('utf-8'))
+
+
+def test_text_that_looks_like_a_tag_is_escaped():
+    assert not MARKUP_RE.search("a<b & c>d")
+    assert not MARKUP_RE.search("1<2 且 3>2")
+    assert MARKUP_RE.search("<p class=\"x\">正文</p>")
+    assert MARKUP_RE.search("第一行<br/>第二行")
+    assert "a&lt;b &amp; c&gt;d" in parse("标题", "a<b & c>d").toxml()
+
+
+def test_invalid_xml_characters_are_removed():
+    for content in ("正文\x01第二\x0b句", "<p>正文\x01</p>", "<p>&#1;正文</p>"):
+        assert "正文" in parse("标题\x0c", content).toxml()
+
+
+def test_markup_with_invalid_attributes_is_well_formed():
+    dom = parse("标题", "<p>正文</p>a<b & c>d<x:y z:w=\"1\">e</x:y>")
+    assert "a" in dom.toxml() and "e" in dom.toxml()
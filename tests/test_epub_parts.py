@@ -0,0 +1,78 @@
+import zipfile
+
+import pytest
+
+import epub_parts
+import process_pool
+from epub_parts import PartedEpubWriter, part_of, plan_parts
+
+
+@pytest.fixture(autouse=True, scope='module')
+def shutdown_pool():
+    yield
+    process_pool.shutdown()
+
+
+def make_chapters(volumes):
+    return [
+        {'item_id': f"{number}{idx}", 'title': f"第{idx + 1}章", 'volume': f"第{number + 1}卷"}
+        for number, count in enumerate(volumes)
+        for idx in range(count)
+    ]
+
+
+def chapter_titles(path):
+    with zipfile.ZipFile(path) as epub:
+        names = sorted(
+            (name for name in epub.namelist() if name.startswith('EPUB/chapter_')),
+            key=lambda name: int(name[len('EPUB/chapter_'):-len('.xhtml')])
+        )
+        return [epub.read(name).decode('utf-8').split('<title>')[1].split('</title>')[0] for name in names]
+
+
+def test_plan_parts_every_n_chapters():
+    parts = plan_parts(make_chapters([10]), 4)
+    assert [(part['start'], part['end']) for part in parts] == [(0, 4), (4, 8), (8, 10)]
+    assert parts[-1]['label'] == "第9-10章"
+    assert [part_of(parts, idx) for idx in (0, 3, 4, 9)] == [0, 0, 1, 2]
+
+
+def test_plan_parts_by_volume_caps_large_volumes(monkeypatch):
+    monkeypatch.setattr(epub_parts, 'MAX_PART_CHAPTERS', 3)
+    parts = plan_parts(make_chapters([2, 5]), 'volume')
+    assert [(part['start'], part['end'], part['label']) for part in parts] == [
+        (0, 2, "第1卷"), (2, 5, "第2卷（1）"), (5, 7, "第2卷（2）")
+    ]
+
+
+def test_plan_parts_without_split_is_single_part():
+    assert plan_parts(make_chapters([3, 3]), None) == [{'number': 1, 'start': 0, 'end': 6, 'label': ''}]
+
+
+def test_parted_writer_with_skipped_chapters(tmp_path):
+    # 正文为空的章节不会写入：第6章、第9~10章（最后一个分册的末尾）以及整个第3分册
+    parts = plan_parts(make_chapters([14]), 4)
+    skipped = {5, 8, 9, 10, 11, 13}
+    writer = PartedEpubWriter(parts, str(tmp_path / 'book'), 'fanqie-test', lambda: ("书名", "作者", None))
+    for idx in range(14):
+        if idx not in skipped:
+            writer.add_chapter(idx, f"第{idx + 1}章", f"正文{idx + 1}", "第1卷")
+    timings = writer.close()
+
+    assert len(timings) == len(parts) == 4
+    assert [chapter_titles(path) for path in writer.paths] == [
+        ["第1章", "第2章", "第3章", "第4章"],
+        ["第5章", "第7章", "第8章"],
+        [],
+        ["第13章"],
+    ]
+    assert not list(tmp_path.glob('*.spool'))
+
+
+def test_parted_writer_abort_removes_temp_files(tmp_path):
+    parts = plan_parts(make_chapters([6]), 2)
+    writer = PartedEpubWriter(parts, str(tmp_path / 'book'), 'fanqie-test', lambda: ("书名", "作者", None))
+    for idx in range(3):
+        writer.add_chapter(idx, f"第{idx + 1}章", "正文")
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
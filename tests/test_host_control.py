@@ -0,0 +1,21 @@
+import host_control
+
+
+def test_max_limit_follows_global_budget():
+    controller = host_control.HostController('upstream')
+    assert controller.maximum == host_control.MAX_LIMIT
+    try:
+        host_control.set_max_limit(512)
+        assert host_control.HostController('other').maximum == 512
+        host_control.set_max_limit(16)
+        assert host_control.HostController('other').maximum == host_control.MAX_LIMIT
+    finally:
+        host_control.set_max_limit(host_control.MAX_LIMIT)
+
+
+def test_limit_grows_up_to_maximum():
+    controller = host_control.HostController('upstream', initial=100, maximum=128)
+    for _ in range(5000):
+        started = controller.acquire()
+        controller.release(started, 'ok')
+    assert controller.stats()['limit'] == 128
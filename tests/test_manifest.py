@@ -0,0 +1,53 @@
+import os
+
+import manifest
+from manifest import BuildHash, build_options, cover_digest, delete_manifests_for, load_manifest, save_manifest, \
+    save_txt_ranges
+
+CHAPTERS = [{'item_id': '1', 'title': "第1章", 'volume': "第1卷"}, {'item_id': '2', 'title': "第2章", 'volume': "第1卷"}]
+
+
+def build_digest(contents, cover):
+    build_hash = BuildHash(CHAPTERS, {'format': 'epub'})
+    for content in contents:
+        build_hash.add({'content': content} if content is not None else None)
+    return build_hash.hexdigest("书名", "作者", "http://example.com/cover.jpg", cover_digest(cover))
+
+
+def test_same_content_same_hash():
+    assert build_digest(["正文1", "正文2"], b'cover') == build_digest(["正文1", "正文2"], b'cover')
+
+
+def test_missing_cover_changes_hash():
+    assert build_digest(["正文1", "正文2"], None) != build_digest(["正文1", "正文2"], b'cover')
+    assert build_digest(["正文1", "正文2"], b'old') != build_digest(["正文1", "正文2"], b'new')
+
+
+def test_content_and_failed_chapters_change_hash():
+    assert build_digest(["正文1", "正文2"], None) != build_digest(["正文1", "正文二"], None)
+    assert build_digest(["正文1", ""], None) != build_digest(["正文1", None], None)
+
+
+def test_deleting_one_file_keeps_the_rest(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest, 'MANIFEST_DIR', str(tmp_path))
+    files = ["书名_第1-50章.epub", "书名_第51-60章.epub", "书名.txt"]
+    save_manifest('1', "书名", files, CHAPTERS, 50, 'hash', 'both')
+    save_txt_ranges('1', [[0, 10], [10, 20]])
+
+    assert delete_manifests_for("书名.txt") == []
+    kept = load_manifest('1')
+    assert kept['files'] == files[:2] and kept['format'] == 'epub' and kept['build_hash'] is None
+    assert not os.path.exists(manifest._ranges_path('1'))
+
+    assert delete_manifests_for(files[0]) == []
+    assert load_manifest('1')['filename'] == files[1]
+
+    assert [m['book_id'] for m in delete_manifests_for(files[1])] == ['1']
+    assert load_manifest('1') is None
+
+
+def test_build_options_follow_previous_build(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest, 'MANIFEST_DIR', str(tmp_path))
+    save_manifest('1', "书名", ["书名_01_第1卷.epub", "书名.txt"], CHAPTERS, 'volume', 'hash', 'both', None, ['s2t'])
+    assert build_options(load_manifest('1')) == {'split': 'volume', 'format': 'both', 'transforms': ['s2t']}
+    assert build_options(None) == {}
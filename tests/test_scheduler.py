@@ -0,0 +1,30 @@
+import threading
+
+import pytest
+
+from scheduler import Job, WorkerBudget, env_int
+
+
+def test_env_int(monkeypatch):
+    monkeypatch.delenv('FANQIE_TEST_INT', raising=False)
+    assert env_int('FANQIE_TEST_INT', 32) == 32
+    monkeypatch.setenv('FANQIE_TEST_INT', '256')
+    assert env_int('FANQIE_TEST_INT', 32) == 256
+    monkeypatch.setenv('FANQIE_TEST_INT', '0')
+    with pytest.raises(Exception):
+        env_int('FANQIE_TEST_INT', 32)
+
+
+def test_release_wakes_waiting_jobs():
+    budget = WorkerBudget(1)
+    job = Job('1')
+    budget.acquire(job)
+    waiter = threading.Thread(target=budget.acquire, args=(job,))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+
+    budget.release(job)
+    waiter.join(1)
+    assert not waiter.is_alive()
+    assert budget.stats()['in_use'] == 1
@@ -0,0 +1,42 @@
+from search_index import SearchIndex
+
+
+def make_index(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    index.add_chapters('.staging', '1', [
+        (0, "第1章", "<p>张三走进了城门。</p>"),
+        (1, "第2章", "<p>李四，张 三和王五。</p>"),
+        (2, "第3章", "<p>abc城门口</p>"),
+    ])
+    index.rename('.staging', "书名.epub", "书名")
+    return index
+
+
+def chapters(index, q):
+    return [hit['chapter_index'] for hit in index.search(q)['hits']]
+
+
+def test_short_terms_use_char_index(tmp_path):
+    index = make_index(tmp_path)
+    assert chapters(index, "张三") == [0]
+    assert chapters(index, "城门") == [0, 2]
+    assert chapters(index, "王") == [1]
+    assert chapters(index, "bc") == [2]
+    assert chapters(index, "四，") == [1]
+    assert chapters(index, "张三 城门") == [0]
+    assert chapters(index, "城门口") == [2]
+
+
+def test_removed_books_leave_no_index(tmp_path):
+    index = make_index(tmp_path)
+    index.remove("书名.epub")
+    assert chapters(index, "张三") == []
+    assert index.conn.execute("SELECT COUNT(*) FROM chapters_chars WHERE chapters_chars MATCH '张'").fetchone()[0] == 0
+
+
+def test_char_index_is_built_for_old_databases(tmp_path):
+    index = make_index(tmp_path)
+    index.conn.execute("DROP TABLE chapters_chars")
+    index.conn.commit()
+    index.conn.close()
+    assert chapters(SearchIndex(str(tmp_path / 'search.db')), "张三") == [0]
@@ -0,0 +1,194 @@
+"""正文后处理：可插拔的文本转换（空白和段落整理、去除广告行、简繁转换），在进程池中与下载同时进行
+
+转换是签名为 transform(title, content) -> (title, content) 的模块级函数，用@register(名称)登记后
+即可在任务参数transforms中按名称启用，按列出的顺序依次执行。转换在子进程中运行，
+自定义转换所在的模块需要能被导入：把模块名写在环境变量FANQIE_TRANSFORM_MODULES中（逗号分隔）。
+"""
+import importlib
+import os
+import re
+import time
+from collections import deque
+
+from chapter_render import MARKUP_RE
+from process_pool import WORKERS, get_executor
+
+# 名称 -> (转换函数, 启用前的可用性检查)
+TRANSFORMS = {}
+PLUGIN_ENV = 'FANQIE_TRANSFORM_MODULES'
+# 每个处理进程最多对应几个在途章节；超过时写入线程等待最早提交的章节处理完成
+PIPELINE_DEPTH_FACTOR = 4
+
+ZERO_WIDTH_RE = re.compile('[\u200b-\u200f\u2060\ufeff]')
+PARAGRAPH_INDENT = '\u3000\u3000'
+# 行首尾需要去掉的空白（含全角空格和不换行空格）
+WHITESPACE = ' \t\u3000\u00a0'
+# 广告和站点提示行：只删除不超过AD_MAX_LENGTH个字、且整行匹配这些模式之一的行，避免误删正文
+AD_PATTERNS = (
+    r'https?://\S+',
+    r'www\.\S+\.\S+',
+    r'.*本章未完.*',
+    r'.*(请|记得|欢迎)?收藏本站.*',
+    r'.*天才一秒记住.*',
+    r'.*最新章节.*(首发|更新最快|请访问).*',
+    r'.*手机(用户)?请?(浏览|阅读|访问).*',
+    r'.*(求|跪求)(月票|推荐票|打赏|订阅).*',
+    r'.*(番茄小说|番茄免费小说).*(首发|免费阅读|下载).*',
+)
+AD_LINE_RE = re.compile('|'.join(f'(?:{pattern})' for pattern in AD_PATTERNS))
+AD_MAX_LENGTH = 60
+# 连续重复的行至少这么长才删除，短句（如对话中的“啊！”）重复是正常的
+REPEAT_MIN_LENGTH = 10
+
+
+def register(name, check=None):
+    """登记一个转换；check为启用前调用的检查函数，依赖缺失时抛出异常"""
+    def decorator(func):
+        TRANSFORMS[name] = (func, check)
+        return func
+    return decorator
+
+
+def validate(names):
+    """检查转换名称和依赖，返回名称元组；无法使用时抛出异常"""
+    names = tuple(name for name in (names or ()) if name)
+    for name in names:
+        if name not in TRANSFORMS:
+            raise Exception(f"未知的正文处理：{name}（可用：{'、'.join(TRANSFORMS)}）")
+        check = TRANSFORMS[name][1]
+        if check:
+            check()
+    return names
+
+
+@register('normalize')
+def normalize(title, content):
+    """整理空白和段落：统一换行、去掉零宽字符和空行，每段统一用两个全角空格缩进"""
+    title = ' '.join(ZERO_WIDTH_RE.sub('', title).split())
+    if MARKUP_RE.search(content):
+        # 带标签的正文由渲染时的BeautifulSoup整理，这里不按行处理
+        return title, content
+    content = ZERO_WIDTH_RE.sub('', content.replace('\r\n', '\n').replace('\r', '\n'))
+    paragraphs = []
+    for line in content.split('\n'):
+        line = line.strip(WHITESPACE)
+        if line:
+            paragraphs.append(PARAGRAPH_INDENT + line)
+    return title, '\n'.join(paragraphs)
+
+
+@register('strip_ads')
+def strip_ads(title, content):
+    """去掉广告和站点提示行，以及连续重复的较长的行"""
+    lines = []
+    previous = None
+    for line in content.split('\n'):
+        text = line.strip(WHITESPACE)
+        if text and len(text) <= AD_MAX_LENGTH and AD_LINE_RE.fullmatch(text):
+            continue
+        if len(text) >= REPEAT_MIN_LENGTH and text == previous:
+            continue
+        lines.append(line)
+        if text:
+            previous = text
+    return title, '\n'.join(lines)
+
+
+_converters = {}
+
+
+def _opencc(config):
+    converter = _converters.get(config)
+    if converter is None:
+        try:
+            import opencc
+        except ImportError:
+            raise Exception("简繁转换需要安装OpenCC：pip install opencc-python-reimplemented")
+        converter = _converters[config] = opencc.OpenCC(config)
+    return converter
+
+
+@register('s2t', check=lambda: _opencc('s2t'))
+def to_traditional(title, content):
+    """简体转繁体（OpenCC）"""
+    converter = _opencc('s2t')
+    return converter.convert(title), converter.convert(content)
+
+
+@register('t2s', check=lambda: _opencc('t2s'))
+def to_simplified(title, content):
+    """繁体转简体（OpenCC）"""
+    converter = _opencc('t2s')
+    return converter.convert(title), converter.convert(content)
+
+
+def _load_plugins():
+    for module in os.environ.get(PLUGIN_ENV, '').split(','):
+        if module.strip():
+            importlib.import_module(module.strip())
+
+
+_load_plugins()
+
+
+def apply(transforms, title, content):
+    """在处理进程中依次执行转换，返回(title, content, {名称: 耗时})"""
+    timings = {}
+    for name, func in transforms:
+        started = time.perf_counter()
+        title, content = func(title, content)
+        timings[name] = time.perf_counter() - started
+    return title, content, timings
+
+
+class TransformPipeline:
+    """按章节顺序把正文提交到进程池，再按同样的顺序把处理结果交给emit(idx, title, content)
+
+    章节一到齐就提交，处理与后续章节的下载同时进行；在途章节超过上限时才等待最早的一个。
+    没有启用任何转换时直接调用emit。
+    """
+
+    def __init__(self, names, emit):
+        self.transforms = [(name, TRANSFORMS[name][0]) for name in names]
+        self.emit = emit
+        self.executor = get_executor() if self.transforms else None
+        self.depth = WORKERS * PIPELINE_DEPTH_FACTOR
+        self.pending = deque()  # (future, idx, title, content)
+        self.timings = {name: 0.0 for name, _ in self.transforms}
+
+    def put(self, idx, title, content, transform=True):
+        """transform为False的章节（如缺失章节的占位页）不做处理，但仍按顺序输出"""
+        if not self.executor:
+            self.emit(idx, title, content)
+            return
+        future = self.executor.submit(apply, self.transforms, title, content) if transform else None
+        self.pending.append((future, idx, title, content))
+        self._drain(len(self.pending) - self.depth)
+
+    def finish(self):
+        """等待全部章节处理完成并输出"""
+        self._drain(len(self.pending))
+
+    def abort(self):
+        for future, _, _, _ in self.pending:
+            if future:
+                future.cancel()
+        self.pending.clear()
+
+    def _drain(self, required):
+        """按顺序输出已处理完的章节；至少输出required个（不足时等待）"""
+        while self.pending:
+            future = self.pending[0][0]
+            if required <= 0 and future and not future.done():
+                break
+            _, idx, title, content = self.pending.popleft()
+            required -= 1
+            if future:
+                try:
+                    title, content, timings = future.result()
+                    for name, seconds in timings.items():
+                        self.timings[name] += seconds
+                except Exception as e:
+                    # 处理失败时保留原文，不影响整本书
+                    print(f"第{idx + 1}章正文处理失败，保留原文：{str(e) or type(e).__name__}")
+            self.emit(idx, title, content)
@@ -0,0 +1,46 @@
+"""流式TXT生成：章节纯文本按顺序追加到UTF-8文件，并记录每章的字节范围，之后可以只读取其中一章"""
+import os
+
+from chapter_render import plain_text
+
+
+class StreamingTxtWriter:
+    """按章节顺序追加的TXT写入器
+
+    book_info()返回(书名, 作者)，在写入第一章前调用，用于文件开头的书名和作者；
+    volumes为真时在分卷变化处写入分卷名。
+    """
+
+    def __init__(self, path, book_info, volumes=False):
+        self.path = path
+        self.book_info = book_info
+        self.volumes = volumes
+        self.volume = None
+        self.ranges = {}  # 章节序号 -> (起始字节, 结束字节)
+        self.file = open(path, 'wb')
+
+    def add_chapter(self, idx, title, content, volume=None):
+        if self.file.tell() == 0:
+            book_name, author = self.book_info()
+            self.file.write(f"{book_name}\n作者：{author}\n\n".encode('utf-8'))
+        if self.volumes and volume and volume != self.volume:
+            self.file.write(f"\n{volume}\n\n".encode('utf-8'))
+            self.volume = volume
+        lines = [line.rstrip() for line in plain_text(content).replace('\r\n', '\n').split('\n')]
+        text = '\n'.join(line for line in lines if line.strip())
+        start = self.file.tell()
+        self.file.write(f"{title}\n\n{text}\n\n".encode('utf-8'))
+        self.ranges[idx] = (start, self.file.tell())
+
+    def close(self, total):
+        """完成文件，返回长度为total的列表：每章的[起始字节, 结束字节]，没有写入的章节为None"""
+        self.file.close()
+        return [list(self.ranges[idx]) if idx in self.ranges else None for idx in range(total)]
+
+    def abort(self):
+        """出错时关闭并删除未完成的文件"""
+        try:
+            self.file.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
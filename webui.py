@@ -1,50 +1,30 @@
-import requests
-import time
-import json
-import threading
 import re
 import os
-from tqdm import tqdm
-from ebooklib import epub
-from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, render_template_string, jsonify, request, send_from_directory
-import webbrowser
-from queue import Queue
+from urllib.parse import quote
+from flask import Flask, Response, render_template_string, jsonify, request, send_from_directory, \
+    stream_with_context
+import http_client
+import events
+from chapter_cache import get_cache
+from library_catalog import get_catalog
+from search_index import get_index
+from manifest import list_manifests, delete_manifests_for, load_manifest, load_txt_ranges, manifest_files
+from scheduler import Scheduler, PRIORITIES, GLOBAL_CONCURRENCY, MAX_ACTIVE_JOBS
+from job_store import get_job_store
+import host_control
+import endpoints
+import metrics
+from retry_policy import MAX_ATTEMPTS
+from text_transforms import validate as validate_transforms
+from epub_parts import parse_split
+from downloader import ENGINES, FORMATS, AUTO_MAX_WORKERS, max_workers_limit, new_job, run_job
 
 app = Flask(__name__)
+# 流式输出TXT时每次读取的字节数
+TXT_CHUNK_SIZE = 64 * 1024
 
-# 创建下载目录
-if not os.path.exists('download'):
-    os.makedirs('download')
-
-# 全局变量存储下载状态和队列
-download_status = {
-    'total_chapters': 0,
-    'downloaded': 0,
-    'current_book': '',
-    'is_downloading': False,
-    'error': None,
-    'last_update': 0,  # 添加时间戳字段
-    'queue': [],  # 下载队列
-    'queue_position': 0,  # 当前下载的位置
-    'completed_books': []  # 已完成的书籍列表
-}
-
-# 从download目录加载已完成的书籍
-def load_completed_books():
-    completed_books = []
-    if os.path.exists('download'):
-        for filename in os.listdir('download'):
-            if filename.endswith('.epub'):
-                completed_books.append({
-                    'name': os.path.splitext(filename)[0],
-                    'filename': filename
-                })
-    return completed_books
-
-# 初始化已完成书籍列表
-download_status['completed_books'] = load_completed_books()
+# 各下载任务的状态由scheduler维护，在init_app中创建
+scheduler = None
 
 # HTML模板
 HTML_TEMPLATE = '''
@@ -102,7 +82,7 @@ HTML_TEMPLATE = '''
             margin: 16px 0;
         }
 
-        .input-field input {
+        .input-field input, .input-field select {
             width: 100%;
             padding: 12px;
             border: 1px solid var(--md-sys-color-outline);
@@ -199,51 +179,242 @@ HTML_TEMPLATE = '''
                 <input type="text" id="book_id" placeholder="输入book_id"/>
             </div>
             <div class="input-field">
-                <input type="number" id="threads" value="8" min="1" max="16" placeholder="线程数"/>
+                <input type="number" id="threads" min="1" max="64" placeholder="单本书并发上限（留空为自动调节）"/>
+            </div>
+            <div class="input-field">
+                <select id="priority">
+                    <option value="normal">普通优先级</option>
+                    <option value="high">高优先级</option>
+                    <option value="low">低优先级</option>
+                </select>
+            </div>
+            <div class="input-field">
+                <select id="engine" onchange="onEngineChange()">
+                    <option value="thread">多线程引擎（最高64线程）</option>
+                    <option value="async">异步引擎（受全局并发预算限制）</option>
+                </select>
+            </div>
+            <div class="input-field">
+                <select id="transforms">
+                    <option value="">正文不做处理</option>
+                    <option value="normalize,strip_ads">整理段落、去除广告行</option>
+                    <option value="normalize,strip_ads,s2t">整理段落、去除广告行，并转为繁体（需要OpenCC）</option>
+                    <option value="normalize,strip_ads,t2s">整理段落、去除广告行，并转为简体（需要OpenCC）</option>
+                </select>
+            </div>
+            <div class="input-field">
+                <select id="format">
+                    <option value="epub">输出EPUB</option>
+                    <option value="txt">输出TXT</option>
+                    <option value="both">同时输出EPUB和TXT</option>
+                </select>
+            </div>
+            <div class="input-field">
+                <select id="split">
+                    <option value="">生成一个EPUB文件</option>
+                    <option value="volume">按卷分册</option>
+                    <option value="500">每500章一册</option>
+                    <option value="1000">每1000章一册</option>
+                </select>
+            </div>
+            <div class="input-field">
+                <label><input type="checkbox" id="update" style="width:auto"/> 仅更新新章节（适用于已下载过的连载书籍）</label>
+            </div>
+            <div class="input-field">
+                <textarea id="bulk_ids" rows="3" style="width:100%" placeholder="批量添加：每行或以逗号分隔一个book_id"></textarea>
             </div>
             <button class="button" onclick="addToQueue()">添加到队列</button>
+            <button class="button" onclick="addBulk()">批量添加</button>
+            <button class="button" onclick="updateAll()">全部更新</button>
         </div>
 
         <div class="card">
             <div id="status">未开始下载</div>
+            <div id="hosts" style="font-size:12px;color:var(--md-sys-color-outline)"></div>
             <div class="progress-container">
                 <div class="progress-bar" id="progress"></div>
             </div>
         </div>
 
-        <h2 class="section-title">下载队列</h2>
+        <h2 class="section-title">下载任务</h2>
         <div id="queue-list"></div>
 
+        <h2 class="section-title">全文搜索</h2>
+        <div class="card">
+            <div class="input-field">
+                <input type="text" id="search-q" placeholder="搜索已下载书籍的正文（多个关键词用空格分隔）"
+                       onkeydown="if(event.key === 'Enter') searchBooks()"/>
+            </div>
+            <button class="button" onclick="searchBooks()">搜索</button>
+            <div id="search-results"></div>
+        </div>
+
         <h2 class="section-title">已完成的书籍</h2>
+        <div class="card">
+            <div class="input-field">
+                <input type="text" id="library-q" placeholder="按书名或作者筛选" oninput="onLibraryFilter()"/>
+            </div>
+            <div class="input-field">
+                <select id="library-sort" onchange="loadLibrary(1)">
+                    <option value="mtime:desc">最近下载</option>
+                    <option value="name:asc">书名</option>
+                    <option value="author:asc">作者</option>
+                    <option value="chapters:desc">章节数</option>
+                    <option value="size:desc">文件大小</option>
+                </select>
+            </div>
+            <div id="library-info"></div>
+        </div>
         <div id="completed-list"></div>
+        <button class="button" id="library-prev" onclick="loadLibrary(libraryPage - 1)">上一页</button>
+        <button class="button" id="library-next" onclick="loadLibrary(libraryPage + 1)">下一页</button>
     </div>
 
     <script>
-        let lastUpdate = 0;
-        
         window.onload = function() {
-            checkStatus();
+            connectEvents();
         };
         
+        function onEngineChange() {
+            const engine = document.getElementById('engine').value;
+            const threads = document.getElementById('threads');
+            if(engine === 'async') {
+                // 单本书的并发不会超过全局并发预算
+                threads.max = state.summary ? state.summary.budget.total : 512;
+                if(threads.value) threads.value = Math.min(threads.value, threads.max);
+            } else {
+                threads.max = 64;
+                if(threads.value) threads.value = Math.min(threads.value, 64);
+            }
+        }
+        
         function addToQueue() {
             const bookId = document.getElementById('book_id').value;
             const threads = document.getElementById('threads').value;
+            const engine = document.getElementById('engine').value;
+            const update = document.getElementById('update').checked;
+            const priority = document.getElementById('priority').value;
+            const transforms = document.getElementById('transforms').value;
+            const split = document.getElementById('split').value;
+            const format = document.getElementById('format').value;
             fetch('/add_to_queue', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({book_id: bookId, threads: threads})
+                body: JSON.stringify({book_id: bookId, threads: threads, engine: engine, update: update, priority: priority,
+                                      transforms: transforms, split: split, format: format})
             })
             .then(response => response.json())
             .then(data => {
                 if(data.error) {
                     alert('错误: ' + data.error);
+                } else if(data.status === 'duplicate') {
+                    alert('该书已在队列中或最近已下载');
                 } else {
                     document.getElementById('book_id').value = '';
-                    checkStatus();
+                    if(!window.EventSource) checkStatus();
                 }
             });
         }
 
+        function addBulk() {
+            const bookIds = document.getElementById('bulk_ids').value;
+            fetch('/add_bulk', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({
+                    book_ids: bookIds,
+                    threads: document.getElementById('threads').value,
+                    engine: document.getElementById('engine').value,
+                    update: document.getElementById('update').checked,
+                    priority: document.getElementById('priority').value,
+                    transforms: document.getElementById('transforms').value,
+                    split: document.getElementById('split').value,
+                    format: document.getElementById('format').value
+                })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if(data.error) {
+                    alert('错误: ' + data.error);
+                } else {
+                    alert(`已添加 ${data.count} 个任务，跳过重复 ${data.duplicates} 个，无效 ${data.invalid} 个`);
+                    document.getElementById('bulk_ids').value = '';
+                    if(!window.EventSource) checkStatus();
+                }
+            });
+        }
+
+        function updateAll() {
+            const threads = document.getElementById('threads').value;
+            const engine = document.getElementById('engine').value;
+            fetch('/update_all', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({threads: threads, engine: engine})
+            })
+            .then(response => response.json())
+            .then(data => {
+                if(data.error) {
+                    alert('错误: ' + data.error);
+                } else {
+                    alert(`已添加 ${data.count} 本书的更新任务`);
+                    if(!window.EventSource) checkStatus();
+                }
+            });
+        }
+
+        const STATE_LABELS = {
+            queued: '排队中', running: '下载中', done: '已完成', failed: '失败', skipped: '无需更新'
+        };
+        const PRIORITY_LABELS = {'-1': '低', '0': '普通', '1': '高'};
+        const FORMAT_LABELS = {txt: 'TXT', both: 'EPUB和TXT'};
+
+        function renderJob(job) {
+            const div = document.createElement('div');
+            div.className = 'queue-item' + (job.state === 'running' ? ' active' : '');
+            const name = job.book_name || `Book ID: ${job.book_id}`;
+            const concurrency = job.engine === 'async' ? `异步 ${job.max_workers} 并发` : `${job.max_workers} 线程`;
+            const mode = (job.update ? '，仅更新' : '') +
+                (job.transforms && job.transforms.length ? `，正文处理 ${job.transforms.join('+')}` : '') +
+                (job.split ? `，${job.split === 'volume' ? '按卷' : '每' + job.split + '章'}分册` : '') +
+                (job.format && job.format !== 'epub' ? `，输出${FORMAT_LABELS[job.format] || job.format}` : '');
+            let text = `${name} [${STATE_LABELS[job.state]}] (${concurrency}，${PRIORITY_LABELS[job.priority] || job.priority}优先级${mode})`;
+            if(job.state === 'running' && job.total_chapters) {
+                const percent = (job.downloaded / job.total_chapters * 100).toFixed(1);
+                const eta = job.eta === null ? '' : `，剩余约 ${formatEta(job.eta)}`;
+                text += ` - ${job.downloaded}/${job.total_chapters} (${percent}%)，` +
+                    `${job.chapters_per_sec} 章/秒，${(job.bytes_per_sec / 1024).toFixed(1)} KB/秒，并发 ${job.in_flight}${eta}`;
+            }
+            if(job.transform_seconds && Object.keys(job.transform_seconds).length) {
+                text += ' - 正文处理耗时 ' + Object.entries(job.transform_seconds)
+                    .map(([name, seconds]) => `${name} ${seconds}秒`).join('、');
+            }
+            if(job.error) {
+                text += ` - 错误: ${job.error}`;
+            }
+            if(job.missing && job.missing.length > 0) {
+                text += ` - 缺失 ${job.missing.length} 章: ${job.missing.slice(0, 5).map(c => c.title).join('、')}`;
+            }
+            div.textContent = text;
+            if(job.state === 'running') {
+                const bar = document.createElement('div');
+                bar.className = 'progress-container';
+                const fill = document.createElement('div');
+                fill.className = 'progress-bar';
+                fill.style.width = job.total_chapters ? (job.downloaded / job.total_chapters * 100) + '%' : '0';
+                bar.appendChild(fill);
+                div.appendChild(bar);
+            }
+            return div;
+        }
+
+        function formatEta(seconds) {
+            if(seconds < 60) return `${seconds}秒`;
+            const minutes = Math.floor(seconds / 60);
+            if(minutes < 60) return `${minutes}分${seconds % 60}秒`;
+            return `${Math.floor(minutes / 60)}小时${minutes % 60}分`;
+        }
+
         function deleteBook(filename) {
             if(confirm('确定要删除这本书吗？')) {
                 fetch('/delete_book/' + filename, {method: 'DELETE'})
@@ -251,7 +422,7 @@ HTML_TEMPLATE = '''
                 .then(data => {
                     if(data.success) {
                         alert('删除成功');
-                        checkStatus();
+                        if(!window.EventSource) checkStatus();
                     } else {
                         alert('删除失败: ' + data.error);
                     }
@@ -259,77 +430,236 @@ HTML_TEMPLATE = '''
             }
         }
         
+        // 页面状态由/events推送维护：连接时收到完整快照，之后只收到变化的部分
+        const state = {jobs: {}, order: {jobs: [], queue: []}, summary: null, hosts: {}, library: null};
+        let renderPending = false;
+
+        function connectEvents() {
+            if(!window.EventSource) {
+                checkStatus();
+                return;
+            }
+            const source = new EventSource('/events');
+            source.addEventListener('snapshot', e => {
+                const data = JSON.parse(e.data);
+                state.jobs = {};
+                data.jobs.concat(data.queue).forEach(job => state.jobs[job.id] = job);
+                state.order = {jobs: data.jobs.map(job => job.id), queue: data.queue.map(job => job.id)};
+                state.summary = data.summary;
+                state.hosts = data.hosts;
+                setLibrary(data.library);
+                scheduleRender();
+            });
+            source.addEventListener('job', e => {
+                const delta = JSON.parse(e.data);
+                state.jobs[delta.id] = Object.assign(state.jobs[delta.id] || {}, delta);
+                scheduleRender();
+            });
+            source.addEventListener('order', e => {
+                state.order = JSON.parse(e.data);
+                const ids = new Set(state.order.jobs.concat(state.order.queue));
+                Object.keys(state.jobs).forEach(id => {
+                    if(!ids.has(Number(id))) delete state.jobs[id];
+                });
+                scheduleRender();
+            });
+            ['summary', 'hosts'].forEach(name => {
+                source.addEventListener(name, e => {
+                    state[name] = JSON.parse(e.data);
+                    scheduleRender();
+                });
+            });
+            source.addEventListener('library', e => setLibrary(JSON.parse(e.data)));
+        }
+
+        // 不支持EventSource的浏览器退回到轮询/status
         function checkStatus() {
             fetch('/status')
                 .then(response => response.json())
                 .then(data => {
-                    const status = document.getElementById('status');
-                    const progress = document.getElementById('progress');
-                    const queueList = document.getElementById('queue-list');
-                    const completedList = document.getElementById('completed-list');
-                    
-                    queueList.innerHTML = '';
-                    data.queue.forEach((item, index) => {
-                        const div = document.createElement('div');
-                        div.className = 'queue-item' + (index === data.queue_position && data.is_downloading ? ' active' : '');
-                        div.textContent = `${index + 1}. Book ID: ${item.book_id} (${item.threads} 线程)`;
-                        queueList.appendChild(div);
-                    });
-                    
-                    completedList.innerHTML = '';
-                    data.completed_books.forEach(book => {
-                        const card = document.createElement('div');
-                        card.className = 'book-card';
-                        
-                        const content = document.createElement('div');
-                        content.className = 'book-card-content';
-                        content.textContent = book.name;
-                        
-                        const actions = document.createElement('div');
-                        actions.className = 'book-card-actions';
-                        
-                        const downloadBtn = document.createElement('button');
-                        downloadBtn.className = 'button';
-                        downloadBtn.textContent = '下载';
-                        downloadBtn.onclick = () => window.location.href = '/download/' + book.filename;
-                        
-                        const deleteBtn = document.createElement('button');
-                        deleteBtn.className = 'button';
-                        deleteBtn.style.backgroundColor = '#DC362E';
-                        deleteBtn.textContent = '删除';
-                        deleteBtn.onclick = () => deleteBook(book.filename);
-                        
-                        actions.appendChild(downloadBtn);
-                        actions.appendChild(deleteBtn);
-                        
-                        card.appendChild(content);
-                        card.appendChild(actions);
-                        completedList.appendChild(card);
-                    });
-                    
+                    state.jobs = {};
+                    data.jobs.concat(data.queue).forEach(job => state.jobs[job.id] = job);
+                    state.order = {jobs: data.jobs.map(job => job.id), queue: data.queue.map(job => job.id)};
+                    state.summary = {is_downloading: data.is_downloading, queue_length: data.queue_length, budget: data.budget};
+                    state.hosts = data.hosts;
+                    setLibrary(data.library);
+                    render();
+                    if(data.is_downloading || data.queue_length > 0) {
+                        setTimeout(checkStatus, 1000);
+                    }
+                });
+        }
+
+        function scheduleRender() {
+            // 同一批推送事件只重绘一次
+            if(!renderPending) {
+                renderPending = true;
+                requestAnimationFrame(() => {
+                    renderPending = false;
+                    render();
+                });
+            }
+        }
+
+        // 书库只在版本变化时重新加载当前页，每页最多50本
+        const LIBRARY_PAGE_SIZE = 50;
+        let libraryPage = 1;
+        let libraryFilterTimer = null;
+
+        function setLibrary(library) {
+            if(!state.library || state.library.version !== library.version) {
+                state.library = library;
+                loadLibrary(libraryPage);
+            }
+        }
+
+        function onLibraryFilter() {
+            clearTimeout(libraryFilterTimer);
+            libraryFilterTimer = setTimeout(() => loadLibrary(1), 300);
+        }
+
+        function loadLibrary(page) {
+            const [sort, order] = document.getElementById('library-sort').value.split(':');
+            const params = new URLSearchParams({
+                page: Math.max(page, 1),
+                page_size: LIBRARY_PAGE_SIZE,
+                q: document.getElementById('library-q').value,
+                sort: sort,
+                order: order
+            });
+            fetch('/library?' + params)
+                .then(response => response.json())
+                .then(data => {
+                    if(data.error) return;
+                    libraryPage = data.page;
+                    renderLibrary(data);
+                });
+        }
+
+        function searchBooks() {
+            const q = document.getElementById('search-q').value.trim();
+            const results = document.getElementById('search-results');
+            if(!q) {
+                results.innerHTML = '';
+                return;
+            }
+            fetch('/search?' + new URLSearchParams({q: q, limit: 50}))
+                .then(response => response.json())
+                .then(data => {
+                    results.innerHTML = '';
                     if(data.error) {
-                        alert('错误: ' + data.error);
+                        results.textContent = '搜索失败: ' + data.error;
                         return;
                     }
-                    
-                    if(data.last_update > lastUpdate) {
-                        lastUpdate = data.last_update;
-                        
-                        if(data.is_downloading) {
-                            const percent = (data.downloaded / data.total_chapters * 100).toFixed(1);
-                            status.textContent = `正在下载 ${data.current_book}: ${data.downloaded}/${data.total_chapters} (${percent}%)`;
-                            progress.style.width = percent + '%';
-                            setTimeout(checkStatus, 1000);
-                        } else if(data.downloaded > 0) {
-                            status.textContent = '下载完成！';
-                            progress.style.width = '100%';
-                            setTimeout(checkStatus, 1000);
-                        }
-                    } else if(data.is_downloading || data.queue.length > 0) {
-                        setTimeout(checkStatus, 1000);
+                    if(data.hits.length === 0) {
+                        results.textContent = '没有找到匹配的章节';
+                        return;
+                    }
+                    data.hits.forEach(hit => {
+                        const div = document.createElement('div');
+                        div.className = 'queue-item';
+                        const title = document.createElement('div');
+                        title.textContent = `${hit.book_name} - ${hit.title}`;
+                        const snippet = document.createElement('div');
+                        snippet.style.fontSize = '14px';
+                        // 摘要由服务端转义，只包含<mark>标签
+                        snippet.innerHTML = hit.snippet;
+                        div.appendChild(title);
+                        div.appendChild(snippet);
+                        results.appendChild(div);
+                    });
+                    if(data.has_more) {
+                        const more = document.createElement('div');
+                        more.textContent = '结果较多，只显示前50条，请增加关键词缩小范围';
+                        results.appendChild(more);
                     }
                 });
         }
+
+        function formatSize(size) {
+            return size >= 1024 * 1024 ? (size / 1024 / 1024).toFixed(1) + ' MB' : (size / 1024).toFixed(0) + ' KB';
+        }
+
+        function renderLibrary(data) {
+            const pages = Math.max(Math.ceil(data.total / data.page_size), 1);
+            document.getElementById('library-info').textContent = `共 ${data.total} 本，第 ${data.page}/${pages} 页`;
+            document.getElementById('library-prev').disabled = data.page <= 1;
+            document.getElementById('library-next').disabled = data.page >= pages;
+
+            const completedList = document.getElementById('completed-list');
+            completedList.innerHTML = '';
+            data.books.forEach(book => {
+                const card = document.createElement('div');
+                card.className = 'book-card';
+
+                const content = document.createElement('div');
+                content.className = 'book-card-content';
+                const details = [book.author, book.chapters ? `${book.chapters} 章` : null, formatSize(book.size),
+                    new Date(book.mtime * 1000).toLocaleString()].filter(Boolean).join(' · ');
+                content.textContent = `${book.name}（${details}）`;
+
+                const actions = document.createElement('div');
+                actions.className = 'book-card-actions';
+
+                const downloadBtn = document.createElement('button');
+                downloadBtn.className = 'button';
+                downloadBtn.textContent = '下载';
+                downloadBtn.onclick = () => window.location.href = '/download/' + encodeURIComponent(book.filename);
+
+                const deleteBtn = document.createElement('button');
+                deleteBtn.className = 'button';
+                deleteBtn.style.backgroundColor = '#DC362E';
+                deleteBtn.textContent = '删除';
+                deleteBtn.onclick = () => deleteBook(book.filename);
+
+                actions.appendChild(downloadBtn);
+                actions.appendChild(deleteBtn);
+
+                card.appendChild(content);
+                card.appendChild(actions);
+                completedList.appendChild(card);
+            });
+        }
+
+        function render() {
+            const status = document.getElementById('status');
+            const progress = document.getElementById('progress');
+            const queueList = document.getElementById('queue-list');
+            const jobs = state.order.jobs.map(id => state.jobs[id]).filter(Boolean);
+            const queue = state.order.queue.map(id => state.jobs[id]).filter(Boolean);
+
+            queueList.innerHTML = '';
+            jobs.concat(queue).forEach(job => {
+                queueList.appendChild(renderJob(job));
+            });
+            if(state.summary && state.summary.queue_length > queue.length) {
+                const more = document.createElement('div');
+                more.className = 'queue-item';
+                more.textContent = `还有 ${state.summary.queue_length - queue.length} 个任务在排队`;
+                queueList.appendChild(more);
+            }
+
+            document.getElementById('hosts').textContent = Object.entries(state.hosts).map(([host, info]) => {
+                const latency = info.latency_ms === null ? '-' : info.latency_ms + 'ms';
+                const cooldown = info.cooldown > 0 ? `，暂停 ${info.cooldown}秒` : '';
+                return `${host}: 并发上限 ${info.limit}，进行中 ${info.in_flight}，延迟 ${latency}，成功率 ${(info.success_rate * 100).toFixed(0)}%${cooldown}`;
+            }).join(' | ');
+
+            const running = jobs.filter(job => job.state === 'running');
+            if(running.length > 0) {
+                const downloaded = running.reduce((sum, job) => sum + job.downloaded, 0);
+                const total = running.reduce((sum, job) => sum + job.total_chapters, 0);
+                const percent = total ? (downloaded / total * 100).toFixed(1) : 0;
+                const budget = state.summary ? state.summary.budget : {in_use: 0, total: 0};
+                const queued = state.summary ? state.summary.queue_length : queue.length;
+                status.textContent = `正在下载 ${running.length} 本书，排队 ${queued} 本，` +
+                    `全局并发 ${budget.in_use}/${budget.total}: ${downloaded}/${total} (${percent}%)`;
+                progress.style.width = percent + '%';
+            } else if(jobs.length > 0) {
+                status.textContent = '下载完成！';
+                progress.style.width = '100%';
+            }
+        }
     </script>
 </body>
 </html>
@@ -341,251 +671,311 @@ def home():
 
 @app.route('/status')
 def status():
-    # 每次请求状态时重新加载已完成书籍列表
-    download_status['completed_books'] = load_completed_books()
-    return jsonify(download_status)
+    """完整状态快照；页面通过/events接收推送，这里只返回内存中的状态"""
+    return jsonify(dict(
+        scheduler.snapshot(),
+        library=get_catalog().summary(),
+        http=http_client.get_stats(),
+        hosts=host_control.get_stats(),
+        endpoints=endpoints.get_stats(),
+        cache=get_cache().stats()
+    ))
+
+def event_snapshot():
+    snapshot = scheduler.snapshot()
+    return {
+        'jobs': snapshot['jobs'],
+        'queue': snapshot['queue'],
+        'summary': {
+            'is_downloading': snapshot['is_downloading'],
+            'queue_length': snapshot['queue_length'],
+            'budget': snapshot['budget']
+        },
+        'hosts': host_control.get_stats(),
+        'library': get_catalog().summary()
+    }
+
+@app.route('/events')
+def event_stream():
+    """SSE推送任务进度、任务状态和书库变化"""
+    return Response(
+        stream_with_context(events.stream(event_snapshot)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/library')
+def library():
+    """分页查询书库：page、page_size、q（书名/作者筛选）、sort、order"""
+    catalog = get_catalog()
+    # 只在download目录mtime变化时扫描目录，发现手动放入或删除的文件
+    catalog.reconcile()
+    try:
+        return jsonify(catalog.query(
+            request.args.get('page', 1),
+            request.args.get('page_size', 50),
+            request.args.get('q', '').strip(),
+            request.args.get('sort', 'mtime'),
+            request.args.get('order', 'desc')
+        ))
+    except ValueError:
+        return jsonify({'error': '无效的分页参数'})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/search')
+def search():
+    """全文搜索：q为空格分隔的关键词，返回命中的书籍、章节和摘要"""
+    q = request.args.get('q', '').strip()
+    try:
+        return jsonify(get_index().search(
+            q, request.args.get('limit', 20), request.args.get('offset', 0)
+        ))
+    except ValueError:
+        return jsonify({'error': '无效的分页参数'})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus文本格式的运行指标"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/download/<filename>')
 def download_file(filename):
+    # 以点开头的是生成中的临时文件和缓存目录，不对外提供
+    if filename.startswith('.'):
+        return jsonify({'error': '文件不存在'}), 404
     return send_from_directory('download', filename, as_attachment=True)
 
+def stream_file_range(f, start, end):
+    """按块读取已打开文件的[start, end)，读完后关闭文件"""
+    try:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(TXT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+@app.route('/txt/<book_id>')
+def txt_file(book_id):
+    """流式输出已完成书籍的TXT，不把整个文件读入内存；chapter为章节序号（从0开始）时只输出这一章"""
+    manifest = load_manifest(book_id)
+    names = [name for name in manifest_files(manifest) if name.endswith('.txt')] if manifest else []
+    if not names:
+        return jsonify({'error': '该书没有生成TXT文件'}), 404
+    try:
+        # 打开之后文件被新的下载替换也不影响本次输出，读到的总是同一个完整的文件
+        f = open(os.path.join('download', names[0]), 'rb')
+    except OSError:
+        return jsonify({'error': '文件不存在'}), 404
+    start, end = 0, os.fstat(f.fileno()).st_size
+    disposition = f"attachment; filename*=UTF-8''{quote(names[0])}"
+    if 'chapter' in request.args:
+        ranges = load_txt_ranges(book_id) or []
+        try:
+            idx = int(request.args['chapter'])
+        except ValueError:
+            idx = -1
+        if not 0 <= idx < len(ranges) or not ranges[idx] or ranges[idx][1] > end:
+            f.close()
+            return jsonify({'error': '章节不存在'}), 404
+        start, end = ranges[idx]
+        disposition = 'inline'
+    return Response(
+        stream_file_range(f, start, end),
+        mimetype='text/plain; charset=utf-8',
+        headers={'Content-Length': str(end - start), 'Content-Disposition': disposition}
+    )
+
 @app.route('/delete_book/<filename>', methods=['DELETE'])
 def delete_book(filename):
     try:
         file_path = os.path.join('download', filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            # 书籍没有下载记录后，它的章节重新参与缓存淘汰
+            for manifest in delete_manifests_for(filename):
+                get_cache().unpin(chapter['item_id'] for chapter in manifest['chapters'])
+            get_catalog().remove(filename)
+            get_index().remove(filename)
+            events.notify()
             return jsonify({'success': True})
         return jsonify({'success': False, 'error': '文件不存在'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def parse_priority(value):
+    """优先级可以是low/normal/high或整数"""
+    if value in PRIORITIES:
+        return PRIORITIES[value]
+    return max(-2, min(int(value), 2))
+
+def job_options(data):
+    """解析任务参数（book_id以外），参数无效时抛出异常"""
+    # threads为单本书的并发上限，留空时自动；实际并发由全局预算和主机控制器决定
+    try:
+        threads = int(data.get('threads') or AUTO_MAX_WORKERS)
+    except (TypeError, ValueError):
+        raise Exception('无效的并发上限')
+    engine = data.get('engine', 'thread')
+    if engine not in ENGINES:
+        raise Exception(f'未知的下载引擎：{engine}')
+    threads = max(1, min(threads, max_workers_limit(engine)))
+    try:
+        priority = parse_priority(data.get('priority', 0))
+    except (TypeError, ValueError):
+        raise Exception('无效的优先级')
+    try:
+        max_attempts = max(1, int(data.get('max_attempts') or MAX_ATTEMPTS))
+    except (TypeError, ValueError):
+        raise Exception('无效的重试次数')
+    options = {
+        'max_workers': threads,
+        'priority': priority,
+        'engine': engine,
+        'update': bool(data.get('update', False)),
+        'max_attempts': max_attempts
+    }
+    # 没有传入的正文处理、分册方式和输出格式使用默认值，更新任务则沿用上次下载时的设置（见new_job）
+    if data.get('transforms') is not None:
+        # transforms为正文处理步骤的列表，或以逗号分隔的文本
+        transforms = data['transforms']
+        if isinstance(transforms, str):
+            transforms = transforms.split(',')
+        options['transforms'] = validate_transforms(str(name).strip() for name in transforms)
+    if data.get('split') is not None:
+        # split为分册方式：空、volume或每册章节数
+        options['split'] = parse_split(data['split'])
+    if data.get('format') is not None:
+        if data['format'] not in FORMATS:
+            raise Exception(f"未知的输出格式：{data['format']}")
+        options['format'] = data['format']
+    return options
+
+def duplicate_book_ids():
+    """排队中、下载中和最近已完成的book_id，不会被重复加入队列"""
+    return scheduler.book_ids() | get_job_store().recent_book_ids()
+
 @app.route('/add_to_queue', methods=['POST'])
 def add_to_queue():
     data = request.json
-    book_id = data.get('book_id')
-    threads = int(data.get('threads', 8))
-    
+    book_id = str(data.get('book_id') or '').strip()
     if not book_id:
         return jsonify({'error': '请输入book_id'})
-    
-    download_status['queue'].append({
-        'book_id': book_id,
-        'threads': threads
-    })
-    
-    # 如果当前没有下载任务，启动下载
-    if not download_status['is_downloading']:
-        threading.Thread(target=process_queue).start()
-    
-    return jsonify({'status': 'added'})
-
-def process_queue():
-    while download_status['queue_position'] < len(download_status['queue']):
-        current_item = download_status['queue'][download_status['queue_position']]
-        
-        # 重置状态
-        download_status.update({
-            'total_chapters': 0,
-            'downloaded': 0,
-            'current_book': '',
-            'is_downloading': True,
-            'error': None,
-            'last_update': int(time.time())
-        })
-        
-        # 下载当前书籍
-        download_and_build_epub(current_item['book_id'], current_item['threads'])
-        
-        # 移动到下一本书
-        download_status['queue_position'] += 1
-        download_status['last_update'] = int(time.time())
-    
-    # 队列处理完成，重置状态
-    download_status['queue'] = []
-    download_status['queue_position'] = 0
-    download_status['is_downloading'] = False
-    download_status['last_update'] = int(time.time())
-
-def get_chapter_infos(book_id):
-    """获取章节信息（包含item_id和标题）"""
-    url = "https://api.cenguigui.cn/api/tomato/api/all_items.php"
-    params = {"book_id": book_id}
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-    
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get("code") != 0:
-            raise Exception(f"API错误：{data.get('message')}")
-        
-        chapters = []
-        # 遍历每个卷中的章节
-        for volume in data["data"].get("chapterListWithVolume", []):
-            for chapter in volume:
-                chapters.append({
-                    "item_id": chapter["itemId"],
-                    "title": chapter["title"].strip()
-                })
-        return chapters
-    
+        options = job_options(data)
     except Exception as e:
-        raise Exception(f"获取章节列表失败：{str(e)}")
-
-def download_chapter(item_id):
-    """下载章节内容并获取元数据"""
-    url = f"https://fanqie.tutuxka.top/content.php?item_id={item_id}"
-    
+        return jsonify({'error': str(e)})
+
+    # force为真时允许重复下载
+    if not data.get('force') and book_id in duplicate_book_ids():
+        return jsonify({'status': 'duplicate', 'book_id': book_id})
+
+    job = scheduler.submit(new_job(book_id, **options))
+    return jsonify({'status': 'added', 'job_id': job.id})
+
+@app.route('/add_bulk', methods=['POST'])
+def add_bulk():
+    """批量加入任务：book_ids为列表，或以空白、逗号分隔的文本；同一请求中的任务一次写入"""
+    data = request.json or {}
+    book_ids = data.get('book_ids') or []
+    if isinstance(book_ids, str):
+        book_ids = re.split(r'[\s,，]+', book_ids)
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get("code") == 200:
-            content_data = data.get("data", {})
-            return {
-                "content": content_data.get("content", ""),
-                "author": content_data.get("author", "未知作者"),
-                "book_name": content_data.get("book_name", "未知书名"),
-                "pic": content_data.get("pic", "")
-            }
-        else:
-            return None
+        options = job_options(data)
     except Exception as e:
-        print(f"下载章节 {item_id} 失败: {str(e)}")
-        return None
-
-def sanitize_filename(name):
-    """去除文件名中的非法字符"""
-    return re.sub(r'[\\/*?:"<>|]', '', name).strip()
-
-def download_and_build_epub(book_id, thread_count=8):
+        return jsonify({'error': str(e)})
+
+    skip = set() if data.get('force') else duplicate_book_ids()
+    jobs = []
+    duplicates = invalid = 0
+    for book_id in book_ids:
+        book_id = str(book_id).strip()
+        if not book_id:
+            continue
+        if not book_id.isdigit():
+            invalid += 1
+        elif book_id in skip:
+            duplicates += 1
+        else:
+            skip.add(book_id)
+            jobs.append(new_job(book_id, **options))
+    scheduler.submit_many(jobs)
+    return jsonify({'status': 'added', 'count': len(jobs), 'duplicates': duplicates, 'invalid': invalid})
+
+@app.route('/update_all', methods=['POST'])
+def update_all():
+    """为已完成列表中所有有下载记录的书籍添加增量更新任务"""
+    data = request.json or {}
     try:
-        print("正在获取章节信息...")
-        chapters = get_chapter_infos(book_id)
-        total_chapters = len(chapters)
-        print(f"共发现 {total_chapters} 个章节")
-        
-        download_status['total_chapters'] = total_chapters
-        download_status['last_update'] = int(time.time())
-
-        if total_chapters == 0:
-            raise Exception("没有找到任何章节")
-
-        # 初始化章节内容存储
-        chapter_contents = [None] * total_chapters
-
-        # 获取元数据（尝试前3个章节）
-        metadata = {"author": "未知作者", "book_name": "未知书名", "pic": ""}
-        for i in range(min(3, total_chapters)):
-            result = download_chapter(chapters[i]["item_id"])
-            if result:
-                metadata["author"] = result.get("author", metadata["author"])
-                metadata["book_name"] = result.get("book_name", metadata["book_name"])
-                metadata["pic"] = result.get("pic", metadata["pic"])
-                download_status['current_book'] = metadata["book_name"]
-                download_status['last_update'] = int(time.time())
-                break
-
-        # 多线程下载所有章节
-        print("开始下载章节内容...")
-        with ThreadPoolExecutor(max_workers=thread_count) as executor:
-            futures = []
-            for idx in range(total_chapters):
-                future = executor.submit(
-                    download_chapter, 
-                    chapters[idx]["item_id"]
-                )
-                futures.append((idx, future))
-
-            for idx, future in futures:
-                result = future.result()
-                if result:
-                    chapter_contents[idx] = {
-                        "title": chapters[idx]["title"],
-                        "content": result["content"]
-                    }
-                time.sleep(0.1)
-                download_status['downloaded'] += 1
-                download_status['last_update'] = int(time.time())
-
-        # 创建EPUB
-        print("正在生成EPUB文件...")
-        book = epub.EpubBook()
-        
-        # 设置元数据
-        book.set_title(metadata["book_name"])
-        book.add_author(metadata["author"])
-        book.set_language('zh')
-
-        # 下载并添加封面
-        cover_data = None
-        if metadata["pic"]:
-            try:
-                response = requests.get(metadata["pic"], timeout=10)
-                if response.status_code == 200:
-                    cover_data = response.content
-            except Exception as e:
-                print(f"封面下载失败: {str(e)}")
-
-        if cover_data:
-            try:
-                book.set_cover('cover.jpg', cover_data)
-            except Exception as e:
-                print(f"封面添加失败: {str(e)}")
-
-        # 创建章节内容
-        spine = ['nav']
-        chapters_epub = []
-
-        for idx, content_info in enumerate(chapter_contents):
-            if not content_info or not content_info["content"]:
-                continue
-
-            chapter = epub.EpubHtml(
-                title=content_info["title"],
-                file_name=f'chapter_{idx}.xhtml',
-                lang='zh'
-            )
-            
-            # 处理换行符并使用BeautifulSoup清理内容
-            content = content_info["content"].replace("\n", "<br/>")
-            soup = BeautifulSoup(
-                f"<h1>{content_info['title']}</h1>{content}", 
-                'html.parser'
-            )
-            chapter.content = str(soup).encode('utf-8')
-            
-            book.add_item(chapter)
-            chapters_epub.append(chapter)
-            spine.append(chapter)
-
-        # 设置目录和导航
-        book.toc = tuple(chapters_epub)
-        book.add_item(epub.EpubNcx())
-        book.add_item(epub.EpubNav())
-        book.spine = spine
-
-        # 生成文件名
-        filename = sanitize_filename(metadata["book_name"]) or f"book_{book_id}"
-        epub_path = os.path.join('download', f"{filename}.epub")
-        epub.write_epub(epub_path, book, {})
-        print(f"EPUB文件已保存为：{epub_path}")
-        
-        # 更新已完成列表
-        download_status['completed_books'] = load_completed_books()
-
+        # 批量更新使用低优先级，不挤占手动添加的任务
+        options = job_options(dict(data, priority='low', update=True))
     except Exception as e:
-        error_msg = str(e)
-        print(f"程序出错：{error_msg}")
-        download_status['error'] = error_msg
-    finally:
-        download_status['last_update'] = int(time.time())
+        return jsonify({'error': str(e)})
+
+    queued = scheduler.book_ids()
+    jobs = []
+    for book in list_manifests():
+        if book['book_id'] in queued:
+            continue
+        if not os.path.exists(os.path.join('download', book['filename'])):
+            continue
+        jobs.append(new_job(book['book_id'], **options))
+    scheduler.submit_many(jobs)
+
+    return jsonify({'status': 'added', 'count': len(jobs)})
+
+# 队列深度、并发和缓存等当前值，在输出/metrics时读取
+metrics.Gauge('fanqie_jobs', "任务数，按状态", lambda: {
+    (state,): count for state, count in scheduler.counts().items()
+}, ('state',))
+metrics.Gauge('fanqie_budget_in_use', "已占用的全局并发名额", lambda: scheduler.budget.stats()['in_use'])
+metrics.Gauge('fanqie_budget_total', "全局并发名额", lambda: scheduler.budget.total)
+metrics.Gauge('fanqie_host_concurrency_limit', "各上游主机当前的并发上限", lambda: {
+    (host,): info['limit'] for host, info in host_control.get_stats().items()
+}, ('host',))
+metrics.Gauge('fanqie_host_in_flight', "各上游主机进行中的请求数", lambda: {
+    (host,): info['in_flight'] for host, info in host_control.get_stats().items()
+}, ('host',))
+metrics.Gauge('fanqie_endpoint_healthy', "各接口地址是否可用（1可用，0暂停使用）", lambda: {
+    (role, info['url']): int(info['healthy'])
+    for role, pool in endpoints.get_stats().items() for info in pool
+}, ('role', 'url'))
+metrics.Gauge('fanqie_cache_bytes', "章节缓存占用字节数", lambda: get_cache().stats()['bytes'])
+
+def init_app(global_concurrency=GLOBAL_CONCURRENCY, max_active=MAX_ACTIVE_JOBS):
+    """提供服务前调用一次：同步书库目录，创建任务调度器和连接池
+
+    不在导入时执行：进程池以spawn方式启动处理进程时会重新导入主模块（python webui.py启动时即本模块），
+    否则每个处理进程都会整理书库、清理任务记录并创建调度器和连接池。
+    """
+    global scheduler
+    # 已完成的书籍记录在书库目录中（启动时与download目录同步）
+    get_catalog()
+    scheduler = Scheduler(run_job, global_concurrency, max_active, on_change=events.notify, store=get_job_store())
+    # 多本书同时下载时，每主机连接池和每主机并发上限按全局并发预算分配
+    http_client.get_session(scheduler.budget.total)
+    host_control.set_max_limit(scheduler.budget.total)
+
+def resume_jobs():
+    """继续上次退出时未完成的任务"""
+    jobs = scheduler.resume()
+    if jobs:
+        print(f"恢复了 {len(jobs)} 个未完成的任务")
 
 if __name__ == "__main__":
-    webbrowser.open('http://127.0.0.1:5000')
+    # 开发模式；部署时使用 python cli.py serve
+    # debug模式下自动重载的父进程只负责监视文件，只在实际提供服务的子进程中恢复任务
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        init_app()
+        resume_jobs()
+    else:
+        import webbrowser
+        webbrowser.open('http://127.0.0.1:5000')
     app.run(debug=True)